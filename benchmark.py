@@ -0,0 +1,448 @@
+"""
+Profile Processor Benchmarks
+----------------------------
+
+Times how long the processor takes to get going, each measurement in a fresh interpreter so nothing is already
+imported or loaded:
+
+    python3 benchmark.py startup --repeat 5 --output startup.json
+
+reports how long `import profile_processor` takes and which heavy libraries (spaCy, Presidio, geopy) that import pulls
+in - none of them should be loaded until a stage needs them. Given recorded fixtures (see nia_api_stub.py), it also
+times a first full analysis against the stub server (as the processor runs it, with empty caches), from interpreter
+start to the report being ready:
+
+    python3 benchmark.py startup --fixtures fixtures --start-date 2021-02-01 --end-date 2021-02-08
+
+It also times each stage of the pipeline - fetching (from the stub server), CorpusBuilder, HansardToMemberConnector,
+AnalyticsCreator, DiscreteAnalyticsCreator and building the report - on a synthetic corpus of any size, and measures
+the memory each stage allocates with tracemalloc:
+
+    python3 benchmark.py pipeline --days 20 --speeches-per-day 300 --members 90 --repeat 3 --output pipeline.json
+
+The synthetic Hansard and Members responses are written as stub fixtures (kept in --fixtures if given, so they can be
+served with nia_api_stub.py too). Sentiment needs the spaCy model; loading it is timed as a stage of its own, and every
+run scores against an empty NLPResultCache.
+
+Results are printed (or written to --output) as JSON, along with the commit they were run on, so runs can be compared
+over time.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+import build_hansard_corpus
+import mla_profiling
+import nia_api_stub
+import profile_analysis
+import profile_processor_with_imports
+import speaker_to_profile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Libraries that are slow to import or load models, and so should only come in when a stage needs them.
+HEAVY_MODULES = ["spacy", "spacytextblob", "presidio_analyzer", "presidio_anonymizer", "geopy"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import profile_processor
+import_seconds = time.perf_counter() - start
+print(json.dumps({"import_seconds": import_seconds,
+                  "heavy_modules_loaded": sorted(m for m in %r if m in sys.modules)}))
+"""
+
+FIRST_ANALYSIS_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import profile_processor
+import_seconds = time.perf_counter() - start
+rprt = profile_processor.run_default_analysis(profile_processor.processor().make_report(), %r, %r)
+rprt.compile()
+print(json.dumps({"import_seconds": import_seconds, "analysis_seconds": time.perf_counter() - start}))
+"""
+
+
+def run_in_fresh_interpreter(script, env=None):
+    """Runs script in a new Python process, returning its (JSON) last line of output and the wall time of the whole
+    process, interpreter start-up included."""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", script], cwd=REPO_DIR, env=env, capture_output=True, text=True,
+                               check=True)
+    wall_seconds = time.perf_counter() - start
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["wall_seconds"] = wall_seconds
+    return result
+
+
+def summarise(runs, key):
+    values = [run[key] for run in runs]
+    return {"min": min(values), "median": statistics.median(values), "max": max(values)}
+
+
+def benchmark_import(repeat):
+    runs = [run_in_fresh_interpreter(IMPORT_SCRIPT % (HEAVY_MODULES,)) for _ in range(repeat)]
+    return {
+        "import_seconds": summarise(runs, "import_seconds"),
+        "wall_seconds": summarise(runs, "wall_seconds"),
+        "heavy_modules_loaded": runs[-1]["heavy_modules_loaded"],
+    }
+
+
+def benchmark_first_analysis(fixtures_dir, start_date, end_date, repeat):
+    """Each run gets an empty cache directory of its own (removed afterwards), so every run really is a first analysis
+    - nothing is read from an earlier run's caches - and the user's own .nia_cache is left alone."""
+    runs = []
+    with nia_api_stub.StubServer(fixtures_dir) as server:
+        for _ in range(repeat):
+            cache_dir = tempfile.mkdtemp(prefix="nia-cache-")
+            try:
+                env = dict(os.environ, NIA_API_ROOT=server.api_root, NIA_CACHE_DIR=cache_dir)
+                runs.append(run_in_fresh_interpreter(FIRST_ANALYSIS_SCRIPT % (start_date, end_date), env=env))
+            finally:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "import_seconds": summarise(runs, "import_seconds"),
+        "analysis_seconds": summarise(runs, "analysis_seconds"),
+        "wall_seconds": summarise(runs, "wall_seconds"),
+    }
+
+
+def run_startup_benchmark(repeat=5, fixtures_dir=None, start_date=None, end_date=None):
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "import": benchmark_import(repeat),
+        "first_analysis": None,
+    }
+    if fixtures_dir:
+        results["first_analysis"] = benchmark_first_analysis(fixtures_dir, start_date, end_date, repeat)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class SyntheticCorpus:
+    """Made-up Hansard and Members responses in the shape the NI Assembly API gives them, at any scale: days of
+    sittings (one a day from start_date), each of speeches_per_day speeches by members MLAs, with the Speaker
+    keeping order, headers and the odd interruption in between. The same seed always gives the same corpus.
+
+    Speakers are named the way Hansard names them ("Mr Allister", or "Mr J Allister" where two members share a title
+    and surname), so every speech can be matched to its member. Within a title, no two first names share an initial,
+    and no title, first name and surname is drawn twice, so no two members have the same Hansard name."""
+    first_names = {
+        "Mr": ["Jim", "Gerry", "Colm", "Mervyn", "Paul", "Declan", "Robin", "Kevin", "Trevor", "Sean", "Alex"],
+        "Mrs": ["Arlene", "Michelle", "Diane", "Paula", "Claire", "Sinead"],
+        "Ms": ["Emma", "Kellie", "Sheila", "Nichola", "Aisling", "Deirdre"],
+    }
+    surnames = ["Allister", "Kelly", "McGrath", "Storey", "Givan", "Kearney", "Swann", "Murphy", "Lyons", "Nesbitt",
+                "Beggs", "Hargey", "Long", "Bradley", "Dodds", "McCann", "Sheerin", "Kimmins", "Dolan", "Hunter",
+                "Stewart", "Carroll", "Mallon", "Poots", "Frew", "Boylan", "Durkan", "Lunn", "Buckley", "Easton"]
+    parties = ["Democratic Unionist Party", "Sinn Féin", "Alliance Party", "Social Democratic and Labour Party",
+               "Ulster Unionist Party", "Green Party", "Traditional Unionist Voice", "People Before Profit Alliance"]
+    constituencies = ["Belfast East", "Belfast North", "Belfast South", "Belfast West", "East Antrim",
+                      "East Londonderry", "Fermanagh and South Tyrone", "Foyle", "Lagan Valley", "Mid Ulster",
+                      "Newry and Armagh", "North Antrim", "North Down", "South Antrim", "South Down", "Strangford",
+                      "Upper Bann", "West Tyrone"]
+    words = ["the", "Minister", "will", "Assembly", "Executive", "people", "that", "we", "must", "funding", "health",
+             "schools", "review", "Committee", "welcome", "report", "I", "am", "grateful", "for", "this", "very",
+             "important", "budget", "cross-border", "rural", "recovery", "support", "constituents", "of", "£2.5",
+             "million", "is", "not", "good", "enough", "Department", "to", "and", "in", "Member's", "question"]
+    interruption_rate = 0.1
+    date_format = "%Y-%m-%d"
+
+    Member = namedtuple("Member", ["person_id", "display_name", "hansard_name", "party", "constituency", "lat_long"])
+
+    def __init__(self, days=5, speeches_per_day=200, members=90, start_date="2021-02-01", seed=0):
+        self.days = days
+        self.speeches_per_day = speeches_per_day
+        self.member_count = members
+        self.start_date = start_date
+        self.seed = seed
+        self.members = self.generate_members()
+
+    def get_dates(self):
+        start_date = datetime.strptime(self.start_date, self.date_format)
+        return [(start_date + timedelta(days=n)).strftime(self.date_format) for n in range(self.days)]
+
+    def get_end_date(self):
+        return (datetime.strptime(self.start_date, self.date_format) + timedelta(days=self.days)).strftime(
+            self.date_format)
+
+    def generate_members(self):
+        rng = random.Random(self.seed)
+        names = [(title, first_name, surname) for title, first_names in self.first_names.items()
+                 for first_name in first_names for surname in self.surnames]
+        if self.member_count > len(names):
+            raise ValueError(f"Only {len(names)} distinct member names can be made, not {self.member_count}")
+        people = rng.sample(names, self.member_count)
+        shared_names = Counter((title, surname) for title, _, surname in people)
+
+        members = []
+        for n, (title, first_name, surname) in enumerate(people):
+            hansard_name = f"{title} {surname}" if shared_names[title, surname] == 1 else \
+                f"{title} {first_name[0]} {surname}"
+            members.append(self.Member(str(1000 + n), f"{title} {first_name} {surname}", hansard_name,
+                                       rng.choice(self.parties), rng.choice(self.constituencies),
+                                       (rng.uniform(54.0, 55.3), rng.uniform(-8.2, -5.4))))
+        return members
+
+    def get_members_xml(self):
+        members_xml = "".join(
+            f"<Member><PersonId>{m.person_id}</PersonId><MemberFullDisplayName>{escape(m.display_name)}"
+            f"</MemberFullDisplayName><PartyName>{escape(m.party)}</PartyName><ConstituencyName>"
+            f"{escape(m.constituency)}</ConstituencyName></Member>" for m in self.members)
+        return f'<?xml version="1.0" encoding="utf-8"?><AllMembersList>{members_xml}</AllMembersList>'.encode("utf-8")
+
+    def get_contact_xml(self):
+        contacts_xml = "".join(
+            f"<Member><PersonId>{m.person_id}</PersonId><AddressType>NIA Constituency Address</AddressType>"
+            f"<Latitude>{m.lat_long[0]:.6f}</Latitude><Longitude>{m.lat_long[1]:.6f}</Longitude></Member>"
+            for m in self.members)
+        return f'<?xml version="1.0" encoding="utf-8"?><AllMembersContactDetails>{contacts_xml}' \
+               f'</AllMembersContactDetails>'.encode("utf-8")
+
+    def get_speech_text(self, rng):
+        sentences = []
+        for _ in range(rng.randint(1, 8)):
+            sentence = " ".join(rng.choice(self.words) for _ in range(rng.randint(4, 30)))
+            sentences.append(sentence[0].upper() + sentence[1:] + rng.choice([".", ".", ".", "?", "!"]))
+        paragraphs = [" ".join(sentences[i:i + 3]) for i in range(0, len(sentences), 3)]
+        return "<BR />".join(paragraphs)
+
+    def get_day_components(self, day_n):
+        """(component type, component text) for each component of the day's sitting, in order."""
+        rng = random.Random(f"{self.seed}-{day_n}")
+        components = [("Header", "Assembly Business"), ("Speaker (MlaName)", "Mr Speaker:"),
+                      ("Spoken Text", "Members, please take your seats.")]
+        for speech_n in range(self.speeches_per_day):
+            if speech_n and speech_n % 20 == 0:
+                components.append(("Header", "Oral Answers to Questions"))
+                components.append(("Question", f"{speech_n // 20}. {self.get_speech_text(rng)}"))
+            member = rng.choice(self.members)
+            components.append(("Speaker (MlaName)", f"{member.hansard_name}:"))
+            components.append(("Spoken Text", self.get_speech_text(rng)))
+            if rng.random() < self.interruption_rate:
+                components.append(("Procedure Line", "[Interruption.]"))
+            if speech_n % 10 == 9:
+                components.append(("Speaker (MlaName)", "Mr Speaker:"))
+                components.append(("Spoken Text", "Order."))
+        return components
+
+    def get_hansard_xml(self, day_n):
+        # Component ids keep going up across days, as they do in the API.
+        first_id = day_n * 10 * (self.speeches_per_day + 10)
+        components_xml = "".join(
+            f"<HansardComponent><ComponentId>{first_id + n}</ComponentId><ComponentType>{escape(component_type)}"
+            f"</ComponentType><ComponentText>{escape(component_text)}</ComponentText></HansardComponent>"
+            for n, (component_type, component_text) in enumerate(self.get_day_components(day_n)))
+        return f'<?xml version="1.0" encoding="utf-8"?><ArrayOfHansardComponent>{components_xml}' \
+               f'</ArrayOfHansardComponent>'.encode("utf-8")
+
+    def write_fixtures(self, fixtures_dir):
+        """Writes the corpus in nia_api_stub's fixture layout. The member list is only recorded for the first day;
+        the stub falls back to it for every later date. Returns the number of bytes of XML written."""
+        fixtures = nia_api_stub.open_fixtures(fixtures_dir)
+        api_root = build_hansard_corpus.API_ROOT
+        responses = {api_root + mla_profiling.MLAProfiler.endpoint + self.start_date: self.get_members_xml(),
+                     api_root + "/members.asmx/GetAllMemberContactDetails?" + self.start_date: self.get_contact_xml()}
+        for day_n, day in enumerate(self.get_dates()):
+            responses[api_root + build_hansard_corpus.XMLGenerator.endpoint + day] = self.get_hansard_xml(day_n)
+        for url, content in responses.items():
+            fixtures.put(url, content)
+        return sum(len(content) for content in responses.values())
+
+    def describe(self):
+        return {"days": self.days, "speeches_per_day": self.speeches_per_day, "members": self.member_count,
+                "start_date": self.start_date, "seed": self.seed}
+
+
+class PipelineBenchmark:
+    """Runs the profile pipeline over the dates of a corpus served from api_root, one stage at a time, keeping each
+    stage's wall time - or, with trace_memory, what it allocated: peak_bytes at its highest, and retained_bytes still
+    held when it finished (its output included). Memory is traced on a separate run, as tracemalloc slows everything
+    down. Fetching includes the stub server's own work, which runs in the same process."""
+    stages = ["fetch-hansard", "fetch-members", "corpus-builder", "member-connector", "nlp-model", "analytics-creator",
+              "discrete-analytics", "report"]
+
+    def __init__(self, api_root, start_date, end_date, trace_memory=False):
+        self.api_root = api_root
+        self.start_date = start_date
+        self.end_date = end_date
+        self.trace_memory = trace_memory
+
+        self.stage_results = {}
+        self.counts = {}
+
+    def measure(self, stage, func, *args):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        if self.trace_memory:
+            retained_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stage_results[stage] = {"peak_bytes": peak_bytes, "retained_bytes": retained_bytes}
+        else:
+            self.stage_results[stage] = {"seconds": seconds}
+        return result
+
+    def fetch_hansard(self):
+        xml_generator = build_hansard_corpus.XMLGenerator(self.start_date, self.end_date, api_root=self.api_root)
+        xml_generator.cache, xml_generator.sitting_calendar = None, None
+        return list(xml_generator.iter_valid_xml())
+
+    def fetch_members(self):
+        profiler = mla_profiling.ProfileParameterCreator(self.start_date, self.end_date, api_root=self.api_root)
+        profiler.cache = None
+        return profiler.create_parameters_from_mla_data()
+
+    @staticmethod
+    def build_corpus(valid_xml_list):
+        return build_hansard_corpus.CorpusBuilder(valid_xml_list).create_speaker_text_dict()
+
+    def connect_members(self, all_speech, mla_profile_dict):
+        hansard_member = speaker_to_profile.HansardToMemberConnector(self.start_date, self.end_date)
+        hansard_member.all_speech, hansard_member.mla_profile_dicts = all_speech, mla_profile_dict
+        return hansard_member.full_hansard_member()
+
+    @staticmethod
+    def add_analytics(combined_dict, nlp_cache_dir):
+        nlp_cache = profile_analysis.NLPResultCache(profile_analysis.AnalyticsCreator.get_model_identity(),
+                                                    cache_dir=nlp_cache_dir)
+        return profile_analysis.AnalyticsCreator(combined_dict, nlp_cache=nlp_cache).add_analytics()
+
+    @staticmethod
+    def analyze(combined_analytics_table, mla_profile_dict):
+        identifiers = sorted(profile_processor_with_imports.IDENTIFIERS)
+        proportions = profile_analysis.ProportionCalculator(mla_profile_dict, identifiers).get_all_proportions()
+        disc_analytics = profile_analysis.DiscreteAnalyticsCreator(combined_analytics_table, proportions)
+        disc_analytics.desired_identifiers = identifiers
+        disc_analytics.desired_metrics = profile_processor_with_imports.OUTPUT_ANALYTICS
+        return disc_analytics.get_all_desired_metrics_for_all_desired_identifiers()
+
+    @staticmethod
+    def build_report(stats_dictionary):
+        rprt = profile_processor_with_imports.processor().make_report()
+        return profile_processor_with_imports.add_stats_to_report(rprt, stats_dictionary).compile()
+
+    def run(self):
+        # The pipeline prints as it goes; that isn't what's being measured.
+        with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as nlp_cache_dir:
+            valid_xml_list = self.measure("fetch-hansard", self.fetch_hansard)
+            mla_profile_dict = self.measure("fetch-members", self.fetch_members)
+            all_speech = self.measure("corpus-builder", self.build_corpus, valid_xml_list)
+            combined_dict = self.measure("member-connector", self.connect_members, all_speech, mla_profile_dict)
+            self.measure("nlp-model", profile_analysis.AnalyticsCreator.get_shared_nlp)
+            combined_analytics_table = self.measure("analytics-creator", self.add_analytics, combined_dict,
+                                                    nlp_cache_dir)
+            stats_dictionary = self.measure("discrete-analytics", self.analyze, combined_analytics_table,
+                                            mla_profile_dict)
+            self.measure("report", self.build_report, stats_dictionary)
+        self.counts = {"days": len(valid_xml_list), "members": len(mla_profile_dict), "speeches": len(all_speech),
+                       "matched_speeches": len(combined_dict)}
+        return self.stage_results
+
+
+def run_pipeline_benchmark(corpus, repeat=3, fixtures_dir=None, latency=0.0):
+    """Times every stage over repeat runs, then traces the memory of each on one more."""
+    with contextlib.ExitStack() as stack:
+        if fixtures_dir is None:
+            fixtures_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        start = time.perf_counter()
+        xml_bytes = corpus.write_fixtures(fixtures_dir)
+        generate_seconds = time.perf_counter() - start
+
+        server = stack.enter_context(nia_api_stub.StubServer(fixtures_dir, latency=latency))
+        end_date = corpus.get_end_date()
+        runs = []
+        for _ in range(repeat):
+            pipeline = PipelineBenchmark(server.api_root, corpus.start_date, end_date)
+            runs.append(pipeline.run())
+        memory_pipeline = PipelineBenchmark(server.api_root, corpus.start_date, end_date, trace_memory=True)
+        memory_run = memory_pipeline.run()
+
+    stages = {stage: {"seconds": summarise([run[stage] for run in runs], "seconds"), **memory_run[stage]}
+              for stage in PipelineBenchmark.stages}
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "commit": get_commit(),
+        "repeat": repeat,
+        "latency": latency,
+        "corpus": {**corpus.describe(), "xml_bytes": xml_bytes, "generate_seconds": generate_seconds},
+        "counts": pipeline.counts,
+        "stages": stages,
+        "total_seconds": summarise([{"seconds": sum(run[stage]["seconds"] for stage in run)} for run in runs],
+                                   "seconds"),
+    }
+
+
+def write_results(results, output=None):
+    output_json = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as output_file:
+            output_file.write(output_json + "\n")
+    else:
+        print(output_json)
+
+
+def get_arg_parser():
+    my_parser = argparse.ArgumentParser(description="Benchmark the profile processor.")
+    subparsers = my_parser.add_subparsers(dest="command", required=True)
+
+    startup_parser = subparsers.add_parser("startup")
+    startup_parser.add_argument("--repeat", type=int, default=5)
+    startup_parser.add_argument("--fixtures", type=str, default=None)
+    startup_parser.add_argument("--start-date", type=str, default=None)
+    startup_parser.add_argument("--end-date", type=str, default=None)
+    startup_parser.add_argument("--output", type=str, default=None)
+
+    pipeline_parser = subparsers.add_parser("pipeline")
+    pipeline_parser.add_argument("--days", type=int, default=5)
+    pipeline_parser.add_argument("--speeches-per-day", type=int, default=200)
+    pipeline_parser.add_argument("--members", type=int, default=90)
+    pipeline_parser.add_argument("--start-date", type=str, default="2021-02-01")
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--repeat", type=int, default=3)
+    pipeline_parser.add_argument("--latency", type=float, default=0.0)
+    pipeline_parser.add_argument("--fixtures", type=str, default=None)
+    pipeline_parser.add_argument("--output", type=str, default=None)
+    return my_parser
+
+
+if __name__ == "__main__":
+    args = get_arg_parser().parse_args()
+    if args.command == "startup":
+        results = run_startup_benchmark(args.repeat, args.fixtures, args.start_date, args.end_date)
+    else:
+        synthetic_corpus = SyntheticCorpus(args.days, args.speeches_per_day, args.members, args.start_date, args.seed)
+        results = run_pipeline_benchmark(synthetic_corpus, args.repeat, args.fixtures, args.latency)
+    write_results(results, args.output)
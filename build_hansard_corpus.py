@@ -1,54 +1,342 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, date, datetime
 from collections import deque, namedtuple
+from urllib.parse import urlsplit, parse_qsl
 import re
 
 """These classes form a similar function to hansard_prepper/py but also collects relevant 'Procedure Lines'  such as 
 [Interruption.], [Laughter.], etc.
 
 It also allows to create a corpus/document based on a date range.
+
+Set NIA_API_ROOT (e.g. to a local nia_api_stub.py server) to use something other than the live API.
 """
 
+API_ROOT = os.environ.get("NIA_API_ROOT", "http://data.niassembly.gov.uk")
+
+
+class ResponseCache:
+    """Keeps raw API responses on disk as gzipped XML, one file per endpoint and date.
+
+    Past sittings and past membership lists don't change, so anything dated more than immutable_after ago is kept
+    for good. More recent dates (and requests with no date) may still be updated on the API side, so they are
+    re-fetched once the cached copy is older than ttl."""
+    cache_dir = os.environ.get("NIA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             ".nia_cache"))
+    immutable_after = timedelta(days=14)
+    ttl = timedelta(hours=6)
+
+    def __init__(self, cache_dir: str = None, immutable_after: timedelta = None, ttl: timedelta = None):
+        if cache_dir:
+            self.cache_dir = cache_dir
+        if immutable_after is not None:
+            self.immutable_after = immutable_after
+        if ttl is not None:
+            self.ttl = ttl
+
+    @staticmethod
+    def split_url(url):
+        """e.g. .../hansard.asmx/GetHansardComponentsByPlenaryDate?plenaryDate=2021-02-01 gives
+        ("hansard.asmx/GetHansardComponentsByPlenaryDate", "2021-02-01"). GetAllMemberContactDetails takes its date
+        as a bare query string (...?2021-02-01), which is used as it is."""
+        split = urlsplit(url)
+        endpoint = split.path.strip("/")
+        query_values = [v for _, v in parse_qsl(split.query)]
+        date_ = query_values[0] if query_values else split.query
+        return endpoint, date_
+
+    def get_path(self, url):
+        endpoint, date_ = self.split_url(url)
+        file_name = re.sub(r"[^\w\-]", "_", date_) or "_"
+        return os.path.join(self.cache_dir, *endpoint.split("/"), f"{file_name}.xml.gz")
+
+    def is_immutable(self, date_):
+        try:
+            dt_date = datetime.strptime(date_, "%Y-%m-%d")
+        except ValueError:
+            return False
+        return datetime.now() - dt_date > self.immutable_after
+
+    def is_fresh(self, path, date_):
+        if self.is_immutable(date_):
+            return True
+        cached_at = datetime.fromtimestamp(os.path.getmtime(path))
+        return datetime.now() - cached_at < self.ttl
+
+    def get(self, url):
+        path = self.get_path(url)
+        if not os.path.exists(path) or not self.is_fresh(path, self.split_url(url)[1]):
+            return None
+        with gzip.open(path, "rb") as cache_file:
+            return cache_file.read()
+
+    @staticmethod
+    def open_tmp_file(path, mode="wb"):
+        """A new, uniquely named file next to path, to be written and then renamed over it: a concurrent reader never
+        sees a half-written file, and concurrent writers (threads or processes) never share a tmp file."""
+        return tempfile.NamedTemporaryFile(mode=mode, dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.",
+                                           suffix=".tmp", delete=False)
+
+    def put(self, url, content):
+        path = self.get_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.open_tmp_file(path) as tmp_file:
+            with gzip.GzipFile(fileobj=tmp_file, mode="wb") as cache_file:
+                cache_file.write(content)
+        os.replace(tmp_file.name, path)
+
+
+class SittingCalendar:
+    """A persisted record of which dates had a plenary sitting, so that later runs only ask for dates worth asking for.
+
+    A date is requested if it is a known sitting, or if it isn't known yet and falls on one of sitting_weekdays.
+    Dates without a sitting are only remembered once they're older than immutable_after, since a recent date may
+    simply not have been published yet.
+
+    Several calendars may be open on the same file at once (one per day's fetch in the Dask workflow), so save()
+    merges what is already on disk with what this one has recorded, rather than overwriting it."""
+    sitting_weekdays = {0, 1, 2, 3, 4}
+    date_format = "%Y-%m-%d"
+    save_lock = threading.Lock()
+
+    def __init__(self, path: str = None, immutable_after: timedelta = None):
+        self.path = path or os.path.join(ResponseCache.cache_dir, "sitting_calendar.json")
+        self.immutable_after = immutable_after if immutable_after is not None else ResponseCache.immutable_after
+        self.sittings = self.load()
+
+    def load(self):
+        """A calendar that can't be read is only a lost optimisation, so it's started again rather than failing."""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as calendar_file:
+                return json.load(calendar_file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable sitting calendar {self.path}: {e}")
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.save_lock:
+            self.sittings = {**self.load(), **self.sittings}
+            with ResponseCache.open_tmp_file(self.path, mode="w") as calendar_file:
+                json.dump(self.sittings, calendar_file, indent=1, sort_keys=True)
+            os.replace(calendar_file.name, self.path)
+
+    def should_request(self, date_):
+        sitting = self.sittings.get(date_)
+        if sitting is not None:
+            return sitting
+        return datetime.strptime(date_, self.date_format).weekday() in self.sitting_weekdays
+
+    def record(self, date_, sitting):
+        is_immutable = datetime.now() - datetime.strptime(date_, self.date_format) > self.immutable_after
+        if sitting or is_immutable:
+            self.sittings[date_] = sitting
+
 
 class HansardXMLValidator:
-    """Occasionally the XML string creates a ParseError Exception which needs to be caught."""
+    """Occasionally the XML string creates a ParseError Exception which needs to be caught.
+
+    Responses that parse are kept in a ResponseCache, so re-running over an overlapping date range only hits the API
+    for dates that haven't been seen (or that are recent enough to have changed). Set cache_responses = False to
+    always go to the API.
+
+    All requests go through one keep-alive session, shared by every validator in the process. Timeouts, connection errors and 5xx responses are retried with
+    exponential backoff (backoff_factor * 2 ** retry seconds) up to max_retries times, and every request's latency and
+    retry count is kept in request_log."""
+    cache_responses = True
+
+    timeout = 30
+    max_retries = 3
+    backoff_factor = 0.5
+    retry_statuses = {500, 502, 503, 504}
+    pool_maxsize = 10
+
+    RequestStats = namedtuple("RequestStats", ["url", "status_code", "latency", "retries"])
+
+    # {(pid, pool size): session}. Validators are made per day and per stage, so sharing lets them reuse connections
+    # rather than each opening its own and never closing them; the pid keeps forked workers off their parent's sockets.
+    sessions = {}
+    sessions_lock = threading.Lock()
 
     def __init__(self):
         self.hansard_exceptions_list = []
         self.current_request = None
-
-    def valid_request(self):
-        status = self.current_request.status_code
+        self.cache = ResponseCache() if self.cache_responses else None
+
+        self.session = self.get_session()
+        self.request_log = []
+
+    def get_session(self):
+        pool_size = max(self.pool_maxsize, getattr(self, "max_workers", 1))
+        key = (os.getpid(), pool_size)
+        with self.sessions_lock:
+            if key not in HansardXMLValidator.sessions:
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                HansardXMLValidator.sessions[key] = session
+            return HansardXMLValidator.sessions[key]
+
+    @staticmethod
+    def valid_request(request):
+        status = request.status_code
         if status != 200:
             print(f"Bad Request: {status}")
-            print(self.current_request)
+            print(request)
             return False
         return True
 
-    def xml_exception_catcher(self):
-        current_request_as_text = self.current_request.text
-        print(current_request_as_text)
+    def xml_exception_catcher(self, content):
         try:
-            et_request = ET.fromstring(current_request_as_text)
+            et_request = ET.fromstring(content)
         except ET.ParseError:
-            self.hansard_exceptions_list.append(("ParseError", current_request_as_text))
+            self.hansard_exceptions_list.append(("ParseError", content))
             et_request = None
         return et_request
 
+    def get_with_retries(self, url):
+        retries = 0
+        start = time.perf_counter()
+        while True:
+            request, error = None, None
+            try:
+                request = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if request is not None and request.status_code not in self.retry_statuses:
+                break
+            if retries >= self.max_retries:
+                break
+            time.sleep(self.backoff_factor * 2 ** retries)
+            retries += 1
+
+        status_code = request.status_code if request is not None else None
+        self.request_log.append(self.RequestStats(url, status_code, time.perf_counter() - start, retries))
+        if error is not None:
+            print(f"Request failed after {retries} retries: {error}")
+            self.hansard_exceptions_list.append(("RequestError", url, error))
+        elif retries:
+            print(f"Request needed {retries} retries: {url}")
+        return request
+
+    def get_content(self, url):
+        """Returns the raw response body, or None for a bad request."""
+        request = self.get_with_retries(url)
+        self.current_request = request
+        if request is None:
+            return None
+        if self.valid_request(request):
+            return request.content
+        self.hansard_exceptions_list.append(("BadRequest", url, request.status_code))
+
+    def get_request_summary(self):
+        latencies = [r.latency for r in self.request_log]
+        return {
+            "requests": len(self.request_log),
+            "retries": sum(r.retries for r in self.request_log),
+            "failed": len([r for r in self.request_log if r.status_code != 200]),
+            "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "max_latency": max(latencies, default=0.0),
+        }
+
+    def has_failed_requests(self):
+        """Whether any request went unanswered (even after retries), or answered with something that couldn't be
+        read - in which case what was fetched may be missing data."""
+        return bool(self.hansard_exceptions_list) or any(r.status_code != 200 for r in self.request_log)
+
+    def get_cached_content(self, url):
+        """Returns the raw response body and whether it came from the cache."""
+        content = self.cache.get(url) if self.cache else None
+        if content is not None:
+            return content, True
+        return self.get_content(url), False
+
     def validate_xml(self, url):
-        self.current_request = requests.get(url)
-        xml_root = self.xml_exception_catcher()
-        if all([self.valid_request(), xml_root]):
+        """The response is passed around explicitly (rather than read back from self.current_request) so that this
+        can be called from several threads at once."""
+        content, from_cache = self.get_cached_content(url)
+        if content is None:
+            return None
+        xml_root = self.xml_exception_catcher(content)
+        if xml_root is not None and self.cache and not from_cache:
+            self.cache.put(url, content)
+        if xml_root:
             return xml_root
 
+    @staticmethod
+    def get_child_text(element, tag):
+        child = element.find(tag)
+        if child is not None:
+            return child.text
+
+    def iterparse_xml(self, url, root_tag, tags):
+        """Streaming alternative to validate_xml. Rather than building the whole tree, this walks the response with
+        iterparse and keeps only the text of the given child tags of each root_tag element, clearing every element
+        as soon as it has been read. Returns a list of tuples (one per root_tag element), or None."""
+        content, from_cache = self.get_cached_content(url)
+        if content is None:
+            return None
+        records = []
+        try:
+            context = ET.iterparse(io.BytesIO(content), events=("start", "end"))
+            _, root = next(context)
+            for event, element in context:
+                if event == "end" and element.tag == root_tag:
+                    records.append(tuple(self.get_child_text(element, tag) for tag in tags))
+                    root.clear()
+        except ET.ParseError:
+            self.hansard_exceptions_list.append(("ParseError", content))
+            return None
+        if self.cache and not from_cache:
+            self.cache.put(url, content)
+        return records
+
 
 class XMLGenerator(HansardXMLValidator):
-    """Validates and compiles XML files into a linked list for a given date range."""
-    date_input_format = "%Y-%m-%d"
-    base_url = r"http://data.niassembly.gov.uk/hansard.asmx/GetHansardComponentsByPlenaryDate?plenaryDate="
+    """Validates and compiles XML files into a linked list for a given date range.
+
+    Days are requested concurrently on a bounded thread pool of max_workers threads (1 gives the old serial
+    behaviour). Results are always consumed in date order, so the output doesn't depend on the concurrency.
 
-    def __init__(self, start_date: str, end_date: str):
+    With streaming set (the default) each day is read with iterparse_xml, so the list for each day holds lightweight
+    StreamedRecord tuples rather than Elements. Set streaming = False to get the full Elements back.
+
+    Unless use_sitting_calendar is switched off, plenary dates are looked up in a SittingCalendar first, so weekends
+    and days already known to have had no sitting aren't requested at all."""
+    date_input_format = "%Y-%m-%d"
+    api_root = API_ROOT
+    endpoint = "/hansard.asmx/GetHansardComponentsByPlenaryDate?plenaryDate="
+    base_url = api_root + endpoint
+    max_workers = 4
+
+    streaming = True
+    HansardComponentFields = namedtuple("HansardComponentFields", ["component_id", "component_type",
+                                                                   "component_text"])
+    streamed_tags = ["ComponentId", "ComponentType", "ComponentText"]
+    StreamedRecord = HansardComponentFields
+
+    use_sitting_calendar = True
+
+    def __init__(self, start_date: str, end_date: str, max_workers: int = None, api_root: str = None):
+        # Set before the session is created, so its connection pool is big enough for every worker.
+        if max_workers:
+            self.max_workers = max_workers
+        if api_root:
+            self.api_root = api_root
+            self.base_url = api_root + self.endpoint
         super().__init__()
         self.start_date = datetime.strptime(start_date, self.date_input_format)
         self.end_date = datetime.strptime(end_date, self.date_input_format)
@@ -60,29 +348,89 @@ class XMLGenerator(HansardXMLValidator):
         self.valid_xml_list = deque()
         self.parse_errors_log = []
 
+        self.sitting_calendar = SittingCalendar() if self.use_sitting_calendar else None
+
     def create_date_range_iterator(self):
         """start_date inclusive; end_date exclusive."""
         for n in range(int((self.end_date - self.start_date).days)):
             dt_date = self.start_date + timedelta(n)
             yield dt_date.strftime("%Y-%m-%d")
 
+    def get_root_components_for_date(self, date_, root_tag):
+        url = self.base_url + date_
+        if self.streaming:
+            records = self.iterparse_xml(url, root_tag, self.streamed_tags)
+            if records is not None:
+                return [self.StreamedRecord(*r) for r in records]
+            return None
+        root = self.validate_xml(url)
+        if root:
+            return [c for c in root if c.tag == root_tag]
+
     def filter_root_components(self, root_tag):
-        url = self.base_url + self.current_date
-        self.root = self.validate_xml(url)
-        if self.root:
-            hansard_components = [c for c in self.root if c.tag == root_tag]
-            return hansard_components
+        return self.get_root_components_for_date(self.current_date, root_tag)
+
+    def fetch_all_dates(self, root_tag, dates=None):
+        """Yields (date, components) for every date in the range (or in dates, if given), in date order, whatever
+        order the requests complete in. Only a couple of days per worker are fetched ahead of the consumer, so a slow
+        consumer doesn't cause the whole range to pile up in memory."""
+        if dates is None:
+            dates = self.create_date_range_iterator()
+        max_pending = 2 * self.max_workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for date_ in dates:
+                pending.append((date_, executor.submit(self.get_root_components_for_date, date_, root_tag)))
+                if len(pending) > max_pending:
+                    pending_date, future = pending.popleft()
+                    yield pending_date, future.result()
+            while pending:
+                pending_date, future = pending.popleft()
+                yield pending_date, future.result()
+
+    @staticmethod
+    def get_component_type(component):
+        if isinstance(component, ET.Element):
+            return component.find("ComponentType").text
+        return component.component_type
+
+    def contains_required_component(self, hansard_components):
+        # We're only interested in documents that contain spoken text:
+        if not hansard_components:
+            return False
+        return any([c for c in hansard_components if self.get_component_type(c) == "Spoken Text"])
 
     def get_valid_xml_string_if_contains_required_component(self, hansard_components):
-        # We're only interested in documents that contain spoken text:
-        if any([c for c in hansard_components if c.find("ComponentType").text == "Spoken Text"]):
+        if self.contains_required_component(hansard_components):
             self.valid_xml_list.append(hansard_components)
 
+    def get_plenary_dates(self):
+        dates = self.create_date_range_iterator()
+        if self.sitting_calendar:
+            dates = [d for d in dates if self.sitting_calendar.should_request(d)]
+        return dates
+
+    def record_sitting(self, date_, hansard_components):
+        # None means the request failed, so we can't say either way.
+        if self.sitting_calendar and hansard_components is not None:
+            self.sitting_calendar.record(date_, self.contains_required_component(hansard_components))
+
+    def iter_valid_xml(self):
+        """Generator version of run_for_all_dates: yields each valid day's components without keeping them, so it
+        can be handed straight to CorpusBuilder."""
+        try:
+            for date_, hansard_components in self.fetch_all_dates("HansardComponent", self.get_plenary_dates()):
+                self.current_date = date_
+                self.record_sitting(date_, hansard_components)
+                if self.contains_required_component(hansard_components):
+                    yield hansard_components
+        finally:
+            if self.sitting_calendar:
+                self.sitting_calendar.save()
+        print(self.get_request_summary())
+
     def run_for_all_dates(self):
-        for date_ in self.create_date_range_iterator():
-            self.current_date = date_
-            hansard_components = self.filter_root_components("HansardComponent")
-            self.get_valid_xml_string_if_contains_required_component(hansard_components)
+        self.valid_xml_list.extend(self.iter_valid_xml())
 
 
 class CorpusBuilder:
@@ -92,86 +440,106 @@ class CorpusBuilder:
     all_component_types = {re.compile("Speaker.*"), 'Question', 'Division', 'Time', 'Bill Text', 'Written Statement',
                            'Procedure Line', 'Plenary Item Text', 'Header', 'Spoken Text', 'Document Title', 'Quote'}
     desired_component_types = {'Question', 'Procedure Line', 'Spoken Text'}
-    procedures_to_add = {re.compile(r"\[Interruption.*"), re.compile(r"\[Laughter.*")}
+    procedures_to_add = re.compile(r"\[Interruption.*|\[Laughter.*")
     SpeakerComponent = namedtuple("SpeakerComponent", ["speaker", "text", "interjection"])
     unwanted_speaker_pattern = re.compile(r".*\sSpeaker.*|A\sMember|Some Members")
+    # Whether the final speech, which has no next speaker to finish it, is yielded too.
+    yield_last_speech = False
 
-    def __init__(self, valid_xml_list):
+    def __init__(self, valid_xml_list, yield_last_speech=None):
         self.valid_xml_list = valid_xml_list
+        if yield_last_speech is not None:
+            self.yield_last_speech = yield_last_speech
 
         self.all_questions = deque()
 
-        self.component_id = None
-        self.component_type = None  # Current Hansard Component Type
-        self.component_text = None
-        self.speech_tup = self.SpeakerComponent(None, None, None)
-
         self.speech_dict = {}
         self.component_error_log = []
 
-    def get_component_id(self, component):
-        self.component_id = component.find("ComponentId").text
+        # Component type: handler. "Speaker ..." types vary, so they're added the first time each one is seen.
+        self.component_handlers = {
+            "Question": self.collate_questions,
+            "Spoken Text": self.add_spoken_text,
+            "Procedure Line": self.add_procedure_line,
+        }
 
-    def identify_component_type_and_text(self, component):
-        self.component_type = component.find("ComponentType").text
-        self.component_text = component.find("ComponentText").text
+    @staticmethod
+    def as_component_fields(component):
+        """Components may be full Elements or the records streamed by XMLGenerator."""
+        if isinstance(component, ET.Element):
+            return XMLGenerator.HansardComponentFields(component.find("ComponentId").text,
+                                                       component.find("ComponentType").text,
+                                                       component.find("ComponentText").text)
+        return component
+
+    def get_component_handler(self, component_type):
+        try:
+            return self.component_handlers[component_type]
+        except KeyError:
+            handler = self.add_new_speaker if component_type.startswith("Speaker") else None
+            self.component_handlers[component_type] = handler
+            return handler
 
-    def collate_questions(self):
-        self.all_questions.append(self.component_text)
+    # Each handler takes the speech in progress and the component, and returns the speech in progress along with any
+    # speech it has just finished (or None).
 
-    def remove_parentheses(self):
+    def collate_questions(self, speech_tup, component_type, component_text):
+        self.all_questions.append(component_text)
+        return speech_tup, None
+
+    @staticmethod
+    def remove_parentheses(speaker):
         """Some speakers' ministerial position is given in parentheses; these need to be removed for matching."""
-        split_speaker = self.component_text.split("(", maxsplit=1)
-        self.component_text = split_speaker[0].strip()
+        split_speaker = speaker.split("(", maxsplit=1)
+        return split_speaker[0].strip()
 
-    def add_new_speaker(self):
-        if self.speech_tup.speaker:
-            self.speech_dict[self.component_id] = self.speech_tup
-        self.component_text = self.component_text.replace(":", "")
-        self.remove_parentheses()
-        self.speech_tup = self.SpeakerComponent(self.component_text, None, None)
+    def add_new_speaker(self, speech_tup, component_type, component_text):
+        finished_speech = speech_tup if speech_tup.speaker else None
+        speaker = self.remove_parentheses(component_text.replace(":", ""))
+        return self.SpeakerComponent(speaker, None, None), finished_speech
 
-    def add_to_error_log(self):
+    def add_to_error_log(self, speech_tup, component_type, component_text):
         """This provides a reference of any examples of a speaker being given without any speech."""
-        self.component_error_log.append((self.speech_tup, self.component_type, self.component_text))
-
-    def add_spoken_text(self):
-        if self.speech_tup.speaker and not self.speech_tup.text:
-            self.speech_tup = self.speech_tup._replace(text=self.component_text)
-        else:
-            self.add_to_error_log()
-
-    def add_procedure_line(self):
-        if self.speech_tup.speaker and self.speech_tup.text and not self.speech_tup.interjection:
-            if any([re.fullmatch(regex, self.component_text) for regex in self.procedures_to_add]):
-                self.speech_tup = self.speech_tup._replace(interjection=self.component_text)
-
-    def remove_unwanted_speakers(self):
-        """Remove the assembly speaker and other non-MLAs"""
-        self.speech_dict = {
-            k: v for k, v in self.speech_dict.items() if not
-            re.fullmatch(self.unwanted_speaker_pattern, v.speaker)
-        }
+        self.component_error_log.append((speech_tup, component_type, component_text))
+
+    def add_spoken_text(self, speech_tup, component_type, component_text):
+        if speech_tup.speaker and not speech_tup.text:
+            return speech_tup._replace(text=component_text), None
+        self.add_to_error_log(speech_tup, component_type, component_text)
+        return speech_tup, None
+
+    def add_procedure_line(self, speech_tup, component_type, component_text):
+        if speech_tup.speaker and speech_tup.text and not speech_tup.interjection:
+            if self.procedures_to_add.fullmatch(component_text):
+                return speech_tup._replace(interjection=component_text), None
+        return speech_tup, None
+
+    def is_unwanted_speaker(self, speaker):
+        """The assembly speaker and other non-MLAs"""
+        return self.unwanted_speaker_pattern.fullmatch(speaker) is not None
+
+    def iter_speaker_components(self):
+        """Reads every component once, in order, and yields (component id, SpeakerComponent) as each speech is
+        finished. A speech is finished by the next speaker, and is keyed by that speaker's component id. (So the last
+        speech in the corpus is only yielded with yield_last_speech - keyed by the last component read, and only if it
+        got further than its speaker.)"""
+        speech_tup = self.SpeakerComponent(None, None, None)
+        component_id, speech_start_id = None, None
+        for components in self.valid_xml_list:
+            for component in components:
+                component_id, component_type, component_text = self.as_component_fields(component)
+                handler = self.get_component_handler(component_type)
+                if handler is None:
+                    continue
+                speech_tup, finished_speech = handler(speech_tup, component_type, component_text)
+                if handler == self.add_new_speaker:
+                    speech_start_id = component_id
+                if finished_speech and not self.is_unwanted_speaker(finished_speech.speaker):
+                    yield component_id, finished_speech
+        if self.yield_last_speech and speech_tup.speaker and component_id != speech_start_id and \
+                not self.is_unwanted_speaker(speech_tup.speaker):
+            yield component_id, speech_tup
 
     def create_speaker_text_dict(self):
-        for components in self.valid_xml_list:
-            relevant_components = [c for c in components if c.find("ComponentType").text in
-                                   self.desired_component_types or
-                                   re.fullmatch("Speaker.*", c.find("ComponentType").text)]
-            for component in relevant_components:
-                self.get_component_id(component)
-                self.identify_component_type_and_text(component)
-                if self.component_type == "Question":
-                    self.collate_questions()
-                elif re.fullmatch("Speaker.*", self.component_type):
-                    self.add_new_speaker()
-                elif self.component_type == "Spoken Text":
-                    self.add_spoken_text()
-                elif self.component_type == "Procedure Line":
-                    print(self.component_text)
-                    self.add_procedure_line()
-                else:
-                    self.component_error_log.append(
-                        ("Not called on main method", self.component_type, self.component_text))
-        self.remove_unwanted_speakers()
+        self.speech_dict = dict(self.iter_speaker_components())
         return self.speech_dict
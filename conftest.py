@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+
+
+class FakeResponse:
+    """Stands in for a requests response from the NI Assembly API."""
+
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.content = text.encode("utf-8")
+        self.status_code = status_code
+
+
+class FakeNLP:
+    """Stands in for the spaCy pipeline: scores a text by its length, and counts how many texts it was given."""
+
+    def __init__(self):
+        self.texts_seen = []
+
+    def pipe(self, texts, batch_size=None, n_process=None):
+        for text in texts:
+            self.texts_seen.append(text)
+            yield SimpleNamespace(_=SimpleNamespace(sentiment=SimpleNamespace(polarity=len(text) / 100,
+                                                                            subjectivity=len(text) / 10)))
@@ -1,7 +1,7 @@
+import threading
 import build_hansard_corpus
 import gender_guesser.detector as gender_detector
-from geopy.distance import distance
-from geopy import Nominatim
+import numpy as np
 from collections import namedtuple
 
 """The purpose of these classes is to extract the data necessary to assign speakers a 'profile' based on
@@ -9,18 +9,28 @@ parameters of interest. The 'Members' API on the niassembly page provides useful
 
 The ability to get a comprehensive list of members by any given date is particularly handy when looking at changes to 
 data over time. However, having to iterate through a member list for each date can cause a significant bottleneck 
-for larger date requests."""
+for larger date requests. Since membership only changes a few times a year, MLAProfiler instead samples the member 
+list every timeline_sample_days and bisects between samples only where the set of members differs. (A member who joins 
+and leaves again between two samples would be missed, so keep the interval well below any tenure of interest.)"""
 
 
 class MLAProfiler(build_hansard_corpus.XMLGenerator):
-    base_url = r"http://data.niassembly.gov.uk/members.asmx/GetAllMembersByGivenDate?specificDate="
+    endpoint = "/members.asmx/GetAllMembersByGivenDate?specificDate="
+    base_url = build_hansard_corpus.API_ROOT + endpoint
 
     MLAInfo = namedtuple("MLAInfo", ["member_name", "party", "constituency", "person_id"])
     xml_member_tag_types = ["MemberFullDisplayName", "PartyName", "ConstituencyName", "PersonId"]
     tag_to_tuple_dict = dict(zip(xml_member_tag_types, MLAInfo._fields))
+    streamed_tags = xml_member_tag_types
+    StreamedRecord = MLAInfo
+    # Membership has to be checked on any date, not just sitting days.
+    use_sitting_calendar = False
 
-    def __init__(self, start_date, end_date):
-        super().__init__(start_date, end_date)
+    use_membership_timeline = True
+    timeline_sample_days = 60
+
+    def __init__(self, start_date, end_date, max_workers=None, api_root=None):
+        super().__init__(start_date, end_date, max_workers, api_root)
         self.root = None
         self.all_member_xml = []
         self.current_member_ids = {}
@@ -33,6 +43,10 @@ class MLAProfiler(build_hansard_corpus.XMLGenerator):
 
         self.all_mla_profile_tuples = []
 
+        self.dates = []
+        self.members_by_date_index = {}
+        self.membership_intervals = {}
+
     def add_to_info_dict_for_named_tuple(self):
         if self.tag in self.xml_member_tag_types:
             tup_name = self.tag_to_tuple_dict[self.tag]
@@ -41,23 +55,108 @@ class MLAProfiler(build_hansard_corpus.XMLGenerator):
     def build_new_tuple(self):
         self.current_named_tuple = self.MLAInfo(**self.mla_info_dict)
 
+    def get_person_id(self, member_components):
+        if isinstance(member_components, self.MLAInfo):
+            return member_components.person_id
+        return member_components.find("PersonId").text
+
+    def add_new_members(self, member_components):
+        new_member_components = [c for c in member_components if self.get_person_id(c) not in
+                                 self.current_member_ids.keys()]
+        for c in new_member_components:
+            self.current_member_ids[self.get_person_id(c)] = c
+
+    def store_members(self, date_index, member_components):
+        """Returns whether there was a member list to store. A failed fetch is left out rather than stored as nobody
+        being a member, which would look like a change in membership on either side of it."""
+        if member_components is None:
+            print(f"No member list for {self.dates[date_index]}")
+            return False
+        self.members_by_date_index[date_index] = {self.get_person_id(c): c for c in member_components}
+        return True
+
+    def get_member_ids(self, date_index):
+        return set(self.members_by_date_index[date_index].keys())
+
+    def bisect_membership(self, low, high):
+        """Fetches dates between two already-fetched date indexes until every change in membership between them is
+        pinned to the day it happened. If both ends have the same members, nothing between them is fetched."""
+        if high - low <= 1 or self.get_member_ids(low) == self.get_member_ids(high):
+            return
+        middle = (low + high) // 2
+        if not self.store_members(middle, self.get_root_components_for_date(self.dates[middle], "Member")):
+            # Without the middle date, the change can't be pinned down any further, so it's put down to high.
+            return
+        self.bisect_membership(low, middle)
+        self.bisect_membership(middle, high)
+
+    def build_membership_intervals(self):
+        """After bisecting, membership is constant from each fetched date up to the next one, so each member's
+        validity intervals (start inclusive, end exclusive) can be read straight off the fetched dates."""
+        fetched_indexes = sorted(self.members_by_date_index.keys())
+        end_indexes = fetched_indexes[1:] + [len(self.dates)]
+        self.membership_intervals = {}
+        for start_index, end_index in zip(fetched_indexes, end_indexes):
+            end_date = self.dates[end_index] if end_index < len(self.dates) else self.end_date.strftime("%Y-%m-%d")
+            for person_id in self.get_member_ids(start_index):
+                intervals = self.membership_intervals.setdefault(person_id, [])
+                if intervals and intervals[-1][1] == self.dates[start_index]:
+                    intervals[-1] = (intervals[-1][0], end_date)
+                else:
+                    intervals.append((self.dates[start_index], end_date))
+
+    def build_membership_timeline(self):
+        self.dates = list(self.create_date_range_iterator())
+        if not self.dates:
+            return
+        sample_indexes = list(range(0, len(self.dates), self.timeline_sample_days))
+        if sample_indexes[-1] != len(self.dates) - 1:
+            sample_indexes.append(len(self.dates) - 1)
+
+        sample_dates = [self.dates[i] for i in sample_indexes]
+        for date_index, (_, member_components) in zip(sample_indexes, self.fetch_all_dates("Member", sample_dates)):
+            self.store_members(date_index, member_components)
+        # Samples that couldn't be fetched are skipped, so each bisection runs between two real member lists.
+        fetched_indexes = [i for i in sample_indexes if i in self.members_by_date_index]
+        for low, high in zip(fetched_indexes, fetched_indexes[1:]):
+            self.bisect_membership(low, high)
+
+        self.build_membership_intervals()
+        for date_index in sorted(self.members_by_date_index.keys()):
+            self.add_new_members(self.members_by_date_index[date_index].values())
+        self.current_date = self.dates[-1]
+
     def get_all_profiles_for_date_range(self):
-        for date_ in self.create_date_range_iterator():
-            self.current_date = date_
-            member_components = self.filter_root_components("Member")
-            new_member_components = [c for c in member_components if c.find("PersonId").text not in
-                                     self.current_member_ids.keys()]
-            for c in new_member_components:
-                self.current_member_ids[c.find("PersonId").text] = c
+        if self.use_membership_timeline:
+            self.build_membership_timeline()
+        else:
+            self.dates = list(self.create_date_range_iterator())
+            for date_index, (date_, member_components) in enumerate(self.fetch_all_dates("Member", self.dates)):
+                self.current_date = date_
+                self.store_members(date_index, member_components)
+                if member_components:
+                    self.add_new_members(member_components)
+            self.build_membership_intervals()
+        print(self.get_request_summary())
+
+    def get_member_ids_on(self, date_):
+        """The PersonIds of everyone who was a member on date_ (within the date range), read off membership_intervals,
+        so one fetch of the range answers for each of its days."""
+        return {person_id for person_id, intervals in self.membership_intervals.items()
+                if any(start <= date_ < end for start, end in intervals)}
 
     def create_named_tuples(self):
         self.get_all_profiles_for_date_range()
         member_profiles = [v for v in self.current_member_ids.values()]
         for member_components in member_profiles:
-            for component in member_components:
-                self.tag, self.text = component.tag, component.text
-                self.add_to_info_dict_for_named_tuple()
-            self.build_new_tuple()
+            if isinstance(member_components, self.MLAInfo):
+                # Streamed members are already in the shape we want.
+                self.current_named_tuple = member_components
+            else:
+                for component in member_components:
+                    self.tag, self.text = component.tag, component.text
+                    self.add_to_info_dict_for_named_tuple()
+                self.build_new_tuple()
             self.all_mla_profile_tuples.append(self.current_named_tuple)
             print(self.current_named_tuple)
 
@@ -68,17 +167,52 @@ class ProfileParameterCreator(MLAProfiler):
     # out of this range. Still worth considering any oversights here.
 
     stormont_lat_long = (54.592997628, -5.835329992)
+    earth_radius_miles = 3958.7613
+    # (latitude, longitude): miles from Stormont. Shared, since constituency offices rarely move.
+    distance_cache = {}
+
+    # Loading the detector parses its whole name database, so it's only done once per process, on first use.
+    gender_detector = None
+    gender_detector_lock = threading.Lock()
+    first_name_gender_cache = {}
 
     MLAParams = namedtuple("MLAParams", ["gender", "distance", "party", "constituency", "name"])
 
-    def __init__(self, start_date, end_date):
-        super().__init__(start_date, end_date)
+    def __init__(self, start_date, end_date, max_workers=None, api_root=None):
+        super().__init__(start_date, end_date, max_workers, api_root)
         self.nia_constituency_list = []
-        self.lat_long = None
-        self.locator = Nominatim(user_agent="lintol_processor")
+        self.lat_long_by_person_id = {}
+        self.locator = None
 
         self.not_all_params_available = []
 
+    def get_locator(self):
+        """geopy is only imported once a geocoder is actually wanted."""
+        if self.locator is None:
+            from geopy import Nominatim
+            self.locator = Nominatim(user_agent="lintol_processor")
+        return self.locator
+
+    @classmethod
+    def get_gender_detector(cls):
+        if ProfileParameterCreator.gender_detector is None:
+            with cls.gender_detector_lock:
+                if ProfileParameterCreator.gender_detector is None:
+                    ProfileParameterCreator.gender_detector = gender_detector.Detector()
+        return ProfileParameterCreator.gender_detector
+
+    @classmethod
+    def detect_first_name_gender(cls, first_name):
+        if first_name in cls.first_name_gender_cache:
+            return cls.first_name_gender_cache[first_name]
+        gender = None
+        detected_gender = cls.get_gender_detector().get_gender(first_name)
+        # Only a certain "male" or "female" counts; "mostly_male" and "mostly_female" are left as None.
+        if detected_gender in {"male", "female"}:
+            gender = detected_gender
+        cls.first_name_gender_cache[first_name] = gender
+        return gender
+
     def assign_gender(self, name):
         gender = None
         name_split = name.split(" ")
@@ -88,50 +222,74 @@ class ProfileParameterCreator(MLAProfiler):
         elif title in self.is_female:
             gender = "female"
         else:
-            first_name = name_split[1]
-            detect = gender_detector.Detector()
-            detected_gender = detect.get_gender(first_name)
-            detected_gender.replace("mostly_", "")  # A more cautious approach to avoid any false positives would
-            # likely wish to remove this line.
-            if detected_gender in {"male", "female"}:
-                gender = detected_gender
+            gender = self.detect_first_name_gender(name_split[1])
         return gender
 
+    def assign_genders(self, names):
+        """Bulk version of assign_gender; returns a dict of name: gender."""
+        return {name: self.assign_gender(name) for name in dict.fromkeys(names)}
+
     def find_constituency_locations(self):
         """Get constituency locations through new API call"""
-        self.base_url = r"http://data.niassembly.gov.uk/members.asmx/GetAllMemberContactDetails?"
+        self.base_url = self.api_root + "/members.asmx/GetAllMemberContactDetails?"
         url = self.base_url + self.current_date
         self.root = self.validate_xml(url)
+        if not self.root:
+            return
         member_constituency_list = [c for c in self.root if c.tag == "Member"]
         self.nia_constituency_list = [c for c in member_constituency_list if
                                       c.find("AddressType").text == "NIA Constituency Address"]
+        self.index_constituency_locations()
 
-    def get_lat_long(self, components):
-        c = components[0]
-        lat, long = c.find("Latitude"), c.find("Longitude")
+    @staticmethod
+    def get_lat_long(component):
+        lat, long = component.find("Latitude"), component.find("Longitude")
         if lat is not None and long is not None:
-            self.lat_long = (lat.text, long.text)
+            try:
+                return float(lat.text), float(long.text)
+            except (TypeError, ValueError):
+                return None
+
+    def index_constituency_locations(self):
+        """Index the (first) constituency address of each member by PersonId, so lookups don't scan the list."""
+        first_component_by_id = {}
+        for c in self.nia_constituency_list:
+            first_component_by_id.setdefault(c.find("PersonId").text, c)
+        self.lat_long_by_person_id = {k: self.get_lat_long(c) for k, c in first_component_by_id.items()}
+
+    @classmethod
+    def haversine_miles_from_stormont(cls, lat_longs):
+        lat_longs = np.radians(np.asarray(lat_longs, dtype=float))
+        lat, long = lat_longs[:, 0], lat_longs[:, 1]
+        stormont_lat, stormont_long = np.radians(cls.stormont_lat_long)
+        a = np.sin((lat - stormont_lat) / 2) ** 2 + \
+            np.cos(lat) * np.cos(stormont_lat) * np.sin((long - stormont_long) / 2) ** 2
+        return 2 * cls.earth_radius_miles * np.arcsin(np.sqrt(a))
+
+    def get_constituency_distances_from_stormont(self, person_ids):
+        """Distances for all of person_ids at once: every coordinate pair not already in distance_cache goes through
+        one vectorised haversine calculation."""
+        lat_longs = {person_id: self.lat_long_by_person_id.get(person_id) for person_id in person_ids}
+        uncached = list({ll for ll in lat_longs.values() if ll is not None and ll not in self.distance_cache})
+        if uncached:
+            self.distance_cache.update(zip(uncached, self.haversine_miles_from_stormont(uncached).tolist()))
+        return {person_id: self.distance_cache[ll] if ll is not None else None for person_id, ll in lat_longs.items()}
 
     def get_constituency_distance_from_stormont(self, person_id):
-        dist = None
-        components = [c for c in self.nia_constituency_list if c.find("PersonId").text == person_id]
-        self.lat_long = None
-        if components:
-            self.get_lat_long(components)
-        if self.lat_long:
-            dist = distance(self.stormont_lat_long, self.lat_long).miles
-        return dist
+        return self.get_constituency_distances_from_stormont([person_id])[person_id]
 
     def create_parameters_from_mla_data(self):
         self.create_named_tuples()
         self.find_constituency_locations()
         mla_param_dict = {}
+        distances_from_stormont = self.get_constituency_distances_from_stormont(
+            [t.person_id for t in self.all_mla_profile_tuples])
+        genders = self.assign_genders([t.member_name for t in self.all_mla_profile_tuples])
         for t in self.all_mla_profile_tuples:
-            name, party, constituency, person_id = list(t)
-            gender = self.assign_gender(name)
-            distance_from_stormont = self.get_constituency_distance_from_stormont(person_id)
+            name, party, constituency, person_id = t
+            gender = genders[name]
 
-            params = [gender, distance_from_stormont, party, constituency, name]
+            params = [gender, distances_from_stormont[person_id], party, constituency, name]
             mla_params = self.MLAParams(*params)
             mla_param_dict[person_id] = mla_params
         return mla_param_dict
@@ -1,35 +1,68 @@
-import spacy
+from concurrent.futures import ProcessPoolExecutor
+import threading
 
-from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.predefined_recognizers import SpacyRecognizer
-from presidio_analyzer.nlp_engine import SpacyNlpEngine
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.anonymizers import Replace
-from presidio_anonymizer.entities import AnonymizerRequest
-from presidio_anonymizer.entities import AnonymizerConfig
+import profile_analysis
 
 
 class HansardTextFormatter:
+    """spaCy and Presidio are only imported (and en_core_web_lg only loaded) when a formatter is created, so importing
+    this module costs nothing. Creating one is slow, so get_shared() gives out one per process."""
+    spacy_model = "en_core_web_lg"
+    score_threshold = 0.5
+    replace_text = "[GDPRREDACT]"
+
+    shared_formatter = None
+    shared_formatter_lock = threading.Lock()
+
     def __init__(self):
+        import spacy
+        from presidio_analyzer import AnalyzerEngine
+        from presidio_analyzer.predefined_recognizers import SpacyRecognizer
+        from presidio_analyzer.nlp_engine import SpacyNlpEngine
+        from presidio_anonymizer import AnonymizerEngine
+        from presidio_anonymizer.anonymizers import Replace
+        from presidio_anonymizer.entities import AnonymizerConfig
+
         SpacyRecognizer.ENTITIES = ["PERSON"]
         Replace.NEW_VALUE = 'replace_text'
         nlp_engine = SpacyNlpEngine()
-        nlp_engine.nlp['en'] = spacy.load('en_core_web_lg', disable=["parser", "tagger", "lemmatizer"])
+        nlp_engine.nlp['en'] = spacy.load(self.spacy_model, disable=["parser", "tagger", "lemmatizer"])
 
         self.analyzer_engine = AnalyzerEngine(nlp_engine=nlp_engine)
         self.anonymizer_engine = AnonymizerEngine()
+        self.anonymizer_config = {"PERSON": AnonymizerConfig("replace", {"replace_text": self.replace_text})}
+
+    @classmethod
+    def get_shared(cls):
+        if HansardTextFormatter.shared_formatter is None:
+            with cls.shared_formatter_lock:
+                if HansardTextFormatter.shared_formatter is None:
+                    HansardTextFormatter.shared_formatter = cls()
+        return HansardTextFormatter.shared_formatter
+
+    @classmethod
+    def get_identity(cls):
+        """Everything that decides what the formatted text comes out as, for keying cached output."""
+        versions = profile_analysis.get_package_versions([cls.spacy_model, "spacy", "presidio-analyzer",
+                                                          "presidio-anonymizer"])
+        return f"{versions};score_threshold={cls.score_threshold};replace_text={cls.replace_text}"
 
     def run_anonymizer(self, text):
+        """Returns the text with any names replaced, or as it was if there weren't any."""
+        if not text:
+            return text
         results = self.analyzer_engine.analyze(text=text,
                                                entities=[],
                                                language='en',
-                                               score_threshold=0.5)
+                                               score_threshold=self.score_threshold)
         if results:
-            config = {"PERSON": AnonymizerConfig("replace", {"replace_text": "[GDPRREDACT]"})}
-            return self.anonymizer_engine.anonymize(text, results, config)
+            return self.anonymizer_engine.anonymize(text, results, self.anonymizer_config)
+        return text
 
     @staticmethod
     def clean_text(text):
+        if not text:
+            return ""
         text = text.replace('\n', '')
         text = text.replace('<BR />', '\n')
         return text
@@ -40,9 +73,60 @@ class HansardTextFormatter:
         return cleaned_text
 
 
+def format_batch(texts):
+    """Formats a batch of texts with this process's shared formatter. (Module level, so worker processes can run it.)"""
+    text_formatter = HansardTextFormatter.get_shared()
+    return [text_formatter.run_formatter(text) for text in texts]
+
+
+class AnonymizationService:
+    """Formats a whole column of speeches at once. Repeated speeches, and any formatted on an earlier run, come from an
+    NLPResultCache keyed by a hash of the text. The rest are split into batches: a single batch is formatted in this
+    process, and more than that are spread over a pool of worker processes, each of which loads its formatter once."""
+    max_workers = 2
+    batch_size = 50
+    use_cache = True
+
+    def __init__(self, max_workers=None, batch_size=None, formatted_cache=None):
+        if max_workers:
+            self.max_workers = max_workers
+        if batch_size:
+            self.batch_size = batch_size
+        self.formatted_cache = formatted_cache
+
+    def get_formatted_cache(self):
+        if self.formatted_cache is None and self.use_cache:
+            self.formatted_cache = profile_analysis.NLPResultCache(HansardTextFormatter.get_identity())
+        return self.formatted_cache
+
+    def format_uncached(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.max_workers <= 1:
+            return [text for batch in batches for text in format_batch(batch)]
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(batches)),
+                                 initializer=HansardTextFormatter.get_shared) as executor:
+            return [text for formatted_batch in executor.map(format_batch, batches) for text in formatted_batch]
+
+    def format_texts(self, texts):
+        texts = [text or "" for text in texts]
+        text_hashes = [profile_analysis.NLPResultCache.hash_text(text) for text in texts]
+
+        formatted_cache = self.get_formatted_cache()
+        outputs_by_hash = formatted_cache.get_many(set(text_hashes)) if formatted_cache else {}
+        misses = {text_hash: text for text_hash, text in zip(text_hashes, texts) if text_hash not in outputs_by_hash}
+        if misses:
+            formatted_texts = self.format_uncached(list(misses.values()))
+            new_outputs = {text_hash: {"formatted_text": formatted_text} for text_hash, formatted_text in
+                           zip(misses.keys(), formatted_texts)}
+            if formatted_cache:
+                formatted_cache.put_many(new_outputs)
+            outputs_by_hash.update(new_outputs)
+        return [outputs_by_hash[text_hash]["formatted_text"] for text_hash in text_hashes]
+
 
-hansard_anon = HansardTextFormatter()
+if __name__ == "__main__":
+    hansard_anon = HansardTextFormatter()
 
-txt = "I assure you, a Cheann Comhairle, that I will stick to the Budget. I am afraid to look at Mervyn in case he thinks that there are any notions."
-anon_txt = hansard_anon.run_anonymizer(txt)
-print(anon_txt)
+    txt = "I assure you, a Cheann Comhairle, that I will stick to the Budget. I am afraid to look at Mervyn in case he thinks that there are any notions."
+    anon_txt = hansard_anon.run_anonymizer(txt)
+    print(anon_txt)
@@ -0,0 +1,188 @@
+"""
+NI Assembly API Stub
+--------------------
+
+Records real responses from data.niassembly.gov.uk into a fixtures directory, and replays them from a local HTTP
+server, so the profile pipeline can be run (and timed) without touching the live API:
+
+    python3 nia_api_stub.py record 2021-02-01 2021-03-01 --fixtures fixtures
+    python3 nia_api_stub.py serve --fixtures fixtures --port 8099 --latency 0.05 --error-rate 0.05
+
+then point the pipeline at it with NIA_API_ROOT=http://127.0.0.1:8099 (or api_root= on XMLGenerator/MLAProfiler).
+
+Fixtures are stored in the same layout as the ResponseCache, one gzipped response per endpoint and date.
+"""
+
+import argparse
+import gzip
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import build_hansard_corpus
+import mla_profiling
+
+
+# Membership and contact details only change now and again, so a date that wasn't recorded gets the closest earlier
+# recording.
+FALL_BACK_TO_EARLIER_DATE = {"members.asmx/GetAllMembersByGivenDate", "members.asmx/GetAllMemberContactDetails"}
+
+EMPTY_RESPONSE = b'<?xml version="1.0" encoding="utf-8"?><ArrayOfItems />'
+
+
+def open_fixtures(fixtures_dir):
+    """Fixtures never expire, whatever their date."""
+    return build_hansard_corpus.ResponseCache(fixtures_dir, immutable_after=timedelta(0), ttl=timedelta.max)
+
+
+def record(start_date, end_date, fixtures_dir, api_root=build_hansard_corpus.API_ROOT):
+    """Saves every Hansard and Members response needed to profile start_date (inclusive) to end_date (exclusive).
+    Returns the number of requests it took."""
+    fixtures = open_fixtures(fixtures_dir)
+
+    xml_generator = build_hansard_corpus.XMLGenerator(start_date, end_date, api_root=api_root)
+    xml_generator.cache, xml_generator.sitting_calendar = fixtures, None
+    xml_generator.run_for_all_dates()
+
+    profiler = mla_profiling.ProfileParameterCreator(start_date, end_date, api_root=api_root)
+    profiler.cache = fixtures
+    profiler.get_all_profiles_for_date_range()
+    profiler.find_constituency_locations()
+
+    return len(xml_generator.request_log) + len(profiler.request_log)
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.wait()
+        if self.server.should_fail():
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        content = self.server.lookup(self.path)
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StubServer(ThreadingHTTPServer):
+    """Replays recorded fixtures. Each response is delayed by latency plus up to jitter seconds, and a share of
+    error_rate requests get a 503 instead. Known endpoints with no recording for a date get an empty array, which is
+    what the live API returns for a day without a sitting; unknown endpoints get a 404."""
+    daemon_threads = True
+
+    def __init__(self, fixtures_dir, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None,
+                 verbose=False):
+        super().__init__((host, port), StubRequestHandler)
+        self.fixtures_dir = fixtures_dir
+        self.fixtures = open_fixtures(fixtures_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.verbose = verbose
+
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def api_root(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def wait(self):
+        with self.random_lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def should_fail(self):
+        with self.random_lock:
+            return self.random.random() < self.error_rate
+
+    def find_earlier_fixture(self, url):
+        path = self.fixtures.get_path(url)
+        endpoint_dir, file_name = os.path.split(path)
+        if not os.path.isdir(endpoint_dir):
+            return None
+        earlier = [f for f in os.listdir(endpoint_dir) if f.endswith(".xml.gz") and f <= file_name]
+        if earlier:
+            with open(os.path.join(endpoint_dir, max(earlier)), "rb") as fixture_file:
+                return fixture_file.read()
+
+    def lookup(self, path):
+        url = self.api_root + path
+        content = self.fixtures.get(url)
+        if content is not None:
+            return content
+
+        endpoint, _ = self.fixtures.split_url(url)
+        if endpoint in FALL_BACK_TO_EARLIER_DATE:
+            earlier_content = self.find_earlier_fixture(url)
+            if earlier_content is not None:
+                return gzip.decompress(earlier_content)
+        if os.path.isdir(os.path.join(self.fixtures_dir, *endpoint.split("/"))):
+            return EMPTY_RESPONSE
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def get_arg_parser():
+    my_parser = argparse.ArgumentParser(description="Record and replay NI Assembly API responses.")
+    subparsers = my_parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("start_date", type=str)
+    record_parser.add_argument("end_date", type=str)
+    record_parser.add_argument("--fixtures", type=str, default="fixtures")
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--fixtures", type=str, default="fixtures")
+    serve_parser.add_argument("--host", type=str, default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8099)
+    serve_parser.add_argument("--latency", type=float, default=0.0)
+    serve_parser.add_argument("--jitter", type=float, default=0.0)
+    serve_parser.add_argument("--error-rate", type=float, default=0.0)
+    serve_parser.add_argument("--seed", type=int, default=None)
+    return my_parser
+
+
+if __name__ == "__main__":
+    args = get_arg_parser().parse_args()
+    if args.command == "record":
+        request_count = record(args.start_date, args.end_date, args.fixtures)
+        print(f"Recorded {request_count} responses to {args.fixtures}")
+    else:
+        server = StubServer(args.fixtures, args.host, args.port, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, seed=args.seed, verbose=True)
+        print(f"Serving {args.fixtures} on {server.api_root}")
+        server.serve_forever()
@@ -13,9 +13,12 @@ or, if you would like a nicely-formatted HTML page to look at:
 This will create output.html in the current directory and, in a browser (tested with Chrome), should look like output.png.
 """
 
-import re
+import csv
+import os
 import sys
 import logging
+from collections import deque
+from functools import lru_cache
 from dask.threaded import get
 
 from ltldoorstep.processor import DoorstepProcessor
@@ -26,10 +29,129 @@ from ltldoorstep.document_utils import load_text, split_into_paragraphs
 # We name some cities - we will do all our comparisons in lowercase to match any casing
 CITIES = ['armagh', 'belfast', 'derry', 'lisburn', 'newry', 'dublin', 'london', 'brussels']
 
+# Alongside them, we look for every place in this gazetteer of NI cities, counties, councils,
+# constituencies, towns and villages - one "name,kind" row per place (add more as you like!)
+# Names that in Hansard mostly mean someone (Whitehead, Malone, Moira), the Assembly itself (Stormont)
+# or nothing in particular (the waterside) are left out, or only listed in a longer form (Malone Road)
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ni_places.csv')
 
-def city_finder(text, rprt):
+
+class PlaceMatcher:
+    """
+    Finds every occurrence of every place name in one pass over a text (an Aho-Corasick
+    automaton), so the time taken doesn't grow with the number of places we look for.
+    Names are matched exactly as given, so pass them in lowercase and search lowercase text.
+
+    With word_boundaries, a name only counts as a whole word (or words) - "derry" is not
+    found in "londonderry" - and any whitespace in the text matches a space in a name, so
+    "lough neagh" is found across a line break. Where names overlap, only the leftmost
+    (and then longest) counts, so "belfast east" is the constituency and not Belfast as well.
+    """
+
+    def __init__(self, places, word_boundaries=False):
+        self.places = list(places)
+        self.word_boundaries = word_boundaries
+
+        # The automaton is a trie of the names: each state is a dict of next character -> state.
+        # `outputs` lists the names that end at each state, as indexes into self.places.
+        self.transitions = [{}]
+        self.outputs = [[]]
+        for place_n, place in enumerate(self.places):
+            state = 0
+            for character in place:
+                if character not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.outputs.append([])
+                    self.transitions[state][character] = len(self.transitions) - 1
+                state = self.transitions[state][character]
+            self.outputs[state].append(place_n)
+
+        # Each state's fallback is the longest suffix of it that is also in the trie - when the
+        # next character doesn't fit, we carry on from there instead of starting again. A state
+        # also ends every name its fallback ends ("londonderry" ends "derry" too).
+        self.fallbacks = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self.transitions[state].items():
+                fallback = self.fallbacks[state]
+                while fallback and character not in self.transitions[fallback]:
+                    fallback = self.fallbacks[fallback]
+                self.fallbacks[next_state] = self.transitions[fallback].get(character, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fallbacks[next_state]]
+                queue.append(next_state)
+
+    def iter_matches(self, text):
+        """Yields (place index, start, end) for every occurrence, overlapping ones included."""
+        state = 0
+        for position, character in enumerate(text, start=1):
+            if self.word_boundaries and character.isspace():
+                character = ' '
+            while state and character not in self.transitions[state]:
+                state = self.fallbacks[state]
+            state = self.transitions[state].get(character, 0)
+            for place_n in self.outputs[state]:
+                start = position - len(self.places[place_n])
+                if self.word_boundaries and not self.is_whole_word(text, start, position):
+                    continue
+                yield place_n, start, position
+
+    @staticmethod
+    def keep_leftmost_longest(matches):
+        """Goes through the matches from the start of the text, keeping each one that starts after the last one
+        kept has ended - of those starting together, the longest - so no kept match falls inside another."""
+        kept_matches = []
+        kept_end = 0
+        for place_n, start, end in sorted(matches, key=lambda match: (match[1], -match[2])):
+            if start >= kept_end:
+                kept_matches.append((place_n, start, end))
+                kept_end = end
+        return kept_matches
+
+    @staticmethod
+    def is_whole_word(text, start, end):
+        return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+    def find_occurrences(self, text):
+        """
+        Returns {place: [(start, end), ...]} for the places found in text, in the order the
+        places were given. Like str.count, occurrences of one name don't overlap each other,
+        though without word_boundaries different names can ("london" and "derry" in "londonderry").
+        """
+        matches = self.iter_matches(text)
+        if self.word_boundaries:
+            matches = self.keep_leftmost_longest(matches)
+        spans_by_place_n = {}
+        for place_n, start, end in matches:
+            spans = spans_by_place_n.setdefault(place_n, [])
+            if not spans or start >= spans[-1][1]:
+                spans.append((start, end))
+        return {self.places[place_n]: spans_by_place_n[place_n] for place_n in sorted(spans_by_place_n)}
+
+
+@lru_cache(maxsize=None)
+def load_gazetteer(gazetteer_path=GAZETTEER_PATH):
     """
-    Add report items to indicate where cities appear, and how often in total
+    Returns {lowercase name: (name, kind)} for CITIES (first, and in order) and then every
+    place in the gazetteer file. Apostrophes are dropped, as split_into_paragraphs drops them.
+    """
+    gazetteer = {city: (city.title(), 'city') for city in CITIES}
+    with open(gazetteer_path, newline='') as gazetteer_file:
+        for row in csv.DictReader(gazetteer_file):
+            place = ' '.join(row['name'].lower().replace("'", '').split())
+            gazetteer.setdefault(place, (row['name'], row['kind']))
+    return gazetteer
+
+
+@lru_cache(maxsize=None)
+def get_place_matcher(gazetteer_path=GAZETTEER_PATH):
+    """The matcher is built the first time it is needed, and reused for every paragraph of every document."""
+    return PlaceMatcher(load_gazetteer(gazetteer_path), word_boundaries=True)
+
+
+def city_finder(text, rprt, gazetteer_path=GAZETTEER_PATH):
+    """
+    Add report items to indicate where cities (and other places) appear, and how often in total
     """
 
     # This doorstep utility splits a big text into paragraphs, and standardizes some of
@@ -37,7 +159,10 @@ def city_finder(text, rprt):
     # than scrolling through highlighted lines in one big document.
     paragraphs = split_into_paragraphs(text)
 
-    # This is our counter for cities - we initialize every city's count to 0
+    # This is our counter for places - we initialize every city's count to 0, and
+    # count any other place from the gazetteer as it turns up
+    gazetteer = load_gazetteer(gazetteer_path)
+    place_matcher = get_place_matcher(gazetteer_path)
     city_counts = {city: 0 for city in CITIES}
 
     # Now we loop through the paragraphs - `enumerate` gives us a running count in `para_n`
@@ -47,76 +172,69 @@ def city_finder(text, rprt):
         # a case insensitive search (others welcome too!)
         paragraph_lower = paragraph.lower()
 
-        # We check this paragraph for city names...
-        for city in CITIES:
-            # This gets a total count for the city
-            city_occurrences = paragraph_lower.count(city)
-
-            # If it's not 0, we will need to add an item to our report
-            if city_occurrences > 0:
-                # ...but first, update our overall count for this city
-                # (we will need this down below)
-                city_counts[city] += city_occurrences
-
-                # To let us highlight words or phrases, we use an "Aspect"
-                # This wraps a phrase/snippet/paragraph, and we add
-                # one or more notes to highlight words or phrases within it.
-                content = AnnotatedTextAspect(paragraph)
-
-                # This loop uses Regular Expressions to search through
-                # all the occurrences of the city's (lowercase) name in the
-                # lowercase paragraph. Note that regular expressions have
-                # their own language for doing more complex searches - because
-                # the `city` variable only contains letters and numbers, this
-                # works easily, but you might need to be careful if searching for something
-                # with punctuation as well.
-                for match in re.finditer(city, paragraph_lower):
-                    # We found an occurrence of the city, now we add it to the report!
-                    # The necessary arguments are:
-                    #    note  - the comment that should pop up
-                    #            if you put your mouse over the highlighted text
-                    #    start_offset and end_offset
-                    #          - where the highlighting should start and end _relative
-                    #            to the paragraph_ in characters.
-                    #    level - which urgency group you want to put it in
-                    #            (logging.INFO, logging.WARNING, logging.ERROR)
-                    #            it's up to you.
-                    #    tags  - (optional) any additional tags you want to make up.
-                    content.add(
-                        note=f'Occurence of {city.title()}',
-                        start_offset=match.start(),
-                        end_offset=match.end(),
-                        level=logging.INFO,
-                        tags=['city']
-                    )
-
-                # Maybe NI's capital gets too much attention? Maybe not?
-                # This will emphasize uses of Belfast by putting them into a
-                # warning group at the top.
-                if city == 'belfast':
-                    urgency = logging.WARNING
-                else:
-                    urgency = logging.INFO
-
-                # Finally, we add our summary for this city in this paragraph to
-                # the overall report.
-                rprt.add_issue(
-                    urgency,
-                    'city-cropped-up',
-                    f'Found {city}',
-                    line_number=line_number,
-                    character_number=0,
-                    content=content
+        # We check this paragraph for place names - the matcher finds all of them in one
+        # pass, giving us the (start, end) of each occurrence of each place that is there
+        for city, spans in place_matcher.find_occurrences(paragraph_lower).items():
+            # First, update our overall count for this place
+            # (we will need this down below)
+            city_counts[city] = city_counts.get(city, 0) + len(spans)
+            name, kind = gazetteer[city]
+
+            # To let us highlight words or phrases, we use an "Aspect"
+            # This wraps a phrase/snippet/paragraph, and we add
+            # one or more notes to highlight words or phrases within it.
+            content = AnnotatedTextAspect(paragraph)
+
+            # This loop goes through all the occurrences of the city's (lowercase)
+            # name in the lowercase paragraph.
+            for start, end in spans:
+                # We found an occurrence of the city, now we add it to the report!
+                # The necessary arguments are:
+                #    note  - the comment that should pop up
+                #            if you put your mouse over the highlighted text
+                #    start_offset and end_offset
+                #          - where the highlighting should start and end _relative
+                #            to the paragraph_ in characters.
+                #    level - which urgency group you want to put it in
+                #            (logging.INFO, logging.WARNING, logging.ERROR)
+                #            it's up to you.
+                #    tags  - (optional) any additional tags you want to make up.
+                content.add(
+                    note=f'Occurence of {name}',
+                    start_offset=start,
+                    end_offset=end,
+                    level=logging.INFO,
+                    tags=[kind]
                 )
 
+            # Maybe NI's capital gets too much attention? Maybe not?
+            # This will emphasize uses of Belfast by putting them into a
+            # warning group at the top.
+            if city == 'belfast':
+                urgency = logging.WARNING
+            else:
+                urgency = logging.INFO
+
+            # Finally, we add our summary for this city in this paragraph to
+            # the overall report.
+            rprt.add_issue(
+                urgency,
+                f'{kind}-cropped-up',
+                f'Found {city}',
+                line_number=line_number,
+                character_number=0,
+                content=content
+            )
+
     # Not all things we want to report have a location in the document - that's OK.
     # Here, we go through and a report item to display the total count for each city
-    # in the entire document.
+    # in the entire document (and for each other place we found).
     for city, total in city_counts.items():
+        name, kind = gazetteer[city]
         rprt.add_issue(
             logging.INFO,
-            'city-totals',
-            f'Found {total} occurrences of {city.title()}'
+            f'{kind}-totals',
+            f'Found {total} occurrences of {name}'
         )
 
     return rprt
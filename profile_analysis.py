@@ -1,140 +1,360 @@
-from collections import namedtuple
+from collections import Counter, namedtuple
+from contextlib import closing
+from datetime import datetime, timedelta
+import hashlib
+from importlib import metadata
+import json
+import numpy as np
+import os
 import re
-import spacy
-from spacytextblob.spacytextblob import SpacyTextBlob
+import sqlite3
+import threading
+
+
+class AnalyticsTable:
+    """Column store for the combined Hansard/member data: one list per field, with every column in the same row order
+    (given by keys). Metric columns are added alongside the existing ones, without copying any of the records."""
+
+    def __init__(self, keys, columns):
+        self.keys = list(keys)
+        self.columns = columns
+
+    @classmethod
+    def from_named_tuples(cls, tuple_dict):
+        records = list(tuple_dict.values())
+        fields = records[0]._fields if records else ()
+        columns = {field: [getattr(r, field) for r in records] for field in fields}
+        return cls(tuple_dict.keys(), columns)
+
+    @property
+    def fields(self):
+        return tuple(self.columns.keys())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def column(self, field):
+        return self.columns[field]
+
+    def add_column(self, field, values):
+        values = list(values)
+        if len(values) != len(self.keys):
+            raise ValueError(f"{field} has {len(values)} values for {len(self.keys)} rows")
+        self.columns[field] = values
+
+    def as_named_tuples(self):
+        """Rebuilds the row-wise {key: namedtuple} view, for anything that still wants records."""
+        Row = namedtuple("Row", self.fields)
+        return {k: Row(*values) for k, values in zip(self.keys, zip(*self.columns.values()))}
+
+
+def get_package_versions(packages):
+    """e.g. "spacy==2.3.5;textblob==0.15.3", read from the installed packages' metadata without importing them."""
+    versions = []
+    for package in packages:
+        try:
+            versions.append(f"{package}=={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package}==unknown")
+    return ";".join(versions)
+
+
+class NLPResultCache:
+    """Per-text NLP outputs (polarity, subjectivity, ...) kept in SQLite between runs, so overlapping date ranges don't
+    re-score speeches they've already seen. Results are keyed by a hash of the text together with the identity of the
+    models that produced them, so upgrading the model or any of the libraries it relies on starts afresh."""
+    cache_dir = os.environ.get("NIA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             ".nia_cache"))
+    file_name = "nlp_results.sqlite3"
+    # Stays under SQLite's default limit on the number of variables in one statement.
+    lookup_chunk_size = 500
+
+    def __init__(self, model_identity, cache_dir=None):
+        self.model_identity = model_identity
+        if cache_dir:
+            self.cache_dir = cache_dir
+        self.path = os.path.join(self.cache_dir, self.file_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS nlp_results "
+                         "(text_hash TEXT NOT NULL, model TEXT NOT NULL, outputs TEXT NOT NULL, "
+                         "PRIMARY KEY (text_hash, model))")
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, text_hashes):
+        """Returns {text_hash: outputs dict} for whichever of text_hashes have been stored for this model."""
+        text_hashes = list(text_hashes)
+        found = {}
+        with closing(sqlite3.connect(self.path)) as conn:
+            for i in range(0, len(text_hashes), self.lookup_chunk_size):
+                chunk = text_hashes[i:i + self.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT text_hash, outputs FROM nlp_results "
+                                    f"WHERE model = ? AND text_hash IN ({placeholders})", [self.model_identity, *chunk])
+                found.update((text_hash, json.loads(outputs)) for text_hash, outputs in rows)
+        return found
+
+    def put_many(self, outputs_by_hash):
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO nlp_results (text_hash, model, outputs) VALUES (?, ?, ?)",
+                             [(text_hash, self.model_identity, json.dumps(outputs))
+                              for text_hash, outputs in outputs_by_hash.items()])
 
 
 class AnalyticsCreator:
     """Adds desired datapoints to each hansard element in the inputted named_tuple. This class acts a bit like a
-    library of different methods that can be incorporateed as and when they are desired."""
-
-    def __init__(self, combined_dict):
-        self.combined_dict = combined_dict
-        self.current_tup = None
-        self.CountAddedTuple = None
-        self.new_field_name = None
+    library of different methods that can be incorporateed as and when they are desired.
+
+    The data is held as an AnalyticsTable, and each analytic is computed over a whole column and added as a new one.
+    Sentiment is worked out in one batched pass: every speech goes through nlp.pipe once, and both polarity and
+    subjectivity are read off the same Doc. Speeches already scored on an earlier run are taken from the
+    NLPResultCache instead, and the model is only loaded if there is anything left to score."""
+    spacy_model = "en_core_web_md"
+    sentiment_batch_size = 64
+    sentiment_n_process = 1
+    # SpacyTextBlob only looks at the text, so the tagger, parser and NER are never loaded.
+    spacy_disabled_components = ["tagger", "parser", "ner"]
+    use_nlp_cache = True
+
+    # The model is loaded once per process, on first use, and shared by every AnalyticsCreator (one per day when days
+    # are worked out separately). Its pipeline isn't meant to be run from several threads at once, so nlp_lock
+    # takes turns.
+    shared_nlp = None
+    nlp_lock = threading.Lock()
+
+    # The tokenizer: markup such as <BR /> is dropped, and a word is a run of letters or digits, which may be joined
+    # by apostrophes or hyphens ("Comhairle's", "cross-border") or be a number like "2.5" or "1,000". A sentence runs
+    # from a word to a run of ., ! or ? followed by a space, or to the end of the speech.
+    markup_pattern = re.compile(r"<[^>]*>")
+    word_pattern = re.compile(r"\w+(?:['’-]\w+|[.,]\d+)*")
+    sentence_pattern = re.compile(r"\w.*?(?:[.!?]+(?=\s|$)|$)", re.DOTALL)
+
+    def __init__(self, combined_dict, sentiment_batch_size=None, sentiment_n_process=None, nlp_cache=None):
+        self.table = AnalyticsTable.from_named_tuples(combined_dict)
 
         self.analytics_to_add_dict = {}
 
         self.nlp = None
-
-    def create_named_tuple_with_additional_analytic(self):
-        for d in self.combined_dict.items():
-            print(d)
-        first_key = list(self.combined_dict.keys())[0]
-        a_current_named_tuple = self.combined_dict[first_key]
-        print(a_current_named_tuple._fields)
-        return namedtuple("NewTuple", a_current_named_tuple._fields + (self.new_field_name,))
+        self.sentiments = None
+        self.token_counts = None
+        self.nlp_cache = nlp_cache
+        if sentiment_batch_size:
+            self.sentiment_batch_size = sentiment_batch_size
+        if sentiment_n_process:
+            self.sentiment_n_process = sentiment_n_process
+
+    def tokenize(self):
+        """The tokenization stage: runs over the whole corpus once, and keeps the word, sentence and character count of
+        every speech for each of the word-level metrics to use. Characters are counted once markup is dropped and runs
+        of whitespace are collapsed."""
+        if self.token_counts is None:
+            texts = [self.markup_pattern.sub(" ", text) if text else "" for text in self.table.column("hansard_text")]
+            word_counts = [len(self.word_pattern.findall(text)) for text in texts]
+            sentence_counts = [len(self.sentence_pattern.findall(text)) for text in texts]
+            character_counts = [len(" ".join(text.split())) for text in texts]
+            self.token_counts = {"word_count": word_counts, "sentence_count": sentence_counts,
+                                 "character_count": character_counts}
+        return self.token_counts
 
     def get_word_count(self):
-        word_count = 0
-        if self.current_tup.hansard_text:
-            word_list = self.current_tup.hansard_text.split(" ")
-            word_count = len(word_list)
-        return word_count
+        return self.tokenize()["word_count"]
+
+    def get_sentence_count(self):
+        return self.tokenize()["sentence_count"]
+
+    def get_character_count(self):
+        return self.tokenize()["character_count"]
 
     def get_whether_interrupted(self):
-        is_interrupted = 0
-        interjection = self.current_tup.interjection
-        if interjection:
-            if re.fullmatch(r".*Interruption.*", interjection):
-                is_interrupted = 1
-        return is_interrupted
+        interruption = re.compile(r".*Interruption.*")
+        return [1 if interjection and interruption.fullmatch(interjection) else 0 for interjection in
+                self.table.column("interjection")]
 
     def preprocessing_spacy(self):
-        """This is loaded first to avoid re-loading on every iteration."""
+        """This is loaded first to avoid re-loading on every iteration. spaCy itself is only imported here, so nothing
+        heavy is loaded until there is a speech that isn't in the NLPResultCache."""
         if not self.nlp:
-            self.nlp = spacy.load("en_core_web_md")
-            spacy_text_blob = SpacyTextBlob()
-            self.nlp.add_pipe(spacy_text_blob)
+            self.nlp = self.get_shared_nlp()
+
+    @classmethod
+    def get_shared_nlp(cls):
+        if AnalyticsCreator.shared_nlp is None:
+            with cls.nlp_lock:
+                if AnalyticsCreator.shared_nlp is None:
+                    import spacy
+                    from spacytextblob.spacytextblob import SpacyTextBlob
+
+                    nlp = spacy.load(cls.spacy_model, disable=cls.spacy_disabled_components)
+                    spacy_text_blob = SpacyTextBlob()
+                    nlp.add_pipe(spacy_text_blob)
+                    AnalyticsCreator.shared_nlp = nlp
+        return AnalyticsCreator.shared_nlp
+
+    @classmethod
+    def get_model_identity(cls):
+        """Names every package that has a say in the sentiment scores, with its version, without loading the model."""
+        return get_package_versions([cls.spacy_model, "spacy", "spacytextblob", "textblob"])
+
+    def get_nlp_cache(self):
+        if self.nlp_cache is None and self.use_nlp_cache:
+            self.nlp_cache = NLPResultCache(self.get_model_identity())
+        return self.nlp_cache
+
+    def run_nlp(self, texts_by_hash):
+        """Parses each text once, in batches, returning {text_hash: outputs} with both sentiment values taken from the
+        same Doc."""
+        self.preprocessing_spacy()
+        outputs_by_hash = {}
+        with self.nlp_lock:
+            docs = self.nlp.pipe(texts_by_hash.values(), batch_size=self.sentiment_batch_size,
+                                 n_process=self.sentiment_n_process)
+            for text_hash, doc in zip(texts_by_hash.keys(), docs):
+                sentiment = doc._.sentiment
+                outputs_by_hash[text_hash] = {"polarity": sentiment.polarity, "subjectivity": sentiment.subjectivity}
+        return outputs_by_hash
+
+    def get_sentiments(self):
+        """Keeps the (polarity, subjectivity) of every speech. Cached results are looked up in one go, and only the
+        speeches that missed (each distinct text once) are sent to the NLP stage."""
+        if self.sentiments is None:
+            nlp_cache = self.get_nlp_cache()
+            texts = [text or "" for text in self.table.column("hansard_text")]
+            text_hashes = [NLPResultCache.hash_text(text) for text in texts]
+
+            outputs_by_hash = nlp_cache.get_many(set(text_hashes)) if nlp_cache else {}
+            misses = {text_hash: text for text_hash, text in zip(text_hashes, texts)
+                      if text_hash not in outputs_by_hash}
+            if misses:
+                new_outputs = self.run_nlp(misses)
+                if nlp_cache:
+                    nlp_cache.put_many(new_outputs)
+                outputs_by_hash.update(new_outputs)
+
+            self.sentiments = [(outputs_by_hash[text_hash]["polarity"], outputs_by_hash[text_hash]["subjectivity"])
+                               for text_hash in text_hashes]
+        return self.sentiments
 
     def get_sentiment_subjectivity(self):
-        text = self.current_tup.hansard_text
-        doc = self.nlp(text)
-        subjectivity = doc._.sentiment.subjectivity
-        print(subjectivity)
-        return subjectivity
+        return [subjectivity for _, subjectivity in self.get_sentiments()]
 
     def get_sentiment_polarity(self):
-        text = self.current_tup.hansard_text
-        doc = self.nlp(text)
-        polarity = doc._.sentiment.polarity
-        print(polarity)
-        return polarity
+        return [polarity for polarity, _ in self.get_sentiments()]
 
-    def add_datapoint_to_named_tuple(self, func_to_add, prepocessing_func=None):
+    def add_datapoint_column(self, field_name, func_to_add, prepocessing_func=None):
         if prepocessing_func:
             prepocessing_func()
-        NewTuple = self.create_named_tuple_with_additional_analytic()
-        for k, tup in self.combined_dict.items():
-            self.current_tup = tup
-            word_count = func_to_add()
-            new_tuple = NewTuple(*tup, word_count)
-            self.combined_dict[k] = new_tuple
+        self.table.add_column(field_name, func_to_add())
 
     def add_word_count(self):
-        self.new_field_name = "word_count"
-        self.add_datapoint_to_named_tuple(self.get_word_count)
+        self.add_datapoint_column("word_count", self.get_word_count)
 
     def compile_analytics_to_add_dict(self):
         self.analytics_to_add_dict = {
             "word_count": [self.get_word_count],
+            "sentence_count": [self.get_sentence_count],
+            "character_count": [self.get_character_count],
             "interruptions_count": [self.get_whether_interrupted],
-            "subjectivity": [self.get_sentiment_subjectivity, self.preprocessing_spacy],
-            "polarity": [self.get_sentiment_subjectivity, self.preprocessing_spacy]
+            "subjectivity": [self.get_sentiment_subjectivity],
+            "polarity": [self.get_sentiment_polarity]
         }
 
-    def add_to_tuple(self):
+    def add_analytics(self):
         self.compile_analytics_to_add_dict()
         for field_name, functions_list in self.analytics_to_add_dict.items():
             get_function = functions_list[0]
             preprocessor = None
             if len(functions_list) == 2:
                 preprocessor = functions_list[1]
-            self.new_field_name = field_name
-            self.add_datapoint_to_named_tuple(get_function, prepocessing_func=preprocessor)
-        for d in self.combined_dict.items():
-            print(d)
-        return self.combined_dict
+            self.add_datapoint_column(field_name, get_function, prepocessing_func=preprocessor)
+        return self.table
 
 
 class ProportionCalculator:
     """In order to extract meaning from e.g. no. of words spoken by gender, we need to know the underlying
     distribution of MLAs."""
 
-
     def __init__(self, mla_param_dict, desired_identifiers):
         self.mla_param_dict = mla_param_dict
+        self.mla_table = AnalyticsTable.from_named_tuples(mla_param_dict)
         self.desired_identifiers = desired_identifiers
 
         self.proportions_dict = {}
-        self.current_tup = None
 
     def get_proportions(self, identifier):
-        tuple_list = [v for v in self.mla_param_dict.values()]
-        dict_list = [v._asdict() for v in tuple_list]
-        identifier_count = {}
-        for d in dict_list:
-            id_output = d[identifier]
-            count_value = identifier_count.get(id_output)
-            if count_value:
-                identifier_count[id_output] += 1
-            else:
-                identifier_count[id_output] = 1
-
+        identifier_count = Counter(self.mla_table.column(identifier))
         total_count = sum([v for v in identifier_count.values()])
 
         identifier_as_proportion = {k: v / total_count for k, v in identifier_count.items()}
         return identifier_as_proportion
 
     def get_all_proportions(self):
-        sample_named_tuple = [v for v in self.mla_param_dict.values()][0]
-        all_identifiers = [i for i in self.desired_identifiers if i in sample_named_tuple._fields]
+        all_identifiers = [i for i in self.desired_identifiers if i in self.mla_table.fields]
         all_identifier_counts = list(map(self.get_proportions, all_identifiers))
         identifier_counts_dict = dict(zip(all_identifiers, all_identifier_counts))
         return identifier_counts_dict
 
 
+class GroupedAggregator:
+    """Totals every metric column for every group of every identifier column at once. Each identifier column is
+    encoded as integer group codes (groups keep the order they first appear in), offset so that all identifiers share
+    one code space, and a single np.bincount over (group code, metric) pairs gives every sum. Rows are added in table
+    order, so the sums come out exactly as a running total over the rows would."""
+
+    def __init__(self, table, identifiers, metrics):
+        self.table = table
+        self.identifiers = list(identifiers)
+        self.metrics = list(metrics)
+
+        self.sums = {}
+        self.counts = {}
+
+    @staticmethod
+    def encode(column):
+        group_codes = {}
+        codes = np.fromiter((group_codes.setdefault(value, len(group_codes)) for value in column), dtype=np.intp,
+                            count=len(column))
+        return list(group_codes), codes
+
+    def aggregate(self):
+        """Fills self.sums with {identifier: {metric: {group: total}}} and self.counts with
+        {identifier: {group: rows}}."""
+        row_count, metric_count = len(self.table), len(self.metrics)
+
+        group_ranges = {}
+        code_columns = []
+        group_count = 0
+        for identifier in self.identifiers:
+            groups, codes = self.encode(self.table.column(identifier))
+            group_ranges[identifier] = (group_count, groups)
+            code_columns.append(codes + group_count)
+            group_count += len(groups)
+
+        codes = np.stack(code_columns, axis=1) if code_columns else np.empty((row_count, 0), dtype=np.intp)
+        metric_values = np.array([self.table.column(metric) for metric in self.metrics],
+                                 dtype=np.float64).reshape(metric_count, row_count).T
+
+        flat_index = (codes[:, :, np.newaxis] * metric_count + np.arange(metric_count)).ravel()
+        weights = np.broadcast_to(metric_values[:, np.newaxis, :],
+                                  (row_count, len(self.identifiers), metric_count)).ravel()
+        sums = np.bincount(flat_index, weights=weights, minlength=group_count * metric_count)
+        sums = sums.reshape(group_count, metric_count)
+        counts = np.bincount(codes.ravel(), minlength=group_count)
+
+        for identifier, (first_code, groups) in group_ranges.items():
+            group_sums = sums[first_code:first_code + len(groups)].tolist()
+            self.sums[identifier] = {metric: {group: group_sums[i][j] for i, group in enumerate(groups)}
+                                     for j, metric in enumerate(self.metrics)}
+            self.counts[identifier] = dict(zip(groups, counts[first_code:first_code + len(groups)].tolist()))
+        return self.sums
+
+    def get_group_means(self, identifier, metric):
+        """The mean within each group, as opposed to DiscreteAnalyticsCreator's share of the overall mean."""
+        return {group: total / self.counts[identifier][group] for group, total in self.sums[identifier][metric].items()}
+
+
 class DiscreteAnalyticsCreator:
     """Groups analytics at the hansard component level into chosen identifiers with a meaningfully limited number of
     discrete groups"""
@@ -142,9 +362,12 @@ class DiscreteAnalyticsCreator:
     get_mean_metrics = {"subjectivity", "polarity"}
     get_proportional = {"word_count", "interruptions_count"}
 
-    def __init__(self, combined_analytics_dict, proportions_dict):
-        self.combined_analytics_dict = combined_analytics_dict
+    def __init__(self, combined_analytics_table, proportions_dict, partial_aggregate=None):
+        """Either works from the analytics table itself, or (with table None) from a PartialAggregate that already has
+        the totals."""
+        self.combined_analytics_table = combined_analytics_table
         self.proportions_dict = proportions_dict
+        self.partial_aggregate = partial_aggregate
 
         self.desired_identifiers = None
         self.desired_metrics = None
@@ -153,30 +376,30 @@ class DiscreteAnalyticsCreator:
         self.current_metric = None
 
         self.current_identifier_count = {}
-        self.totalizer_dicts = {}
-
-    def get_tuples_as_dict(self):
-        tuple_list = [v for v in self.combined_analytics_dict.values()]
-        dict_list = [v._asdict() for v in tuple_list]
-        return dict_list
+        self.aggregator = None
+
+    @property
+    def speech_count(self):
+        if self.partial_aggregate is not None:
+            return self.partial_aggregate.speech_count
+        return len(self.combined_analytics_table)
+
+    def totalize_all(self):
+        """Sums every desired metric for every desired identifier in one go."""
+        if self.partial_aggregate is not None:
+            self.aggregator = self.partial_aggregate
+            return
+        self.aggregator = GroupedAggregator(self.combined_analytics_table, self.desired_identifiers,
+                                            self.desired_metrics)
+        self.aggregator.aggregate()
 
     def totalize_metric_for_identifier(self):
-        dict_list = self.get_tuples_as_dict()
-
-        self.current_identifier_count = {}
-        for d in dict_list:
-            id_output = d[self.current_identifier]
-            identifier_grouping = self.current_identifier_count.get(id_output)
-
-            identifier_value = d[self.current_metric]
-
-            if identifier_grouping:
-                self.current_identifier_count[id_output] += identifier_value
-            else:
-                self.current_identifier_count[id_output] = identifier_value
+        self.current_identifier_count = self.aggregator.sums[self.current_identifier][self.current_metric]
 
     def calculate_average(self):
-        identifier_average = {k: v / len(self.combined_analytics_dict) for k, v in
+        """Each group's total over the number of speeches overall (rather than in the group), so the group values add
+        up to the overall mean."""
+        identifier_average = {k: v / self.speech_count for k, v in
                               self.current_identifier_count.items()}
         return identifier_average
 
@@ -205,6 +428,7 @@ class DiscreteAnalyticsCreator:
 
     def get_all_desired_metrics_for_all_desired_identifiers(self):
         overall_analytics_summary = {identifier: {} for identifier in self.desired_identifiers}
+        self.totalize_all()
         for identifier in self.desired_identifiers:
             self.current_identifier = identifier
             for metric in self.desired_metrics:
@@ -213,3 +437,151 @@ class DiscreteAnalyticsCreator:
                 calc_output_dict = self.run_calculation()
                 overall_analytics_summary[identifier][metric] = calc_output_dict
         return overall_analytics_summary
+
+
+class PartialAggregate:
+    """Everything the discrete analytics need from some set of days, in a form where the partials for two sets of
+    days merge into the partial for both: the number of speeches, each identifier group's number of speeches and total
+    of every metric, and the identifiers of every member sitting over those days (for the proportions).
+
+    Totals are added up day by day rather than row by row, so a merged mean can differ from a whole-range run in its
+    last bit or so."""
+
+    def __init__(self, identifiers, metrics, speech_count=0, group_totals=None, members=None):
+        self.identifiers = list(identifiers)
+        self.metrics = list(metrics)
+        self.speech_count = speech_count
+        # {identifier: {group: [speech count, {metric: total}]}}, groups in the order they were first seen.
+        self.group_totals = group_totals if group_totals is not None else {i: {} for i in self.identifiers}
+        # {person id: {identifier: group}}
+        self.members = members if members is not None else {}
+
+    @classmethod
+    def from_table(cls, table, mla_param_dict, identifiers, metrics):
+        partial = cls(identifiers, metrics, len(table))
+        if len(table):
+            aggregator = GroupedAggregator(table, partial.identifiers, partial.metrics)
+            aggregator.aggregate()
+            for identifier in partial.identifiers:
+                partial.group_totals[identifier] = {
+                    group: [count, {metric: aggregator.sums[identifier][metric][group] for metric in partial.metrics}]
+                    for group, count in aggregator.counts[identifier].items()}
+        partial.members = {person_id: {identifier: getattr(params, identifier) for identifier in partial.identifiers}
+                           for person_id, params in mla_param_dict.items()}
+        return partial
+
+    @classmethod
+    def merge(cls, *partials):
+        """Partials should be given in date order, which keeps groups in the order a whole-range run would see them
+        and, like the MLAProfiler, keeps the first-seen identifiers for a member."""
+        merged = cls(partials[0].identifiers, partials[0].metrics)
+        for partial in partials:
+            merged.speech_count += partial.speech_count
+            for identifier, groups in partial.group_totals.items():
+                merged_groups = merged.group_totals.setdefault(identifier, {})
+                for group, (count, totals) in groups.items():
+                    merged_count, merged_totals = merged_groups.setdefault(group, [0, {m: 0 for m in totals}])
+                    merged_groups[group][0] = merged_count + count
+                    for metric, total in totals.items():
+                        merged_totals[metric] = merged_totals.get(metric, 0) + total
+            for person_id, member_identifiers in partial.members.items():
+                merged.members.setdefault(person_id, member_identifiers)
+        return merged
+
+    @property
+    def sums(self):
+        """{identifier: {metric: {group: total}}}, as GroupedAggregator gives them."""
+        return {identifier: {metric: {group: totals[metric] for group, (_, totals) in groups.items()}
+                             for metric in self.metrics}
+                for identifier, groups in self.group_totals.items()}
+
+    @property
+    def counts(self):
+        return {identifier: {group: count for group, (count, _) in groups.items()}
+                for identifier, groups in self.group_totals.items()}
+
+    def get_member_params(self):
+        """The members as {person id: namedtuple}, which is what ProportionCalculator takes."""
+        MemberIdentifiers = namedtuple("MemberIdentifiers", self.identifiers)
+        return {person_id: MemberIdentifiers(**member_identifiers)
+                for person_id, member_identifiers in self.members.items()}
+
+    def to_json(self):
+        # Groups can be None, which JSON keys can't, so they're kept as [group, count, totals] lists.
+        return json.dumps({
+            "identifiers": self.identifiers,
+            "metrics": self.metrics,
+            "speech_count": self.speech_count,
+            "group_totals": {identifier: [[group, count, totals] for group, (count, totals) in groups.items()]
+                             for identifier, groups in self.group_totals.items()},
+            "members": self.members,
+        })
+
+    @classmethod
+    def from_json(cls, partial_json):
+        loaded = json.loads(partial_json)
+        group_totals = {identifier: {group: [count, totals] for group, count, totals in groups}
+                        for identifier, groups in loaded["group_totals"].items()}
+        return cls(loaded["identifiers"], loaded["metrics"], loaded["speech_count"], group_totals, loaded["members"])
+
+
+class PartialAggregateStore:
+    """One PartialAggregate per day, kept in SQLite between runs so a date range only has to fetch, parse, match and
+    score the days it hasn't seen before. Hansard for recent days can still be revised, so (like the ResponseCache) a
+    partial stored when its day was older than immutable_after is kept for good, and any other is only reused for ttl
+    after it was stored. Partials are keyed by an identity covering the models, the identifiers and the metrics, so
+    changing any of them starts afresh."""
+    cache_dir = NLPResultCache.cache_dir
+    file_name = "day_partials.sqlite3"
+    immutable_after = timedelta(days=14)
+    ttl = timedelta(hours=6)
+    date_format = "%Y-%m-%d"
+    # Bump when the way a day's partial is worked out changes.
+    partial_version = 2
+
+    def __init__(self, identifiers, metrics, cache_dir=None, immutable_after=None, ttl=None):
+        self.identity = ";".join([f"partials=={self.partial_version}", AnalyticsCreator.get_model_identity(),
+                                  ",".join(identifiers), ",".join(metrics)])
+        if cache_dir:
+            self.cache_dir = cache_dir
+        if immutable_after is not None:
+            self.immutable_after = immutable_after
+        if ttl is not None:
+            self.ttl = ttl
+        self.path = os.path.join(self.cache_dir, self.file_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS day_partials "
+                         "(day TEXT NOT NULL, identity TEXT NOT NULL, partial TEXT NOT NULL, "
+                         "stored_at REAL NOT NULL DEFAULT 0, PRIMARY KEY (day, identity))")
+            # Stores from before stored_at was kept only had immutable days; their rows count as stored at 0, so
+            # they're worked out once more and then kept for good again.
+            if "stored_at" not in [row[1] for row in conn.execute("PRAGMA table_info(day_partials)")]:
+                conn.execute("ALTER TABLE day_partials ADD COLUMN stored_at REAL NOT NULL DEFAULT 0")
+
+    def is_fresh(self, day, stored_at):
+        stored_at = datetime.fromtimestamp(stored_at)
+        is_immutable = stored_at - datetime.strptime(day, self.date_format) > self.immutable_after
+        return is_immutable or datetime.now() - stored_at < self.ttl
+
+    def get_many(self, days):
+        """Returns {day: PartialAggregate} for whichever of days have been stored."""
+        days = list(days)
+        found = {}
+        with closing(sqlite3.connect(self.path)) as conn:
+            for i in range(0, len(days), NLPResultCache.lookup_chunk_size):
+                chunk = days[i:i + NLPResultCache.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT day, partial, stored_at FROM day_partials "
+                                    f"WHERE identity = ? AND day IN ({placeholders})", [self.identity, *chunk])
+                found.update((day, PartialAggregate.from_json(partial)) for day, partial, stored_at in rows
+                             if self.is_fresh(day, stored_at))
+        return found
+
+    def put_many(self, partials_by_day):
+        stored_at = datetime.now().timestamp()
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO day_partials (day, identity, partial, stored_at) "
+                             "VALUES (?, ?, ?, ?)",
+                             [(day, self.identity, partial.to_json(), stored_at)
+                              for day, partial in partials_by_day.items()])
@@ -1,54 +1,342 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, date, datetime
 from collections import deque, namedtuple
+from urllib.parse import urlsplit, parse_qsl
 import re
 
 """These classes form a similar function to hansard_prepper/py but also collects relevant 'Procedure Lines'  such as 
 [Interruption.], [Laughter.], etc.
 
 It also allows to create a corpus/document based on a date range.
+
+Set NIA_API_ROOT (e.g. to a local nia_api_stub.py server) to use something other than the live API.
 """
 
+API_ROOT = os.environ.get("NIA_API_ROOT", "http://data.niassembly.gov.uk")
+
+
+class ResponseCache:
+    """Keeps raw API responses on disk as gzipped XML, one file per endpoint and date.
+
+    Past sittings and past membership lists don't change, so anything dated more than immutable_after ago is kept
+    for good. More recent dates (and requests with no date) may still be updated on the API side, so they are
+    re-fetched once the cached copy is older than ttl."""
+    cache_dir = os.environ.get("NIA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             ".nia_cache"))
+    immutable_after = timedelta(days=14)
+    ttl = timedelta(hours=6)
+
+    def __init__(self, cache_dir: str = None, immutable_after: timedelta = None, ttl: timedelta = None):
+        if cache_dir:
+            self.cache_dir = cache_dir
+        if immutable_after is not None:
+            self.immutable_after = immutable_after
+        if ttl is not None:
+            self.ttl = ttl
+
+    @staticmethod
+    def split_url(url):
+        """e.g. .../hansard.asmx/GetHansardComponentsByPlenaryDate?plenaryDate=2021-02-01 gives
+        ("hansard.asmx/GetHansardComponentsByPlenaryDate", "2021-02-01"). GetAllMemberContactDetails takes its date
+        as a bare query string (...?2021-02-01), which is used as it is."""
+        split = urlsplit(url)
+        endpoint = split.path.strip("/")
+        query_values = [v for _, v in parse_qsl(split.query)]
+        date_ = query_values[0] if query_values else split.query
+        return endpoint, date_
+
+    def get_path(self, url):
+        endpoint, date_ = self.split_url(url)
+        file_name = re.sub(r"[^\w\-]", "_", date_) or "_"
+        return os.path.join(self.cache_dir, *endpoint.split("/"), f"{file_name}.xml.gz")
+
+    def is_immutable(self, date_):
+        try:
+            dt_date = datetime.strptime(date_, "%Y-%m-%d")
+        except ValueError:
+            return False
+        return datetime.now() - dt_date > self.immutable_after
+
+    def is_fresh(self, path, date_):
+        if self.is_immutable(date_):
+            return True
+        cached_at = datetime.fromtimestamp(os.path.getmtime(path))
+        return datetime.now() - cached_at < self.ttl
+
+    def get(self, url):
+        path = self.get_path(url)
+        if not os.path.exists(path) or not self.is_fresh(path, self.split_url(url)[1]):
+            return None
+        with gzip.open(path, "rb") as cache_file:
+            return cache_file.read()
+
+    @staticmethod
+    def open_tmp_file(path, mode="wb"):
+        """A new, uniquely named file next to path, to be written and then renamed over it: a concurrent reader never
+        sees a half-written file, and concurrent writers (threads or processes) never share a tmp file."""
+        return tempfile.NamedTemporaryFile(mode=mode, dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.",
+                                           suffix=".tmp", delete=False)
+
+    def put(self, url, content):
+        path = self.get_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.open_tmp_file(path) as tmp_file:
+            with gzip.GzipFile(fileobj=tmp_file, mode="wb") as cache_file:
+                cache_file.write(content)
+        os.replace(tmp_file.name, path)
+
+
+class SittingCalendar:
+    """A persisted record of which dates had a plenary sitting, so that later runs only ask for dates worth asking for.
+
+    A date is requested if it is a known sitting, or if it isn't known yet and falls on one of sitting_weekdays.
+    Dates without a sitting are only remembered once they're older than immutable_after, since a recent date may
+    simply not have been published yet.
+
+    Several calendars may be open on the same file at once (one per day's fetch in the Dask workflow), so save()
+    merges what is already on disk with what this one has recorded, rather than overwriting it."""
+    sitting_weekdays = {0, 1, 2, 3, 4}
+    date_format = "%Y-%m-%d"
+    save_lock = threading.Lock()
+
+    def __init__(self, path: str = None, immutable_after: timedelta = None):
+        self.path = path or os.path.join(ResponseCache.cache_dir, "sitting_calendar.json")
+        self.immutable_after = immutable_after if immutable_after is not None else ResponseCache.immutable_after
+        self.sittings = self.load()
+
+    def load(self):
+        """A calendar that can't be read is only a lost optimisation, so it's started again rather than failing."""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as calendar_file:
+                return json.load(calendar_file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable sitting calendar {self.path}: {e}")
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.save_lock:
+            self.sittings = {**self.load(), **self.sittings}
+            with ResponseCache.open_tmp_file(self.path, mode="w") as calendar_file:
+                json.dump(self.sittings, calendar_file, indent=1, sort_keys=True)
+            os.replace(calendar_file.name, self.path)
+
+    def should_request(self, date_):
+        sitting = self.sittings.get(date_)
+        if sitting is not None:
+            return sitting
+        return datetime.strptime(date_, self.date_format).weekday() in self.sitting_weekdays
+
+    def record(self, date_, sitting):
+        is_immutable = datetime.now() - datetime.strptime(date_, self.date_format) > self.immutable_after
+        if sitting or is_immutable:
+            self.sittings[date_] = sitting
+
 
 class HansardXMLValidator:
-    """Occasionally the XML string creates a ParseError Exception which needs to be caught."""
+    """Occasionally the XML string creates a ParseError Exception which needs to be caught.
+
+    Responses that parse are kept in a ResponseCache, so re-running over an overlapping date range only hits the API
+    for dates that haven't been seen (or that are recent enough to have changed). Set cache_responses = False to
+    always go to the API.
+
+    All requests go through one keep-alive session, shared by every validator in the process. Timeouts, connection errors and 5xx responses are retried with
+    exponential backoff (backoff_factor * 2 ** retry seconds) up to max_retries times, and every request's latency and
+    retry count is kept in request_log."""
+    cache_responses = True
+
+    timeout = 30
+    max_retries = 3
+    backoff_factor = 0.5
+    retry_statuses = {500, 502, 503, 504}
+    pool_maxsize = 10
+
+    RequestStats = namedtuple("RequestStats", ["url", "status_code", "latency", "retries"])
+
+    # {(pid, pool size): session}. Validators are made per day and per stage, so sharing lets them reuse connections
+    # rather than each opening its own and never closing them; the pid keeps forked workers off their parent's sockets.
+    sessions = {}
+    sessions_lock = threading.Lock()
 
     def __init__(self):
         self.hansard_exceptions_list = []
         self.current_request = None
+        self.cache = ResponseCache() if self.cache_responses else None
+
+        self.session = self.get_session()
+        self.request_log = []
+
+    def get_session(self):
+        pool_size = max(self.pool_maxsize, getattr(self, "max_workers", 1))
+        key = (os.getpid(), pool_size)
+        with self.sessions_lock:
+            if key not in HansardXMLValidator.sessions:
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                HansardXMLValidator.sessions[key] = session
+            return HansardXMLValidator.sessions[key]
 
-    def valid_request(self):
-        status = self.current_request.status_code
+    @staticmethod
+    def valid_request(request):
+        status = request.status_code
         if status != 200:
             print(f"Bad Request: {status}")
-            print(self.current_request)
+            print(request)
             return False
         return True
 
-    def xml_exception_catcher(self):
-        current_request_as_text = self.current_request.text
-        print(current_request_as_text)
+    def xml_exception_catcher(self, content):
         try:
-            et_request = ET.fromstring(current_request_as_text)
+            et_request = ET.fromstring(content)
         except ET.ParseError:
-            self.hansard_exceptions_list.append(("ParseError", current_request_as_text))
+            self.hansard_exceptions_list.append(("ParseError", content))
             et_request = None
         return et_request
 
+    def get_with_retries(self, url):
+        retries = 0
+        start = time.perf_counter()
+        while True:
+            request, error = None, None
+            try:
+                request = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if request is not None and request.status_code not in self.retry_statuses:
+                break
+            if retries >= self.max_retries:
+                break
+            time.sleep(self.backoff_factor * 2 ** retries)
+            retries += 1
+
+        status_code = request.status_code if request is not None else None
+        self.request_log.append(self.RequestStats(url, status_code, time.perf_counter() - start, retries))
+        if error is not None:
+            print(f"Request failed after {retries} retries: {error}")
+            self.hansard_exceptions_list.append(("RequestError", url, error))
+        elif retries:
+            print(f"Request needed {retries} retries: {url}")
+        return request
+
+    def get_content(self, url):
+        """Returns the raw response body, or None for a bad request."""
+        request = self.get_with_retries(url)
+        self.current_request = request
+        if request is None:
+            return None
+        if self.valid_request(request):
+            return request.content
+        self.hansard_exceptions_list.append(("BadRequest", url, request.status_code))
+
+    def get_request_summary(self):
+        latencies = [r.latency for r in self.request_log]
+        return {
+            "requests": len(self.request_log),
+            "retries": sum(r.retries for r in self.request_log),
+            "failed": len([r for r in self.request_log if r.status_code != 200]),
+            "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "max_latency": max(latencies, default=0.0),
+        }
+
+    def has_failed_requests(self):
+        """Whether any request went unanswered (even after retries), or answered with something that couldn't be
+        read - in which case what was fetched may be missing data."""
+        return bool(self.hansard_exceptions_list) or any(r.status_code != 200 for r in self.request_log)
+
+    def get_cached_content(self, url):
+        """Returns the raw response body and whether it came from the cache."""
+        content = self.cache.get(url) if self.cache else None
+        if content is not None:
+            return content, True
+        return self.get_content(url), False
+
     def validate_xml(self, url):
-        self.current_request = requests.get(url)
-        xml_root = self.xml_exception_catcher()
-        if all([self.valid_request(), xml_root]):
+        """The response is passed around explicitly (rather than read back from self.current_request) so that this
+        can be called from several threads at once."""
+        content, from_cache = self.get_cached_content(url)
+        if content is None:
+            return None
+        xml_root = self.xml_exception_catcher(content)
+        if xml_root is not None and self.cache and not from_cache:
+            self.cache.put(url, content)
+        if xml_root:
             return xml_root
 
+    @staticmethod
+    def get_child_text(element, tag):
+        child = element.find(tag)
+        if child is not None:
+            return child.text
+
+    def iterparse_xml(self, url, root_tag, tags):
+        """Streaming alternative to validate_xml. Rather than building the whole tree, this walks the response with
+        iterparse and keeps only the text of the given child tags of each root_tag element, clearing every element
+        as soon as it has been read. Returns a list of tuples (one per root_tag element), or None."""
+        content, from_cache = self.get_cached_content(url)
+        if content is None:
+            return None
+        records = []
+        try:
+            context = ET.iterparse(io.BytesIO(content), events=("start", "end"))
+            _, root = next(context)
+            for event, element in context:
+                if event == "end" and element.tag == root_tag:
+                    records.append(tuple(self.get_child_text(element, tag) for tag in tags))
+                    root.clear()
+        except ET.ParseError:
+            self.hansard_exceptions_list.append(("ParseError", content))
+            return None
+        if self.cache and not from_cache:
+            self.cache.put(url, content)
+        return records
+
 
 class XMLGenerator(HansardXMLValidator):
-    """Validates and compiles XML files into a linked list for a given date range."""
-    date_input_format = "%Y-%m-%d"
-    base_url = r"http://data.niassembly.gov.uk/hansard.asmx/GetHansardComponentsByPlenaryDate?plenaryDate="
+    """Validates and compiles XML files into a linked list for a given date range.
+
+    Days are requested concurrently on a bounded thread pool of max_workers threads (1 gives the old serial
+    behaviour). Results are always consumed in date order, so the output doesn't depend on the concurrency.
+
+    With streaming set (the default) each day is read with iterparse_xml, so the list for each day holds lightweight
+    StreamedRecord tuples rather than Elements. Set streaming = False to get the full Elements back.
 
-    def __init__(self, start_date: str, end_date: str):
+    Unless use_sitting_calendar is switched off, plenary dates are looked up in a SittingCalendar first, so weekends
+    and days already known to have had no sitting aren't requested at all."""
+    date_input_format = "%Y-%m-%d"
+    api_root = API_ROOT
+    endpoint = "/hansard.asmx/GetHansardComponentsByPlenaryDate?plenaryDate="
+    base_url = api_root + endpoint
+    max_workers = 4
+
+    streaming = True
+    HansardComponentFields = namedtuple("HansardComponentFields", ["component_id", "component_type",
+                                                                   "component_text"])
+    streamed_tags = ["ComponentId", "ComponentType", "ComponentText"]
+    StreamedRecord = HansardComponentFields
+
+    use_sitting_calendar = True
+
+    def __init__(self, start_date: str, end_date: str, max_workers: int = None, api_root: str = None):
+        # Set before the session is created, so its connection pool is big enough for every worker.
+        if max_workers:
+            self.max_workers = max_workers
+        if api_root:
+            self.api_root = api_root
+            self.base_url = api_root + self.endpoint
         super().__init__()
         self.start_date = datetime.strptime(start_date, self.date_input_format)
         self.end_date = datetime.strptime(end_date, self.date_input_format)
@@ -60,29 +348,89 @@ class XMLGenerator(HansardXMLValidator):
         self.valid_xml_list = deque()
         self.parse_errors_log = []
 
+        self.sitting_calendar = SittingCalendar() if self.use_sitting_calendar else None
+
     def create_date_range_iterator(self):
         """start_date inclusive; end_date exclusive."""
         for n in range(int((self.end_date - self.start_date).days)):
             dt_date = self.start_date + timedelta(n)
             yield dt_date.strftime("%Y-%m-%d")
 
+    def get_root_components_for_date(self, date_, root_tag):
+        url = self.base_url + date_
+        if self.streaming:
+            records = self.iterparse_xml(url, root_tag, self.streamed_tags)
+            if records is not None:
+                return [self.StreamedRecord(*r) for r in records]
+            return None
+        root = self.validate_xml(url)
+        if root:
+            return [c for c in root if c.tag == root_tag]
+
     def filter_root_components(self, root_tag):
-        url = self.base_url + self.current_date
-        self.root = self.validate_xml(url)
-        if self.root:
-            hansard_components = [c for c in self.root if c.tag == root_tag]
-            return hansard_components
+        return self.get_root_components_for_date(self.current_date, root_tag)
+
+    def fetch_all_dates(self, root_tag, dates=None):
+        """Yields (date, components) for every date in the range (or in dates, if given), in date order, whatever
+        order the requests complete in. Only a couple of days per worker are fetched ahead of the consumer, so a slow
+        consumer doesn't cause the whole range to pile up in memory."""
+        if dates is None:
+            dates = self.create_date_range_iterator()
+        max_pending = 2 * self.max_workers
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for date_ in dates:
+                pending.append((date_, executor.submit(self.get_root_components_for_date, date_, root_tag)))
+                if len(pending) > max_pending:
+                    pending_date, future = pending.popleft()
+                    yield pending_date, future.result()
+            while pending:
+                pending_date, future = pending.popleft()
+                yield pending_date, future.result()
 
-    def get_valid_xml_string_if_contains_required_component(self, hansard_components):
+    @staticmethod
+    def get_component_type(component):
+        if isinstance(component, ET.Element):
+            return component.find("ComponentType").text
+        return component.component_type
+
+    def contains_required_component(self, hansard_components):
         # We're only interested in documents that contain spoken text:
-        if any([c for c in hansard_components if c.find("ComponentType").text == "Spoken Text"]):
+        if not hansard_components:
+            return False
+        return any([c for c in hansard_components if self.get_component_type(c) == "Spoken Text"])
+
+    def get_valid_xml_string_if_contains_required_component(self, hansard_components):
+        if self.contains_required_component(hansard_components):
             self.valid_xml_list.append(hansard_components)
 
+    def get_plenary_dates(self):
+        dates = self.create_date_range_iterator()
+        if self.sitting_calendar:
+            dates = [d for d in dates if self.sitting_calendar.should_request(d)]
+        return dates
+
+    def record_sitting(self, date_, hansard_components):
+        # None means the request failed, so we can't say either way.
+        if self.sitting_calendar and hansard_components is not None:
+            self.sitting_calendar.record(date_, self.contains_required_component(hansard_components))
+
+    def iter_valid_xml(self):
+        """Generator version of run_for_all_dates: yields each valid day's components without keeping them, so it
+        can be handed straight to CorpusBuilder."""
+        try:
+            for date_, hansard_components in self.fetch_all_dates("HansardComponent", self.get_plenary_dates()):
+                self.current_date = date_
+                self.record_sitting(date_, hansard_components)
+                if self.contains_required_component(hansard_components):
+                    yield hansard_components
+        finally:
+            if self.sitting_calendar:
+                self.sitting_calendar.save()
+        print(self.get_request_summary())
+
     def run_for_all_dates(self):
-        for date_ in self.create_date_range_iterator():
-            self.current_date = date_
-            hansard_components = self.filter_root_components("HansardComponent")
-            self.get_valid_xml_string_if_contains_required_component(hansard_components)
+        self.valid_xml_list.extend(self.iter_valid_xml())
 
 
 class CorpusBuilder:
@@ -92,94 +440,114 @@ class CorpusBuilder:
     all_component_types = {re.compile("Speaker.*"), 'Question', 'Division', 'Time', 'Bill Text', 'Written Statement',
                            'Procedure Line', 'Plenary Item Text', 'Header', 'Spoken Text', 'Document Title', 'Quote'}
     desired_component_types = {'Question', 'Procedure Line', 'Spoken Text'}
-    procedures_to_add = {re.compile(r"\[Interruption.*"), re.compile(r"\[Laughter.*")}
+    procedures_to_add = re.compile(r"\[Interruption.*|\[Laughter.*")
     SpeakerComponent = namedtuple("SpeakerComponent", ["speaker", "text", "interjection"])
     unwanted_speaker_pattern = re.compile(r".*\sSpeaker.*|A\sMember|Some Members")
+    # Whether the final speech, which has no next speaker to finish it, is yielded too.
+    yield_last_speech = False
 
-    def __init__(self, valid_xml_list):
+    def __init__(self, valid_xml_list, yield_last_speech=None):
         self.valid_xml_list = valid_xml_list
+        if yield_last_speech is not None:
+            self.yield_last_speech = yield_last_speech
 
         self.all_questions = deque()
 
-        self.component_id = None
-        self.component_type = None  # Current Hansard Component Type
-        self.component_text = None
-        self.speech_tup = self.SpeakerComponent(None, None, None)
-
         self.speech_dict = {}
         self.component_error_log = []
 
-    def get_component_id(self, component):
-        self.component_id = component.find("ComponentId").text
+        # Component type: handler. "Speaker ..." types vary, so they're added the first time each one is seen.
+        self.component_handlers = {
+            "Question": self.collate_questions,
+            "Spoken Text": self.add_spoken_text,
+            "Procedure Line": self.add_procedure_line,
+        }
 
-    def identify_component_type_and_text(self, component):
-        self.component_type = component.find("ComponentType").text
-        self.component_text = component.find("ComponentText").text
+    @staticmethod
+    def as_component_fields(component):
+        """Components may be full Elements or the records streamed by XMLGenerator."""
+        if isinstance(component, ET.Element):
+            return XMLGenerator.HansardComponentFields(component.find("ComponentId").text,
+                                                       component.find("ComponentType").text,
+                                                       component.find("ComponentText").text)
+        return component
+
+    def get_component_handler(self, component_type):
+        try:
+            return self.component_handlers[component_type]
+        except KeyError:
+            handler = self.add_new_speaker if component_type.startswith("Speaker") else None
+            self.component_handlers[component_type] = handler
+            return handler
 
-    def collate_questions(self):
-        self.all_questions.append(self.component_text)
+    # Each handler takes the speech in progress and the component, and returns the speech in progress along with any
+    # speech it has just finished (or None).
 
-    def remove_parentheses(self):
+    def collate_questions(self, speech_tup, component_type, component_text):
+        self.all_questions.append(component_text)
+        return speech_tup, None
+
+    @staticmethod
+    def remove_parentheses(speaker):
         """Some speakers' ministerial position is given in parentheses; these need to be removed for matching."""
-        split_speaker = self.component_text.split("(", maxsplit=1)
-        self.component_text = split_speaker[0].strip()
+        split_speaker = speaker.split("(", maxsplit=1)
+        return split_speaker[0].strip()
 
-    def add_new_speaker(self):
-        if self.speech_tup.speaker:
-            self.speech_dict[self.component_id] = self.speech_tup
-        self.component_text = self.component_text.replace(":", "")
-        self.remove_parentheses()
-        self.speech_tup = self.SpeakerComponent(self.component_text, None, None)
+    def add_new_speaker(self, speech_tup, component_type, component_text):
+        finished_speech = speech_tup if speech_tup.speaker else None
+        speaker = self.remove_parentheses(component_text.replace(":", ""))
+        return self.SpeakerComponent(speaker, None, None), finished_speech
 
-    def add_to_error_log(self):
+    def add_to_error_log(self, speech_tup, component_type, component_text):
         """This provides a reference of any examples of a speaker being given without any speech."""
-        self.component_error_log.append((self.speech_tup, self.component_type, self.component_text))
-
-    def add_spoken_text(self):
-        if self.speech_tup.speaker and not self.speech_tup.text:
-            self.speech_tup = self.speech_tup._replace(text=self.component_text)
-        else:
-            self.add_to_error_log()
-
-    def add_procedure_line(self):
-        if self.speech_tup.speaker and self.speech_tup.text and not self.speech_tup.interjection:
-            if any([re.fullmatch(regex, self.component_text) for regex in self.procedures_to_add]):
-                self.speech_tup = self.speech_tup._replace(interjection=self.component_text)
-
-    def remove_unwanted_speakers(self):
-        """Remove the assembly speaker and other non-MLAs"""
-        self.speech_dict = {
-            k: v for k, v in self.speech_dict.items() if not
-            re.fullmatch(self.unwanted_speaker_pattern, v.speaker)
-        }
+        self.component_error_log.append((speech_tup, component_type, component_text))
+
+    def add_spoken_text(self, speech_tup, component_type, component_text):
+        if speech_tup.speaker and not speech_tup.text:
+            return speech_tup._replace(text=component_text), None
+        self.add_to_error_log(speech_tup, component_type, component_text)
+        return speech_tup, None
+
+    def add_procedure_line(self, speech_tup, component_type, component_text):
+        if speech_tup.speaker and speech_tup.text and not speech_tup.interjection:
+            if self.procedures_to_add.fullmatch(component_text):
+                return speech_tup._replace(interjection=component_text), None
+        return speech_tup, None
+
+    def is_unwanted_speaker(self, speaker):
+        """The assembly speaker and other non-MLAs"""
+        return self.unwanted_speaker_pattern.fullmatch(speaker) is not None
+
+    def iter_speaker_components(self):
+        """Reads every component once, in order, and yields (component id, SpeakerComponent) as each speech is
+        finished. A speech is finished by the next speaker, and is keyed by that speaker's component id. (So the last
+        speech in the corpus is only yielded with yield_last_speech - keyed by the last component read, and only if it
+        got further than its speaker.)"""
+        speech_tup = self.SpeakerComponent(None, None, None)
+        component_id, speech_start_id = None, None
+        for components in self.valid_xml_list:
+            for component in components:
+                component_id, component_type, component_text = self.as_component_fields(component)
+                handler = self.get_component_handler(component_type)
+                if handler is None:
+                    continue
+                speech_tup, finished_speech = handler(speech_tup, component_type, component_text)
+                if handler == self.add_new_speaker:
+                    speech_start_id = component_id
+                if finished_speech and not self.is_unwanted_speaker(finished_speech.speaker):
+                    yield component_id, finished_speech
+        if self.yield_last_speech and speech_tup.speaker and component_id != speech_start_id and \
+                not self.is_unwanted_speaker(speech_tup.speaker):
+            yield component_id, speech_tup
 
     def create_speaker_text_dict(self):
-        for components in self.valid_xml_list:
-            relevant_components = [c for c in components if c.find("ComponentType").text in
-                                   self.desired_component_types or
-                                   re.fullmatch("Speaker.*", c.find("ComponentType").text)]
-            for component in relevant_components:
-                self.get_component_id(component)
-                self.identify_component_type_and_text(component)
-                if self.component_type == "Question":
-                    self.collate_questions()
-                elif re.fullmatch("Speaker.*", self.component_type):
-                    self.add_new_speaker()
-                elif self.component_type == "Spoken Text":
-                    self.add_spoken_text()
-                elif self.component_type == "Procedure Line":
-                    print(self.component_text)
-                    self.add_procedure_line()
-                else:
-                    self.component_error_log.append(
-                        ("Not called on main method", self.component_type, self.component_text))
-        self.remove_unwanted_speakers()
+        self.speech_dict = dict(self.iter_speaker_components())
         return self.speech_dict
 
 
+import threading
 import gender_guesser.detector as gender_detector
-from geopy.distance import distance
-from geopy import Nominatim
+import numpy as np
 from collections import namedtuple
 
 """The purpose of these classes is to extract the data necessary to assign speakers a 'profile' based on
@@ -187,18 +555,28 @@ parameters of interest. The 'Members' API on the niassembly page provides useful
 
 The ability to get a comprehensive list of members by any given date is particularly handy when looking at changes to 
 data over time. However, having to iterate through a member list for each date can cause a significant bottleneck 
-for larger date requests."""
+for larger date requests. Since membership only changes a few times a year, MLAProfiler instead samples the member 
+list every timeline_sample_days and bisects between samples only where the set of members differs. (A member who joins 
+and leaves again between two samples would be missed, so keep the interval well below any tenure of interest.)"""
 
 
 class MLAProfiler(XMLGenerator):
-    base_url = r"http://data.niassembly.gov.uk/members.asmx/GetAllMembersByGivenDate?specificDate="
+    endpoint = "/members.asmx/GetAllMembersByGivenDate?specificDate="
+    base_url = API_ROOT + endpoint
 
     MLAInfo = namedtuple("MLAInfo", ["member_name", "party", "constituency", "person_id"])
     xml_member_tag_types = ["MemberFullDisplayName", "PartyName", "ConstituencyName", "PersonId"]
     tag_to_tuple_dict = dict(zip(xml_member_tag_types, MLAInfo._fields))
+    streamed_tags = xml_member_tag_types
+    StreamedRecord = MLAInfo
+    # Membership has to be checked on any date, not just sitting days.
+    use_sitting_calendar = False
 
-    def __init__(self, start_date, end_date):
-        super().__init__(start_date, end_date)
+    use_membership_timeline = True
+    timeline_sample_days = 60
+
+    def __init__(self, start_date, end_date, max_workers=None, api_root=None):
+        super().__init__(start_date, end_date, max_workers, api_root)
         self.root = None
         self.all_member_xml = []
         self.current_member_ids = {}
@@ -211,6 +589,10 @@ class MLAProfiler(XMLGenerator):
 
         self.all_mla_profile_tuples = []
 
+        self.dates = []
+        self.members_by_date_index = {}
+        self.membership_intervals = {}
+
     def add_to_info_dict_for_named_tuple(self):
         if self.tag in self.xml_member_tag_types:
             tup_name = self.tag_to_tuple_dict[self.tag]
@@ -219,23 +601,108 @@ class MLAProfiler(XMLGenerator):
     def build_new_tuple(self):
         self.current_named_tuple = self.MLAInfo(**self.mla_info_dict)
 
+    def get_person_id(self, member_components):
+        if isinstance(member_components, self.MLAInfo):
+            return member_components.person_id
+        return member_components.find("PersonId").text
+
+    def add_new_members(self, member_components):
+        new_member_components = [c for c in member_components if self.get_person_id(c) not in
+                                 self.current_member_ids.keys()]
+        for c in new_member_components:
+            self.current_member_ids[self.get_person_id(c)] = c
+
+    def store_members(self, date_index, member_components):
+        """Returns whether there was a member list to store. A failed fetch is left out rather than stored as nobody
+        being a member, which would look like a change in membership on either side of it."""
+        if member_components is None:
+            print(f"No member list for {self.dates[date_index]}")
+            return False
+        self.members_by_date_index[date_index] = {self.get_person_id(c): c for c in member_components}
+        return True
+
+    def get_member_ids(self, date_index):
+        return set(self.members_by_date_index[date_index].keys())
+
+    def bisect_membership(self, low, high):
+        """Fetches dates between two already-fetched date indexes until every change in membership between them is
+        pinned to the day it happened. If both ends have the same members, nothing between them is fetched."""
+        if high - low <= 1 or self.get_member_ids(low) == self.get_member_ids(high):
+            return
+        middle = (low + high) // 2
+        if not self.store_members(middle, self.get_root_components_for_date(self.dates[middle], "Member")):
+            # Without the middle date, the change can't be pinned down any further, so it's put down to high.
+            return
+        self.bisect_membership(low, middle)
+        self.bisect_membership(middle, high)
+
+    def build_membership_intervals(self):
+        """After bisecting, membership is constant from each fetched date up to the next one, so each member's
+        validity intervals (start inclusive, end exclusive) can be read straight off the fetched dates."""
+        fetched_indexes = sorted(self.members_by_date_index.keys())
+        end_indexes = fetched_indexes[1:] + [len(self.dates)]
+        self.membership_intervals = {}
+        for start_index, end_index in zip(fetched_indexes, end_indexes):
+            end_date = self.dates[end_index] if end_index < len(self.dates) else self.end_date.strftime("%Y-%m-%d")
+            for person_id in self.get_member_ids(start_index):
+                intervals = self.membership_intervals.setdefault(person_id, [])
+                if intervals and intervals[-1][1] == self.dates[start_index]:
+                    intervals[-1] = (intervals[-1][0], end_date)
+                else:
+                    intervals.append((self.dates[start_index], end_date))
+
+    def build_membership_timeline(self):
+        self.dates = list(self.create_date_range_iterator())
+        if not self.dates:
+            return
+        sample_indexes = list(range(0, len(self.dates), self.timeline_sample_days))
+        if sample_indexes[-1] != len(self.dates) - 1:
+            sample_indexes.append(len(self.dates) - 1)
+
+        sample_dates = [self.dates[i] for i in sample_indexes]
+        for date_index, (_, member_components) in zip(sample_indexes, self.fetch_all_dates("Member", sample_dates)):
+            self.store_members(date_index, member_components)
+        # Samples that couldn't be fetched are skipped, so each bisection runs between two real member lists.
+        fetched_indexes = [i for i in sample_indexes if i in self.members_by_date_index]
+        for low, high in zip(fetched_indexes, fetched_indexes[1:]):
+            self.bisect_membership(low, high)
+
+        self.build_membership_intervals()
+        for date_index in sorted(self.members_by_date_index.keys()):
+            self.add_new_members(self.members_by_date_index[date_index].values())
+        self.current_date = self.dates[-1]
+
     def get_all_profiles_for_date_range(self):
-        for date_ in self.create_date_range_iterator():
-            self.current_date = date_
-            member_components = self.filter_root_components("Member")
-            new_member_components = [c for c in member_components if c.find("PersonId").text not in
-                                     self.current_member_ids.keys()]
-            for c in new_member_components:
-                self.current_member_ids[c.find("PersonId").text] = c
+        if self.use_membership_timeline:
+            self.build_membership_timeline()
+        else:
+            self.dates = list(self.create_date_range_iterator())
+            for date_index, (date_, member_components) in enumerate(self.fetch_all_dates("Member", self.dates)):
+                self.current_date = date_
+                self.store_members(date_index, member_components)
+                if member_components:
+                    self.add_new_members(member_components)
+            self.build_membership_intervals()
+        print(self.get_request_summary())
+
+    def get_member_ids_on(self, date_):
+        """The PersonIds of everyone who was a member on date_ (within the date range), read off membership_intervals,
+        so one fetch of the range answers for each of its days."""
+        return {person_id for person_id, intervals in self.membership_intervals.items()
+                if any(start <= date_ < end for start, end in intervals)}
 
     def create_named_tuples(self):
         self.get_all_profiles_for_date_range()
         member_profiles = [v for v in self.current_member_ids.values()]
         for member_components in member_profiles:
-            for component in member_components:
-                self.tag, self.text = component.tag, component.text
-                self.add_to_info_dict_for_named_tuple()
-            self.build_new_tuple()
+            if isinstance(member_components, self.MLAInfo):
+                # Streamed members are already in the shape we want.
+                self.current_named_tuple = member_components
+            else:
+                for component in member_components:
+                    self.tag, self.text = component.tag, component.text
+                    self.add_to_info_dict_for_named_tuple()
+                self.build_new_tuple()
             self.all_mla_profile_tuples.append(self.current_named_tuple)
             print(self.current_named_tuple)
 
@@ -246,17 +713,52 @@ class ProfileParameterCreator(MLAProfiler):
     # out of this range. Still worth considering any oversights here.
 
     stormont_lat_long = (54.592997628, -5.835329992)
+    earth_radius_miles = 3958.7613
+    # (latitude, longitude): miles from Stormont. Shared, since constituency offices rarely move.
+    distance_cache = {}
+
+    # Loading the detector parses its whole name database, so it's only done once per process, on first use.
+    gender_detector = None
+    gender_detector_lock = threading.Lock()
+    first_name_gender_cache = {}
 
     MLAParams = namedtuple("MLAParams", ["gender", "distance", "party", "constituency", "name"])
 
-    def __init__(self, start_date, end_date):
-        super().__init__(start_date, end_date)
+    def __init__(self, start_date, end_date, max_workers=None, api_root=None):
+        super().__init__(start_date, end_date, max_workers, api_root)
         self.nia_constituency_list = []
-        self.lat_long = None
-        self.locator = Nominatim(user_agent="lintol_processor")
+        self.lat_long_by_person_id = {}
+        self.locator = None
 
         self.not_all_params_available = []
 
+    def get_locator(self):
+        """geopy is only imported once a geocoder is actually wanted."""
+        if self.locator is None:
+            from geopy import Nominatim
+            self.locator = Nominatim(user_agent="lintol_processor")
+        return self.locator
+
+    @classmethod
+    def get_gender_detector(cls):
+        if ProfileParameterCreator.gender_detector is None:
+            with cls.gender_detector_lock:
+                if ProfileParameterCreator.gender_detector is None:
+                    ProfileParameterCreator.gender_detector = gender_detector.Detector()
+        return ProfileParameterCreator.gender_detector
+
+    @classmethod
+    def detect_first_name_gender(cls, first_name):
+        if first_name in cls.first_name_gender_cache:
+            return cls.first_name_gender_cache[first_name]
+        gender = None
+        detected_gender = cls.get_gender_detector().get_gender(first_name)
+        # Only a certain "male" or "female" counts; "mostly_male" and "mostly_female" are left as None.
+        if detected_gender in {"male", "female"}:
+            gender = detected_gender
+        cls.first_name_gender_cache[first_name] = gender
+        return gender
+
     def assign_gender(self, name):
         gender = None
         name_split = name.split(" ")
@@ -266,50 +768,74 @@ class ProfileParameterCreator(MLAProfiler):
         elif title in self.is_female:
             gender = "female"
         else:
-            first_name = name_split[1]
-            detect = gender_detector.Detector()
-            detected_gender = detect.get_gender(first_name)
-            detected_gender.replace("mostly_", "")  # A more cautious approach to avoid any false positives would
-            # likely wish to remove this line.
-            if detected_gender in {"male", "female"}:
-                gender = detected_gender
+            gender = self.detect_first_name_gender(name_split[1])
         return gender
 
+    def assign_genders(self, names):
+        """Bulk version of assign_gender; returns a dict of name: gender."""
+        return {name: self.assign_gender(name) for name in dict.fromkeys(names)}
+
     def find_constituency_locations(self):
         """Get constituency locations through new API call"""
-        self.base_url = r"http://data.niassembly.gov.uk/members.asmx/GetAllMemberContactDetails?"
+        self.base_url = self.api_root + "/members.asmx/GetAllMemberContactDetails?"
         url = self.base_url + self.current_date
         self.root = self.validate_xml(url)
+        if not self.root:
+            return
         member_constituency_list = [c for c in self.root if c.tag == "Member"]
         self.nia_constituency_list = [c for c in member_constituency_list if
                                       c.find("AddressType").text == "NIA Constituency Address"]
+        self.index_constituency_locations()
 
-    def get_lat_long(self, components):
-        c = components[0]
-        lat, long = c.find("Latitude"), c.find("Longitude")
+    @staticmethod
+    def get_lat_long(component):
+        lat, long = component.find("Latitude"), component.find("Longitude")
         if lat is not None and long is not None:
-            self.lat_long = (lat.text, long.text)
+            try:
+                return float(lat.text), float(long.text)
+            except (TypeError, ValueError):
+                return None
+
+    def index_constituency_locations(self):
+        """Index the (first) constituency address of each member by PersonId, so lookups don't scan the list."""
+        first_component_by_id = {}
+        for c in self.nia_constituency_list:
+            first_component_by_id.setdefault(c.find("PersonId").text, c)
+        self.lat_long_by_person_id = {k: self.get_lat_long(c) for k, c in first_component_by_id.items()}
+
+    @classmethod
+    def haversine_miles_from_stormont(cls, lat_longs):
+        lat_longs = np.radians(np.asarray(lat_longs, dtype=float))
+        lat, long = lat_longs[:, 0], lat_longs[:, 1]
+        stormont_lat, stormont_long = np.radians(cls.stormont_lat_long)
+        a = np.sin((lat - stormont_lat) / 2) ** 2 + \
+            np.cos(lat) * np.cos(stormont_lat) * np.sin((long - stormont_long) / 2) ** 2
+        return 2 * cls.earth_radius_miles * np.arcsin(np.sqrt(a))
+
+    def get_constituency_distances_from_stormont(self, person_ids):
+        """Distances for all of person_ids at once: every coordinate pair not already in distance_cache goes through
+        one vectorised haversine calculation."""
+        lat_longs = {person_id: self.lat_long_by_person_id.get(person_id) for person_id in person_ids}
+        uncached = list({ll for ll in lat_longs.values() if ll is not None and ll not in self.distance_cache})
+        if uncached:
+            self.distance_cache.update(zip(uncached, self.haversine_miles_from_stormont(uncached).tolist()))
+        return {person_id: self.distance_cache[ll] if ll is not None else None for person_id, ll in lat_longs.items()}
 
     def get_constituency_distance_from_stormont(self, person_id):
-        dist = None
-        components = [c for c in self.nia_constituency_list if c.find("PersonId").text == person_id]
-        self.lat_long = None
-        if components:
-            self.get_lat_long(components)
-        if self.lat_long:
-            dist = distance(self.stormont_lat_long, self.lat_long).miles
-        return dist
+        return self.get_constituency_distances_from_stormont([person_id])[person_id]
 
     def create_parameters_from_mla_data(self):
         self.create_named_tuples()
         self.find_constituency_locations()
         mla_param_dict = {}
+        distances_from_stormont = self.get_constituency_distances_from_stormont(
+            [t.person_id for t in self.all_mla_profile_tuples])
+        genders = self.assign_genders([t.member_name for t in self.all_mla_profile_tuples])
         for t in self.all_mla_profile_tuples:
-            name, party, constituency, person_id = list(t)
-            gender = self.assign_gender(name)
-            distance_from_stormont = self.get_constituency_distance_from_stormont(person_id)
+            name, party, constituency, person_id = t
+            gender = genders[name]
 
-            params = [gender, distance_from_stormont, party, constituency, name]
+            params = [gender, distances_from_stormont[person_id], party, constituency, name]
             mla_params = self.MLAParams(*params)
             mla_param_dict[person_id] = mla_params
         return mla_param_dict
@@ -326,6 +852,9 @@ misleading matches which we'd want to avoid.
 
 The matching process is not comprehensive - what if two MLAs of the same gender have the same surname AND initial? This 
 is yet to be accounted for.
+
+Each matching pass (title + surname, title + initial + surname, title + double-barrelled surname) is held as a
+name: PersonId index, so each distinct Hansard speaker string is resolved with a few dictionary lookups, once.
 """
 
 
@@ -348,15 +877,22 @@ class HansardToMemberConnector:
         self.unmatched_components_dict = {}
         self.current_unmatched_speech = {}
 
-    def get_speech_data(self):
+        self.speaker_indexes = []
+        self.resolved_speakers = {}
+
+        self.profile_parameter_creator = None
+
+    def get_speech_data(self, yield_last_speech=None):
         valid_xmls = XMLGenerator(self.start_date, self.end_date)
-        valid_xmls.run_for_all_dates()
-        corp = CorpusBuilder(valid_xmls.valid_xml_list)
+        # Days are parsed as they arrive rather than all being held in valid_xml_list first.
+        corp = CorpusBuilder(valid_xmls.iter_valid_xml(), yield_last_speech=yield_last_speech)
         self.all_speech = corp.create_speaker_text_dict()
         return self.all_speech
 
     def get_mla_data(self):
         ppc = ProfileParameterCreator(self.start_date, self.end_date)
+        # Kept, so its request log can be checked afterwards.
+        self.profile_parameter_creator = ppc
         self.mla_profile_dicts = ppc.create_parameters_from_mla_data()
         return self.mla_profile_dicts
 
@@ -373,22 +909,36 @@ class HansardToMemberConnector:
         self.dupe_speakers = {k: v for k, v in speaker_name_dict.items() if k in duplicate_keys}
 
     def update_unmatched_components(self):
-        self.current_unmatched_speech = {k: v for k, v in self.current_unmatched_speech.items() if
+        self.current_unmatched_speech = {k: v for k, v in self.all_speech.items() if
                                          k not in self.matched_components_dict.keys()}
-        for d in self.current_unmatched_speech.items():
-            print(d)
 
-    def match_hansard_to_speaker(self, hansard_dict_item, speaker_dict):
-        component_id, speech_tup = hansard_dict_item
-        for speaker_id, speaker in speaker_dict.items():
-            if speech_tup.speaker == speaker:
-                self.matched_components_dict[component_id] = speaker_id
-                break
+    @staticmethod
+    def normalise_name(name):
+        return " ".join(name.split())
 
-    def title_surname_match(self):
-        for hansard_dict_item in self.all_speech.items():
-            self.match_hansard_to_speaker(hansard_dict_item, self.deduped_speakers)
-        self.update_unmatched_components()
+    def index_speaker_dict(self, speaker_dict):
+        """Inverts a PersonId: name dict. Where two members share a name the first one wins, as it always has."""
+        speaker_index = {}
+        for speaker_id, speaker in speaker_dict.items():
+            speaker_index.setdefault(self.normalise_name(speaker), speaker_id)
+        return speaker_index
+
+    def build_speaker_indexes(self):
+        # In the order the passes are tried.
+        self.speaker_indexes = [
+            self.index_speaker_dict(self.deduped_speakers),
+            self.index_speaker_dict(self.get_speakers_dict_as_title_initial_surname()),
+            self.index_speaker_dict(self.get_speakers_dict_as_dual_surname()),
+        ]
+
+    def resolve_speaker(self, speaker):
+        """Returns (pass number, PersonId) for the first pass that matches speaker, or None."""
+        if speaker not in self.resolved_speakers:
+            normalised_speaker = self.normalise_name(speaker)
+            self.resolved_speakers[speaker] = next(
+                ((n, speaker_index[normalised_speaker]) for n, speaker_index in enumerate(self.speaker_indexes)
+                 if normalised_speaker in speaker_index), None)
+        return self.resolved_speakers[speaker]
 
     def get_speakers_dict_as_title_initial_surname(self):
         initial_added_dict = {}
@@ -397,12 +947,6 @@ class HansardToMemberConnector:
             initial_added_dict[k] = new_v
         return initial_added_dict
 
-    def title_initial_surname_match(self):
-        initial_added_dict = self.get_speakers_dict_as_title_initial_surname()
-        for hansard_dict_item in self.current_unmatched_speech.items():
-            self.match_hansard_to_speaker(hansard_dict_item, initial_added_dict)
-        self.update_unmatched_components()
-
     def get_speakers_dict_as_dual_surname(self):
         dual_surname_dict = {}
         for k, v in self.split_names_dict.items():
@@ -411,18 +955,19 @@ class HansardToMemberConnector:
                 dual_surname_dict[k] = new_v
         return dual_surname_dict
 
-    def dual_surname_match(self):
-        dual_surname_dict = self.get_speakers_dict_as_dual_surname()
-        for hansard_dict_item in self.current_unmatched_speech.items():
-            self.match_hansard_to_speaker(hansard_dict_item, dual_surname_dict)
-        self.update_unmatched_components()
-
     def run_all_matching(self):
         self.split_duplicate_names_to_separate_dict()
-        self.current_unmatched_speech = self.all_speech
-        self.title_surname_match()
-        self.title_initial_surname_match()
-        self.dual_surname_match()
+        self.build_speaker_indexes()
+        matches_by_pass = [[] for _ in self.speaker_indexes]
+        for component_id, speech_tup in self.all_speech.items():
+            resolved = self.resolve_speaker(speech_tup.speaker)
+            if resolved:
+                match_pass, speaker_id = resolved
+                matches_by_pass[match_pass].append((component_id, speaker_id))
+        # Matches are stored pass by pass, which keeps the order the passes used to produce.
+        for matches in matches_by_pass:
+            self.matched_components_dict.update(matches)
+        self.update_unmatched_components()
 
     def unify_data(self):
         combined_data_dict = {}
@@ -440,104 +985,278 @@ class HansardToMemberConnector:
         return combined
 
 
-from collections import namedtuple
+from collections import Counter, namedtuple
+from contextlib import closing
+from datetime import datetime, timedelta
+import hashlib
+from importlib import metadata
+import json
+import numpy as np
+import os
 import re
-import spacy
-from spacytextblob.spacytextblob import SpacyTextBlob
+import sqlite3
+import threading
+
+
+class AnalyticsTable:
+    """Column store for the combined Hansard/member data: one list per field, with every column in the same row order
+    (given by keys). Metric columns are added alongside the existing ones, without copying any of the records."""
+
+    def __init__(self, keys, columns):
+        self.keys = list(keys)
+        self.columns = columns
+
+    @classmethod
+    def from_named_tuples(cls, tuple_dict):
+        records = list(tuple_dict.values())
+        fields = records[0]._fields if records else ()
+        columns = {field: [getattr(r, field) for r in records] for field in fields}
+        return cls(tuple_dict.keys(), columns)
+
+    @property
+    def fields(self):
+        return tuple(self.columns.keys())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def column(self, field):
+        return self.columns[field]
+
+    def add_column(self, field, values):
+        values = list(values)
+        if len(values) != len(self.keys):
+            raise ValueError(f"{field} has {len(values)} values for {len(self.keys)} rows")
+        self.columns[field] = values
+
+    def as_named_tuples(self):
+        """Rebuilds the row-wise {key: namedtuple} view, for anything that still wants records."""
+        Row = namedtuple("Row", self.fields)
+        return {k: Row(*values) for k, values in zip(self.keys, zip(*self.columns.values()))}
+
+
+def get_package_versions(packages):
+    """e.g. "spacy==2.3.5;textblob==0.15.3", read from the installed packages' metadata without importing them."""
+    versions = []
+    for package in packages:
+        try:
+            versions.append(f"{package}=={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package}==unknown")
+    return ";".join(versions)
+
+
+class NLPResultCache:
+    """Per-text NLP outputs (polarity, subjectivity, ...) kept in SQLite between runs, so overlapping date ranges don't
+    re-score speeches they've already seen. Results are keyed by a hash of the text together with the identity of the
+    models that produced them, so upgrading the model or any of the libraries it relies on starts afresh."""
+    cache_dir = os.environ.get("NIA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                             ".nia_cache"))
+    file_name = "nlp_results.sqlite3"
+    # Stays under SQLite's default limit on the number of variables in one statement.
+    lookup_chunk_size = 500
+
+    def __init__(self, model_identity, cache_dir=None):
+        self.model_identity = model_identity
+        if cache_dir:
+            self.cache_dir = cache_dir
+        self.path = os.path.join(self.cache_dir, self.file_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS nlp_results "
+                         "(text_hash TEXT NOT NULL, model TEXT NOT NULL, outputs TEXT NOT NULL, "
+                         "PRIMARY KEY (text_hash, model))")
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, text_hashes):
+        """Returns {text_hash: outputs dict} for whichever of text_hashes have been stored for this model."""
+        text_hashes = list(text_hashes)
+        found = {}
+        with closing(sqlite3.connect(self.path)) as conn:
+            for i in range(0, len(text_hashes), self.lookup_chunk_size):
+                chunk = text_hashes[i:i + self.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT text_hash, outputs FROM nlp_results "
+                                    f"WHERE model = ? AND text_hash IN ({placeholders})", [self.model_identity, *chunk])
+                found.update((text_hash, json.loads(outputs)) for text_hash, outputs in rows)
+        return found
+
+    def put_many(self, outputs_by_hash):
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO nlp_results (text_hash, model, outputs) VALUES (?, ?, ?)",
+                             [(text_hash, self.model_identity, json.dumps(outputs))
+                              for text_hash, outputs in outputs_by_hash.items()])
 
 
 class AnalyticsCreator:
     """Adds desired datapoints to each hansard element in the inputted named_tuple. This class acts a bit like a
-    library of different methods that can be incorporateed as and when they are desired."""
-
-    def __init__(self, combined_dict):
-        self.combined_dict = combined_dict
-        self.current_tup = None
-        self.CountAddedTuple = None
-        self.new_field_name = None
+    library of different methods that can be incorporateed as and when they are desired.
+
+    The data is held as an AnalyticsTable, and each analytic is computed over a whole column and added as a new one.
+    Sentiment is worked out in one batched pass: every speech goes through nlp.pipe once, and both polarity and
+    subjectivity are read off the same Doc. Speeches already scored on an earlier run are taken from the
+    NLPResultCache instead, and the model is only loaded if there is anything left to score."""
+    spacy_model = "en_core_web_md"
+    sentiment_batch_size = 64
+    sentiment_n_process = 1
+    # SpacyTextBlob only looks at the text, so the tagger, parser and NER are never loaded.
+    spacy_disabled_components = ["tagger", "parser", "ner"]
+    use_nlp_cache = True
+
+    # The model is loaded once per process, on first use, and shared by every AnalyticsCreator (one per day when days
+    # are worked out separately). Its pipeline isn't meant to be run from several threads at once, so nlp_lock
+    # takes turns.
+    shared_nlp = None
+    nlp_lock = threading.Lock()
+
+    # The tokenizer: markup such as <BR /> is dropped, and a word is a run of letters or digits, which may be joined
+    # by apostrophes or hyphens ("Comhairle's", "cross-border") or be a number like "2.5" or "1,000". A sentence runs
+    # from a word to a run of ., ! or ? followed by a space, or to the end of the speech.
+    markup_pattern = re.compile(r"<[^>]*>")
+    word_pattern = re.compile(r"\w+(?:['’-]\w+|[.,]\d+)*")
+    sentence_pattern = re.compile(r"\w.*?(?:[.!?]+(?=\s|$)|$)", re.DOTALL)
+
+    def __init__(self, combined_dict, sentiment_batch_size=None, sentiment_n_process=None, nlp_cache=None):
+        self.table = AnalyticsTable.from_named_tuples(combined_dict)
 
         self.analytics_to_add_dict = {}
 
         self.nlp = None
-
-    def create_named_tuple_with_additional_analytic(self):
-        for d in self.combined_dict.items():
-            print(d)
-        first_key = list(self.combined_dict.keys())[0]
-        a_current_named_tuple = self.combined_dict[first_key]
-        print(a_current_named_tuple._fields)
-        return namedtuple("NewTuple", a_current_named_tuple._fields + (self.new_field_name,))
+        self.sentiments = None
+        self.token_counts = None
+        self.nlp_cache = nlp_cache
+        if sentiment_batch_size:
+            self.sentiment_batch_size = sentiment_batch_size
+        if sentiment_n_process:
+            self.sentiment_n_process = sentiment_n_process
+
+    def tokenize(self):
+        """The tokenization stage: runs over the whole corpus once, and keeps the word, sentence and character count of
+        every speech for each of the word-level metrics to use. Characters are counted once markup is dropped and runs
+        of whitespace are collapsed."""
+        if self.token_counts is None:
+            texts = [self.markup_pattern.sub(" ", text) if text else "" for text in self.table.column("hansard_text")]
+            word_counts = [len(self.word_pattern.findall(text)) for text in texts]
+            sentence_counts = [len(self.sentence_pattern.findall(text)) for text in texts]
+            character_counts = [len(" ".join(text.split())) for text in texts]
+            self.token_counts = {"word_count": word_counts, "sentence_count": sentence_counts,
+                                 "character_count": character_counts}
+        return self.token_counts
 
     def get_word_count(self):
-        word_count = 0
-        if self.current_tup.hansard_text:
-            word_list = self.current_tup.hansard_text.split(" ")
-            word_count = len(word_list)
-        return word_count
+        return self.tokenize()["word_count"]
+
+    def get_sentence_count(self):
+        return self.tokenize()["sentence_count"]
+
+    def get_character_count(self):
+        return self.tokenize()["character_count"]
 
     def get_whether_interrupted(self):
-        is_interrupted = 0
-        interjection = self.current_tup.interjection
-        if interjection:
-            if re.fullmatch(r".*Interruption.*", interjection):
-                is_interrupted = 1
-        return is_interrupted
+        interruption = re.compile(r".*Interruption.*")
+        return [1 if interjection and interruption.fullmatch(interjection) else 0 for interjection in
+                self.table.column("interjection")]
 
     def preprocessing_spacy(self):
-        """This is loaded first to avoid re-loading on every iteration."""
+        """This is loaded first to avoid re-loading on every iteration. spaCy itself is only imported here, so nothing
+        heavy is loaded until there is a speech that isn't in the NLPResultCache."""
         if not self.nlp:
-            self.nlp = spacy.load("en_core_web_md")
-            spacy_text_blob = SpacyTextBlob()
-            self.nlp.add_pipe(spacy_text_blob)
+            self.nlp = self.get_shared_nlp()
+
+    @classmethod
+    def get_shared_nlp(cls):
+        if AnalyticsCreator.shared_nlp is None:
+            with cls.nlp_lock:
+                if AnalyticsCreator.shared_nlp is None:
+                    import spacy
+                    from spacytextblob.spacytextblob import SpacyTextBlob
+
+                    nlp = spacy.load(cls.spacy_model, disable=cls.spacy_disabled_components)
+                    spacy_text_blob = SpacyTextBlob()
+                    nlp.add_pipe(spacy_text_blob)
+                    AnalyticsCreator.shared_nlp = nlp
+        return AnalyticsCreator.shared_nlp
+
+    @classmethod
+    def get_model_identity(cls):
+        """Names every package that has a say in the sentiment scores, with its version, without loading the model."""
+        return get_package_versions([cls.spacy_model, "spacy", "spacytextblob", "textblob"])
+
+    def get_nlp_cache(self):
+        if self.nlp_cache is None and self.use_nlp_cache:
+            self.nlp_cache = NLPResultCache(self.get_model_identity())
+        return self.nlp_cache
+
+    def run_nlp(self, texts_by_hash):
+        """Parses each text once, in batches, returning {text_hash: outputs} with both sentiment values taken from the
+        same Doc."""
+        self.preprocessing_spacy()
+        outputs_by_hash = {}
+        with self.nlp_lock:
+            docs = self.nlp.pipe(texts_by_hash.values(), batch_size=self.sentiment_batch_size,
+                                 n_process=self.sentiment_n_process)
+            for text_hash, doc in zip(texts_by_hash.keys(), docs):
+                sentiment = doc._.sentiment
+                outputs_by_hash[text_hash] = {"polarity": sentiment.polarity, "subjectivity": sentiment.subjectivity}
+        return outputs_by_hash
+
+    def get_sentiments(self):
+        """Keeps the (polarity, subjectivity) of every speech. Cached results are looked up in one go, and only the
+        speeches that missed (each distinct text once) are sent to the NLP stage."""
+        if self.sentiments is None:
+            nlp_cache = self.get_nlp_cache()
+            texts = [text or "" for text in self.table.column("hansard_text")]
+            text_hashes = [NLPResultCache.hash_text(text) for text in texts]
+
+            outputs_by_hash = nlp_cache.get_many(set(text_hashes)) if nlp_cache else {}
+            misses = {text_hash: text for text_hash, text in zip(text_hashes, texts)
+                      if text_hash not in outputs_by_hash}
+            if misses:
+                new_outputs = self.run_nlp(misses)
+                if nlp_cache:
+                    nlp_cache.put_many(new_outputs)
+                outputs_by_hash.update(new_outputs)
+
+            self.sentiments = [(outputs_by_hash[text_hash]["polarity"], outputs_by_hash[text_hash]["subjectivity"])
+                               for text_hash in text_hashes]
+        return self.sentiments
 
     def get_sentiment_subjectivity(self):
-        text = self.current_tup.hansard_text
-        doc = self.nlp(text)
-        subjectivity = doc._.sentiment.subjectivity
-        print(subjectivity)
-        return subjectivity
+        return [subjectivity for _, subjectivity in self.get_sentiments()]
 
     def get_sentiment_polarity(self):
-        text = self.current_tup.hansard_text
-        doc = self.nlp(text)
-        polarity = doc._.sentiment.polarity
-        print(polarity)
-        return polarity
+        return [polarity for polarity, _ in self.get_sentiments()]
 
-    def add_datapoint_to_named_tuple(self, func_to_add, prepocessing_func=None):
+    def add_datapoint_column(self, field_name, func_to_add, prepocessing_func=None):
         if prepocessing_func:
             prepocessing_func()
-        NewTuple = self.create_named_tuple_with_additional_analytic()
-        for k, tup in self.combined_dict.items():
-            self.current_tup = tup
-            word_count = func_to_add()
-            new_tuple = NewTuple(*tup, word_count)
-            self.combined_dict[k] = new_tuple
+        self.table.add_column(field_name, func_to_add())
 
     def add_word_count(self):
-        self.new_field_name = "word_count"
-        self.add_datapoint_to_named_tuple(self.get_word_count)
+        self.add_datapoint_column("word_count", self.get_word_count)
 
     def compile_analytics_to_add_dict(self):
         self.analytics_to_add_dict = {
             "word_count": [self.get_word_count],
+            "sentence_count": [self.get_sentence_count],
+            "character_count": [self.get_character_count],
             "interruptions_count": [self.get_whether_interrupted],
-            "subjectivity": [self.get_sentiment_subjectivity, self.preprocessing_spacy],
-            "polarity": [self.get_sentiment_polarity, self.preprocessing_spacy]
+            "subjectivity": [self.get_sentiment_subjectivity],
+            "polarity": [self.get_sentiment_polarity]
         }
 
-    def add_to_tuple(self):
+    def add_analytics(self):
         self.compile_analytics_to_add_dict()
         for field_name, functions_list in self.analytics_to_add_dict.items():
             get_function = functions_list[0]
             preprocessor = None
             if len(functions_list) == 2:
                 preprocessor = functions_list[1]
-            self.new_field_name = field_name
-            self.add_datapoint_to_named_tuple(get_function, prepocessing_func=preprocessor)
-        for d in self.combined_dict.items():
-            print(d)
-        return self.combined_dict
+            self.add_datapoint_column(field_name, get_function, prepocessing_func=preprocessor)
+        return self.table
 
 
 class ProportionCalculator:
@@ -546,36 +1265,83 @@ class ProportionCalculator:
 
     def __init__(self, mla_param_dict, desired_identifiers):
         self.mla_param_dict = mla_param_dict
+        self.mla_table = AnalyticsTable.from_named_tuples(mla_param_dict)
         self.desired_identifiers = desired_identifiers
 
         self.proportions_dict = {}
-        self.current_tup = None
 
     def get_proportions(self, identifier):
-        tuple_list = [v for v in self.mla_param_dict.values()]
-        dict_list = [v._asdict() for v in tuple_list]
-        identifier_count = {}
-        for d in dict_list:
-            id_output = d[identifier]
-            count_value = identifier_count.get(id_output)
-            if count_value:
-                identifier_count[id_output] += 1
-            else:
-                identifier_count[id_output] = 1
-
+        identifier_count = Counter(self.mla_table.column(identifier))
         total_count = sum([v for v in identifier_count.values()])
 
         identifier_as_proportion = {k: v / total_count for k, v in identifier_count.items()}
         return identifier_as_proportion
 
     def get_all_proportions(self):
-        sample_named_tuple = [v for v in self.mla_param_dict.values()][0]
-        all_identifiers = [i for i in self.desired_identifiers if i in sample_named_tuple._fields]
+        all_identifiers = [i for i in self.desired_identifiers if i in self.mla_table.fields]
         all_identifier_counts = list(map(self.get_proportions, all_identifiers))
         identifier_counts_dict = dict(zip(all_identifiers, all_identifier_counts))
         return identifier_counts_dict
 
 
+class GroupedAggregator:
+    """Totals every metric column for every group of every identifier column at once. Each identifier column is
+    encoded as integer group codes (groups keep the order they first appear in), offset so that all identifiers share
+    one code space, and a single np.bincount over (group code, metric) pairs gives every sum. Rows are added in table
+    order, so the sums come out exactly as a running total over the rows would."""
+
+    def __init__(self, table, identifiers, metrics):
+        self.table = table
+        self.identifiers = list(identifiers)
+        self.metrics = list(metrics)
+
+        self.sums = {}
+        self.counts = {}
+
+    @staticmethod
+    def encode(column):
+        group_codes = {}
+        codes = np.fromiter((group_codes.setdefault(value, len(group_codes)) for value in column), dtype=np.intp,
+                            count=len(column))
+        return list(group_codes), codes
+
+    def aggregate(self):
+        """Fills self.sums with {identifier: {metric: {group: total}}} and self.counts with
+        {identifier: {group: rows}}."""
+        row_count, metric_count = len(self.table), len(self.metrics)
+
+        group_ranges = {}
+        code_columns = []
+        group_count = 0
+        for identifier in self.identifiers:
+            groups, codes = self.encode(self.table.column(identifier))
+            group_ranges[identifier] = (group_count, groups)
+            code_columns.append(codes + group_count)
+            group_count += len(groups)
+
+        codes = np.stack(code_columns, axis=1) if code_columns else np.empty((row_count, 0), dtype=np.intp)
+        metric_values = np.array([self.table.column(metric) for metric in self.metrics],
+                                 dtype=np.float64).reshape(metric_count, row_count).T
+
+        flat_index = (codes[:, :, np.newaxis] * metric_count + np.arange(metric_count)).ravel()
+        weights = np.broadcast_to(metric_values[:, np.newaxis, :],
+                                  (row_count, len(self.identifiers), metric_count)).ravel()
+        sums = np.bincount(flat_index, weights=weights, minlength=group_count * metric_count)
+        sums = sums.reshape(group_count, metric_count)
+        counts = np.bincount(codes.ravel(), minlength=group_count)
+
+        for identifier, (first_code, groups) in group_ranges.items():
+            group_sums = sums[first_code:first_code + len(groups)].tolist()
+            self.sums[identifier] = {metric: {group: group_sums[i][j] for i, group in enumerate(groups)}
+                                     for j, metric in enumerate(self.metrics)}
+            self.counts[identifier] = dict(zip(groups, counts[first_code:first_code + len(groups)].tolist()))
+        return self.sums
+
+    def get_group_means(self, identifier, metric):
+        """The mean within each group, as opposed to DiscreteAnalyticsCreator's share of the overall mean."""
+        return {group: total / self.counts[identifier][group] for group, total in self.sums[identifier][metric].items()}
+
+
 class DiscreteAnalyticsCreator:
     """Groups analytics at the hansard component level into chosen identifiers with a meaningfully limited number of
     discrete groups"""
@@ -583,9 +1349,12 @@ class DiscreteAnalyticsCreator:
     get_mean_metrics = {"subjectivity", "polarity"}
     get_proportional = {"word_count", "interruptions_count"}
 
-    def __init__(self, combined_analytics_dict, proportions_dict):
-        self.combined_analytics_dict = combined_analytics_dict
+    def __init__(self, combined_analytics_table, proportions_dict, partial_aggregate=None):
+        """Either works from the analytics table itself, or (with table None) from a PartialAggregate that already has
+        the totals."""
+        self.combined_analytics_table = combined_analytics_table
         self.proportions_dict = proportions_dict
+        self.partial_aggregate = partial_aggregate
 
         self.desired_identifiers = None
         self.desired_metrics = None
@@ -594,30 +1363,30 @@ class DiscreteAnalyticsCreator:
         self.current_metric = None
 
         self.current_identifier_count = {}
-        self.totalizer_dicts = {}
-
-    def get_tuples_as_dict(self):
-        tuple_list = [v for v in self.combined_analytics_dict.values()]
-        dict_list = [v._asdict() for v in tuple_list]
-        return dict_list
+        self.aggregator = None
+
+    @property
+    def speech_count(self):
+        if self.partial_aggregate is not None:
+            return self.partial_aggregate.speech_count
+        return len(self.combined_analytics_table)
+
+    def totalize_all(self):
+        """Sums every desired metric for every desired identifier in one go."""
+        if self.partial_aggregate is not None:
+            self.aggregator = self.partial_aggregate
+            return
+        self.aggregator = GroupedAggregator(self.combined_analytics_table, self.desired_identifiers,
+                                            self.desired_metrics)
+        self.aggregator.aggregate()
 
     def totalize_metric_for_identifier(self):
-        dict_list = self.get_tuples_as_dict()
-
-        self.current_identifier_count = {}
-        for d in dict_list:
-            id_output = d[self.current_identifier]
-            identifier_grouping = self.current_identifier_count.get(id_output)
-
-            identifier_value = d[self.current_metric]
-
-            if identifier_grouping:
-                self.current_identifier_count[id_output] += identifier_value
-            else:
-                self.current_identifier_count[id_output] = identifier_value
+        self.current_identifier_count = self.aggregator.sums[self.current_identifier][self.current_metric]
 
     def calculate_average(self):
-        identifier_average = {k: v / len(self.combined_analytics_dict) for k, v in
+        """Each group's total over the number of speeches overall (rather than in the group), so the group values add
+        up to the overall mean."""
+        identifier_average = {k: v / self.speech_count for k, v in
                               self.current_identifier_count.items()}
         return identifier_average
 
@@ -646,6 +1415,7 @@ class DiscreteAnalyticsCreator:
 
     def get_all_desired_metrics_for_all_desired_identifiers(self):
         overall_analytics_summary = {identifier: {} for identifier in self.desired_identifiers}
+        self.totalize_all()
         for identifier in self.desired_identifiers:
             self.current_identifier = identifier
             for metric in self.desired_metrics:
@@ -656,38 +1426,217 @@ class DiscreteAnalyticsCreator:
         return overall_analytics_summary
 
 
-import spacy
+class PartialAggregate:
+    """Everything the discrete analytics need from some set of days, in a form where the partials for two sets of
+    days merge into the partial for both: the number of speeches, each identifier group's number of speeches and total
+    of every metric, and the identifiers of every member sitting over those days (for the proportions).
+
+    Totals are added up day by day rather than row by row, so a merged mean can differ from a whole-range run in its
+    last bit or so."""
+
+    def __init__(self, identifiers, metrics, speech_count=0, group_totals=None, members=None):
+        self.identifiers = list(identifiers)
+        self.metrics = list(metrics)
+        self.speech_count = speech_count
+        # {identifier: {group: [speech count, {metric: total}]}}, groups in the order they were first seen.
+        self.group_totals = group_totals if group_totals is not None else {i: {} for i in self.identifiers}
+        # {person id: {identifier: group}}
+        self.members = members if members is not None else {}
+
+    @classmethod
+    def from_table(cls, table, mla_param_dict, identifiers, metrics):
+        partial = cls(identifiers, metrics, len(table))
+        if len(table):
+            aggregator = GroupedAggregator(table, partial.identifiers, partial.metrics)
+            aggregator.aggregate()
+            for identifier in partial.identifiers:
+                partial.group_totals[identifier] = {
+                    group: [count, {metric: aggregator.sums[identifier][metric][group] for metric in partial.metrics}]
+                    for group, count in aggregator.counts[identifier].items()}
+        partial.members = {person_id: {identifier: getattr(params, identifier) for identifier in partial.identifiers}
+                           for person_id, params in mla_param_dict.items()}
+        return partial
+
+    @classmethod
+    def merge(cls, *partials):
+        """Partials should be given in date order, which keeps groups in the order a whole-range run would see them
+        and, like the MLAProfiler, keeps the first-seen identifiers for a member."""
+        merged = cls(partials[0].identifiers, partials[0].metrics)
+        for partial in partials:
+            merged.speech_count += partial.speech_count
+            for identifier, groups in partial.group_totals.items():
+                merged_groups = merged.group_totals.setdefault(identifier, {})
+                for group, (count, totals) in groups.items():
+                    merged_count, merged_totals = merged_groups.setdefault(group, [0, {m: 0 for m in totals}])
+                    merged_groups[group][0] = merged_count + count
+                    for metric, total in totals.items():
+                        merged_totals[metric] = merged_totals.get(metric, 0) + total
+            for person_id, member_identifiers in partial.members.items():
+                merged.members.setdefault(person_id, member_identifiers)
+        return merged
+
+    @property
+    def sums(self):
+        """{identifier: {metric: {group: total}}}, as GroupedAggregator gives them."""
+        return {identifier: {metric: {group: totals[metric] for group, (_, totals) in groups.items()}
+                             for metric in self.metrics}
+                for identifier, groups in self.group_totals.items()}
+
+    @property
+    def counts(self):
+        return {identifier: {group: count for group, (count, _) in groups.items()}
+                for identifier, groups in self.group_totals.items()}
+
+    def get_member_params(self):
+        """The members as {person id: namedtuple}, which is what ProportionCalculator takes."""
+        MemberIdentifiers = namedtuple("MemberIdentifiers", self.identifiers)
+        return {person_id: MemberIdentifiers(**member_identifiers)
+                for person_id, member_identifiers in self.members.items()}
+
+    def to_json(self):
+        # Groups can be None, which JSON keys can't, so they're kept as [group, count, totals] lists.
+        return json.dumps({
+            "identifiers": self.identifiers,
+            "metrics": self.metrics,
+            "speech_count": self.speech_count,
+            "group_totals": {identifier: [[group, count, totals] for group, (count, totals) in groups.items()]
+                             for identifier, groups in self.group_totals.items()},
+            "members": self.members,
+        })
+
+    @classmethod
+    def from_json(cls, partial_json):
+        loaded = json.loads(partial_json)
+        group_totals = {identifier: {group: [count, totals] for group, count, totals in groups}
+                        for identifier, groups in loaded["group_totals"].items()}
+        return cls(loaded["identifiers"], loaded["metrics"], loaded["speech_count"], group_totals, loaded["members"])
+
+
+class PartialAggregateStore:
+    """One PartialAggregate per day, kept in SQLite between runs so a date range only has to fetch, parse, match and
+    score the days it hasn't seen before. Hansard for recent days can still be revised, so (like the ResponseCache) a
+    partial stored when its day was older than immutable_after is kept for good, and any other is only reused for ttl
+    after it was stored. Partials are keyed by an identity covering the models, the identifiers and the metrics, so
+    changing any of them starts afresh."""
+    cache_dir = NLPResultCache.cache_dir
+    file_name = "day_partials.sqlite3"
+    immutable_after = timedelta(days=14)
+    ttl = timedelta(hours=6)
+    date_format = "%Y-%m-%d"
+    # Bump when the way a day's partial is worked out changes.
+    partial_version = 2
+
+    def __init__(self, identifiers, metrics, cache_dir=None, immutable_after=None, ttl=None):
+        self.identity = ";".join([f"partials=={self.partial_version}", AnalyticsCreator.get_model_identity(),
+                                  ",".join(identifiers), ",".join(metrics)])
+        if cache_dir:
+            self.cache_dir = cache_dir
+        if immutable_after is not None:
+            self.immutable_after = immutable_after
+        if ttl is not None:
+            self.ttl = ttl
+        self.path = os.path.join(self.cache_dir, self.file_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS day_partials "
+                         "(day TEXT NOT NULL, identity TEXT NOT NULL, partial TEXT NOT NULL, "
+                         "stored_at REAL NOT NULL DEFAULT 0, PRIMARY KEY (day, identity))")
+            # Stores from before stored_at was kept only had immutable days; their rows count as stored at 0, so
+            # they're worked out once more and then kept for good again.
+            if "stored_at" not in [row[1] for row in conn.execute("PRAGMA table_info(day_partials)")]:
+                conn.execute("ALTER TABLE day_partials ADD COLUMN stored_at REAL NOT NULL DEFAULT 0")
+
+    def is_fresh(self, day, stored_at):
+        stored_at = datetime.fromtimestamp(stored_at)
+        is_immutable = stored_at - datetime.strptime(day, self.date_format) > self.immutable_after
+        return is_immutable or datetime.now() - stored_at < self.ttl
+
+    def get_many(self, days):
+        """Returns {day: PartialAggregate} for whichever of days have been stored."""
+        days = list(days)
+        found = {}
+        with closing(sqlite3.connect(self.path)) as conn:
+            for i in range(0, len(days), NLPResultCache.lookup_chunk_size):
+                chunk = days[i:i + NLPResultCache.lookup_chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT day, partial, stored_at FROM day_partials "
+                                    f"WHERE identity = ? AND day IN ({placeholders})", [self.identity, *chunk])
+                found.update((day, PartialAggregate.from_json(partial)) for day, partial, stored_at in rows
+                             if self.is_fresh(day, stored_at))
+        return found
+
+    def put_many(self, partials_by_day):
+        stored_at = datetime.now().timestamp()
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO day_partials (day, identity, partial, stored_at) "
+                             "VALUES (?, ?, ?, ?)",
+                             [(day, self.identity, partial.to_json(), stored_at)
+                              for day, partial in partials_by_day.items()])
+
+
+from concurrent.futures import ProcessPoolExecutor
+import threading
 
-from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.predefined_recognizers import SpacyRecognizer
-from presidio_analyzer.nlp_engine import SpacyNlpEngine
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.anonymizers import Replace
-from presidio_anonymizer.entities import AnonymizerRequest
-from presidio_anonymizer.entities import AnonymizerConfig
 
 
 class HansardTextFormatter:
+    """spaCy and Presidio are only imported (and en_core_web_lg only loaded) when a formatter is created, so importing
+    this module costs nothing. Creating one is slow, so get_shared() gives out one per process."""
+    spacy_model = "en_core_web_lg"
+    score_threshold = 0.5
+    replace_text = "[GDPRREDACT]"
+
+    shared_formatter = None
+    shared_formatter_lock = threading.Lock()
+
     def __init__(self):
+        import spacy
+        from presidio_analyzer import AnalyzerEngine
+        from presidio_analyzer.predefined_recognizers import SpacyRecognizer
+        from presidio_analyzer.nlp_engine import SpacyNlpEngine
+        from presidio_anonymizer import AnonymizerEngine
+        from presidio_anonymizer.anonymizers import Replace
+        from presidio_anonymizer.entities import AnonymizerConfig
+
         SpacyRecognizer.ENTITIES = ["PERSON"]
         Replace.NEW_VALUE = 'replace_text'
         nlp_engine = SpacyNlpEngine()
-        nlp_engine.nlp['en'] = spacy.load('en_core_web_lg', disable=["parser", "tagger", "lemmatizer"])
+        nlp_engine.nlp['en'] = spacy.load(self.spacy_model, disable=["parser", "tagger", "lemmatizer"])
 
         self.analyzer_engine = AnalyzerEngine(nlp_engine=nlp_engine)
         self.anonymizer_engine = AnonymizerEngine()
+        self.anonymizer_config = {"PERSON": AnonymizerConfig("replace", {"replace_text": self.replace_text})}
+
+    @classmethod
+    def get_shared(cls):
+        if HansardTextFormatter.shared_formatter is None:
+            with cls.shared_formatter_lock:
+                if HansardTextFormatter.shared_formatter is None:
+                    HansardTextFormatter.shared_formatter = cls()
+        return HansardTextFormatter.shared_formatter
+
+    @classmethod
+    def get_identity(cls):
+        """Everything that decides what the formatted text comes out as, for keying cached output."""
+        versions = get_package_versions([cls.spacy_model, "spacy", "presidio-analyzer", "presidio-anonymizer"])
+        return f"{versions};score_threshold={cls.score_threshold};replace_text={cls.replace_text}"
 
     def run_anonymizer(self, text):
+        """Returns the text with any names replaced, or as it was if there weren't any."""
+        if not text:
+            return text
         results = self.analyzer_engine.analyze(text=text,
                                                entities=[],
                                                language='en',
-                                               score_threshold=0.5)
+                                               score_threshold=self.score_threshold)
         if results:
-            config = {"PERSON": AnonymizerConfig("replace", {"replace_text": "[GDPRREDACT]"})}
-            return self.anonymizer_engine.anonymize(text, results, config)
+            return self.anonymizer_engine.anonymize(text, results, self.anonymizer_config)
+        return text
 
     @staticmethod
     def clean_text(text):
+        if not text:
+            return ""
         text = text.replace('\n', '')
         text = text.replace('<BR />', '\n')
         return text
@@ -698,11 +1647,56 @@ class HansardTextFormatter:
         return cleaned_text
 
 
-hansard_anon = HansardTextFormatter()
+def format_batch(texts):
+    """Formats a batch of texts with this process's shared formatter. (Module level, so worker processes can run it.)"""
+    text_formatter = HansardTextFormatter.get_shared()
+    return [text_formatter.run_formatter(text) for text in texts]
+
+
+class AnonymizationService:
+    """Formats a whole column of speeches at once. Repeated speeches, and any formatted on an earlier run, come from an
+    NLPResultCache keyed by a hash of the text. The rest are split into batches: a single batch is formatted in this
+    process, and more than that are spread over a pool of worker processes, each of which loads its formatter once."""
+    max_workers = 2
+    batch_size = 50
+    use_cache = True
+
+    def __init__(self, max_workers=None, batch_size=None, formatted_cache=None):
+        if max_workers:
+            self.max_workers = max_workers
+        if batch_size:
+            self.batch_size = batch_size
+        self.formatted_cache = formatted_cache
+
+    def get_formatted_cache(self):
+        if self.formatted_cache is None and self.use_cache:
+            self.formatted_cache = NLPResultCache(HansardTextFormatter.get_identity())
+        return self.formatted_cache
+
+    def format_uncached(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.max_workers <= 1:
+            return [text for batch in batches for text in format_batch(batch)]
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(batches)),
+                                 initializer=HansardTextFormatter.get_shared) as executor:
+            return [text for formatted_batch in executor.map(format_batch, batches) for text in formatted_batch]
+
+    def format_texts(self, texts):
+        texts = [text or "" for text in texts]
+        text_hashes = [NLPResultCache.hash_text(text) for text in texts]
+
+        formatted_cache = self.get_formatted_cache()
+        outputs_by_hash = formatted_cache.get_many(set(text_hashes)) if formatted_cache else {}
+        misses = {text_hash: text for text_hash, text in zip(text_hashes, texts) if text_hash not in outputs_by_hash}
+        if misses:
+            formatted_texts = self.format_uncached(list(misses.values()))
+            new_outputs = {text_hash: {"formatted_text": formatted_text} for text_hash, formatted_text in
+                           zip(misses.keys(), formatted_texts)}
+            if formatted_cache:
+                formatted_cache.put_many(new_outputs)
+            outputs_by_hash.update(new_outputs)
+        return [outputs_by_hash[text_hash]["formatted_text"] for text_hash in text_hashes]
 
-txt = "I assure you, a Cheann Comhairle, that I will stick to the Budget. I am afraid to look at Mervyn in case he thinks that there are any notions."
-anon_txt = hansard_anon.run_anonymizer(txt)
-print(anon_txt)
 
 """
 City Finder Processor
@@ -741,6 +1735,9 @@ OUTPUT_ANALYTICS = {"word_count": "proportional", "interruptions_count": "propor
 
 
 class ProfileAnalyzer:
+    date_format = "%Y-%m-%d"
+    # Keep each day's partial aggregates between runs, so only days not seen before are fetched and scored.
+    use_partial_store = True
 
     def __init__(self):
         self.identifiers = None
@@ -750,6 +1747,9 @@ class ProfileAnalyzer:
         self.end_date = None
 
         self.hansard_member = None
+        self.partial_store = None
+        # Days with a request that failed, whose partials may be missing data and so aren't stored.
+        self.incomplete_days = set()
 
     def get_identifiers(self, *args: str):
         self.identifiers = [i for i in args if i in IDENTIFIERS]
@@ -797,10 +1797,10 @@ class ProfileAnalyzer:
         # Create a dictionary of component id: namedtuple to connect up the spoken data with the mla speaking.
         combined_dict = self.hansard_member.full_hansard_member()
 
-        # Use this dictionary to run analytics on the spoken text and add these datapoints to a new namedtuple.
+        # Use this dictionary to run analytics on the spoken text, adding each datapoint as a new column.
         analytics_creator = AnalyticsCreator(combined_dict)
-        combined_analytics_dict = analytics_creator.add_to_tuple()
-        return combined_analytics_dict
+        combined_analytics_table = analytics_creator.add_analytics()
+        return combined_analytics_table
 
     def run_profile_analysis(self):
         self.get_hansard_data_obj()
@@ -809,7 +1809,7 @@ class ProfileAnalyzer:
         mla_profile_dict = self.get_mla_profile_dict()
         self.get_speech_data()
 
-        combined_analytics_dict = self.get_data_with_analytics()
+        combined_analytics_table = self.get_data_with_analytics()
 
         # Go back to the mla dictionary to get base proportions of different identifiers.
         # E.g. we want to know the % of female MLAs in order to then compare the % of female words spoken.
@@ -817,13 +1817,130 @@ class ProfileAnalyzer:
         identifier_counts_dict = prop_calc.get_all_proportions()
 
         # Now we can run the analysis to compare how these proportions differ for identifier groupings.
-        disc_analytics = DiscreteAnalyticsCreator(combined_analytics_dict, identifier_counts_dict)
+        disc_analytics = DiscreteAnalyticsCreator(combined_analytics_table, identifier_counts_dict)
         disc_analytics.desired_identifiers = self.identifiers
         disc_analytics.desired_metrics = self.output_analytics
 
         # The output format is split by identifer which gives an analysis for each grouping for that identifier.
         output_dict = disc_analytics.get_all_desired_metrics_for_all_desired_identifiers()
-        return combined_analytics_dict, output_dict
+        return combined_analytics_table, output_dict
+
+
+    def iter_days(self):
+        """start_date inclusive; end_date exclusive, as for the XMLGenerator."""
+        start_date = datetime.strptime(self.start_date, self.date_format)
+        end_date = datetime.strptime(self.end_date, self.date_format)
+        for n in range((end_date - start_date).days):
+            yield (start_date + timedelta(days=n)).strftime(self.date_format)
+
+    def get_next_day(self, day):
+        return (datetime.strptime(day, self.date_format) + timedelta(days=1)).strftime(self.date_format)
+
+    def get_partial_store(self):
+        if self.partial_store is None and self.use_partial_store:
+            self.partial_store = PartialAggregateStore(sorted(IDENTIFIERS), sorted(OUTPUT_ANALYTICS))
+        return self.partial_store
+
+    # A day is worked out in stages (fetch members and Hansard, parse, match, score), so that get_workflow can hand
+    # each stage of each day to Dask as a task of its own. Members are the exception: they're fetched once for all the
+    # days being worked out, and each day takes its own members from that.
+
+    def fetch_members(self, days):
+        """Fetches the members from the first to the last of days in one go: the membership timeline only needs a few
+        requests for the whole range, and contact details are fetched once. If any request failed, any of the days
+        may have the wrong members, so none of them are stored."""
+        hansard_member = HansardToMemberConnector(days[0], self.get_next_day(days[-1]))
+        hansard_member.get_mla_data()
+        if hansard_member.profile_parameter_creator.has_failed_requests():
+            self.incomplete_days.update(days)
+        return hansard_member
+
+    def get_day_members(self, range_member, day):
+        """A connector for the day alone, holding the profiles of those who were members on the day."""
+        member_ids = range_member.profile_parameter_creator.get_member_ids_on(day)
+        hansard_member = HansardToMemberConnector(day, self.get_next_day(day))
+        hansard_member.mla_profile_dicts = {person_id: params for person_id, params in
+                                            range_member.mla_profile_dicts.items() if person_id in member_ids}
+        return hansard_member
+
+    def fetch_day_hansard(self, day):
+        xml_generator = XMLGenerator(day, self.get_next_day(day))
+        day_components = list(xml_generator.iter_valid_xml())
+        if xml_generator.has_failed_requests():
+            self.incomplete_days.add(day)
+        return day_components
+
+    @staticmethod
+    def parse_day(day_components):
+        # There's no next day's first speaker to finish the day's last speech, so it's let through as it is.
+        return CorpusBuilder(day_components, yield_last_speech=True).create_speaker_text_dict()
+
+    @staticmethod
+    def match_day(hansard_member, all_speech):
+        hansard_member.all_speech = all_speech
+        return hansard_member.full_hansard_member()
+
+    def score_day(self, day, hansard_member, combined_dict):
+        """Scores the day's matched speeches and sums them up as a PartialAggregate, stored for later runs (unless one
+        of the day's requests failed). Every identifier and analytic is totalled, whatever this run asked for, so the
+        partial can answer any later run."""
+        if combined_dict:
+            combined_analytics_table = AnalyticsCreator(combined_dict).add_analytics()
+        else:
+            combined_analytics_table = AnalyticsTable.from_named_tuples(combined_dict)
+        partial_aggregate = PartialAggregate.from_table(
+            combined_analytics_table, hansard_member.mla_profile_dicts, sorted(IDENTIFIERS), sorted(OUTPUT_ANALYTICS))
+
+        partial_store = self.get_partial_store()
+        if day in self.incomplete_days:
+            print(f"Not storing {day}'s partial aggregate, as some of its requests failed")
+        elif partial_store:
+            partial_store.put_many({day: partial_aggregate})
+        return partial_aggregate
+
+    def get_day_partial(self, day, range_member):
+        hansard_member = self.get_day_members(range_member, day)
+        all_speech = self.parse_day(self.fetch_day_hansard(day))
+        return self.score_day(day, hansard_member, self.match_day(hansard_member, all_speech))
+
+    def get_stored_partials(self, days):
+        partial_store = self.get_partial_store()
+        partials_by_day = partial_store.get_many(days) if partial_store else {}
+        print(f"Reusing {len(partials_by_day)} of {len(days)} days' partial aggregates")
+        return partials_by_day
+
+    def get_day_partials(self):
+        """A PartialAggregate for every day in the date range, in order. Stored days are read back from the
+        PartialAggregateStore; only the rest are worked out."""
+        days = list(self.iter_days())
+        partials_by_day = self.get_stored_partials(days)
+        unseen_days = [day for day in days if day not in partials_by_day]
+        if unseen_days:
+            range_member = self.fetch_members(unseen_days)
+            partials_by_day.update({day: self.get_day_partial(day, range_member) for day in unseen_days})
+        return [partials_by_day[day] for day in days]
+
+    @staticmethod
+    def merge_partials(*day_partials):
+        """Day partials must be given in date order."""
+        if day_partials:
+            return PartialAggregate.merge(*day_partials)
+        return PartialAggregate(sorted(IDENTIFIERS), sorted(OUTPUT_ANALYTICS))
+
+    def analyze_partial_aggregate(self, partial_aggregate):
+        prop_calc = ProportionCalculator(partial_aggregate.get_member_params(), self.identifiers)
+        identifier_counts_dict = prop_calc.get_all_proportions()
+
+        disc_analytics = DiscreteAnalyticsCreator(None, identifier_counts_dict, partial_aggregate=partial_aggregate)
+        disc_analytics.desired_identifiers = self.identifiers
+        disc_analytics.desired_metrics = self.output_analytics
+        return disc_analytics.get_all_desired_metrics_for_all_desired_identifiers()
+
+    def run_incremental_analysis(self):
+        """Gives the same statistics as run_profile_analysis (without the speeches themselves), by merging the date
+        range's per-day partial aggregates."""
+        self.set_default()
+        return self.analyze_partial_aggregate(self.merge_partials(*self.get_day_partials()))
 
 
 class LintolPrepper:
@@ -831,31 +1948,32 @@ class LintolPrepper:
     highlighting useful phrases based on a member profile."""
 
     # TODO: Integrate text finding into processor.
-    def __init__(self, analytics_output_dict, data_dict):
+    def __init__(self, analytics_output_dict, data_table):
         self.analytics_output_dict = analytics_output_dict
-        self.data_dict = data_dict
+        self.data_table = data_table
 
     def clean_hansard_text(self):
-        text_formatter = HansardTextFormatter()
-        for k, v in self.data_dict.items():
-            txt = v.hansard_text
-            clean_txt = text_formatter.run_formatter(txt)
-            new_v = v._replace(hansard_text=clean_txt)
-            self.data_dict[k] = new_v
+        anonymization_service = AnonymizationService()
+        clean_texts = anonymization_service.format_texts(self.data_table.column("hansard_text"))
+        self.data_table.add_column("hansard_text", clean_texts)
 
 
-def run_default_analysis(rprt):
+def run_default_analysis(rprt, start_date=None, end_date=None):
     """
     Add report items to indicate where cities appear, and how often in total
     """
 
-    # No need to add any arguments as we're running default.
+    # No need to add any arguments as we're running default (the past week, unless given a date range).
     profile_analyzer = ProfileAnalyzer()
+    profile_analyzer.get_date_range(start_date, end_date)
     profile_analyzer.set_default()
 
-    # Run methods to get our two desired output dictionaries: adata dictionary that contains the text, and an analytics
-    # dictionary that contains the stats.
-    data_dictionary, stats_dictionary = profile_analyzer.run_profile_analysis()
+    # Only the stats are reported, so they're built up from per-day partial aggregates, which later runs can reuse.
+    stats_dictionary = profile_analyzer.run_incremental_analysis()
+    return add_stats_to_report(rprt, stats_dictionary)
+
+
+def add_stats_to_report(rprt, stats_dictionary):
     # Iterate through identifier keys in our stats_dictionary to format output for lintol doorstep.
     for identifier, analytic_dict in stats_dictionary.items():
         for analytic, datapoints in analytic_dict.items():
@@ -875,6 +1993,32 @@ def run_default_analysis(rprt):
     return rprt
 
 
+def report_partial_aggregate(rprt, profile_analyzer, partial_aggregate):
+    return add_stats_to_report(rprt, profile_analyzer.analyze_partial_aggregate(partial_aggregate))
+
+
+def add_tree_reduce(workflow, keys, reduce_func, prefix):
+    """Adds tasks to workflow that combine keys pairwise with reduce_func, then the results pairwise, and so on, keeping
+    them in order. Returns the key of the final result."""
+    level = 0
+    while len(keys) > 1:
+        next_keys = []
+        for i in range(0, len(keys), 2):
+            pair = keys[i:i + 2]
+            if len(pair) == 1:
+                next_keys.append(pair[0])
+                continue
+            key = f'{prefix}-{level}-{i // 2}'
+            workflow[key] = (reduce_func, *pair)
+            next_keys.append(key)
+        keys = next_keys
+        level += 1
+    if keys:
+        return keys[0]
+    workflow[prefix] = (reduce_func,)
+    return prefix
+
+
 class CityFinderProcessor(DoorstepProcessor):
     """
     This class wraps some of the Lintol magic under the hood, that lets us plug
@@ -897,15 +2041,44 @@ class CityFinderProcessor(DoorstepProcessor):
     # However, for the coding challenge, you probably only want one or more steps.
     # To add two more, create functions like city_finder called town_finder and country_finder,
     # then uncomment the code in this function (and remove the extra parenthesis in the 'output' line)
+    #
+    # Each day is fetched, parsed, matched and scored as tasks of its own, so Dask can overlap one day's API requests
+    # with another day's parsing and NLP. The days' partial aggregates are then merged pairwise into the one that step-A
+    # reports on. Days already in the PartialAggregateStore go straight into the merge. Members are fetched by one task
+    # for all the other days, which each day's members are then taken from.
     def get_workflow(self, filename, metadata={}):
+        profile_analyzer = ProfileAnalyzer()
+        profile_analyzer.set_default()
+        days = list(profile_analyzer.iter_days())
+        stored_partials = profile_analyzer.get_stored_partials(days)
+        unseen_days = [day for day in days if day not in stored_partials]
+
         workflow = {
             # 'load-text': (load_text, filename),
             'get-report': (self.make_report,),
-            'step-A': (run_default_analysis, 'get-report'),
+        }
+        if unseen_days:
+            workflow['members'] = (profile_analyzer.fetch_members, unseen_days)
+        for day in days:
+            if day in stored_partials:
+                workflow[f'partial-{day}'] = stored_partials[day]
+                continue
+            workflow.update({
+                f'members-{day}': (profile_analyzer.get_day_members, 'members', day),
+                f'hansard-{day}': (profile_analyzer.fetch_day_hansard, day),
+                f'parse-{day}': (profile_analyzer.parse_day, f'hansard-{day}'),
+                f'match-{day}': (profile_analyzer.match_day, f'members-{day}', f'parse-{day}'),
+                f'partial-{day}': (profile_analyzer.score_day, day, f'members-{day}', f'match-{day}'),
+            })
+        merged_partial = add_tree_reduce(workflow, [f'partial-{day}' for day in days], profile_analyzer.merge_partials,
+                                         'merge-partials')
+
+        workflow.update({
+            'step-A': (report_partial_aggregate, 'get-report', profile_analyzer, merged_partial),
             # 'step-B': (town_finder, 'load-text', 'get-report'),
             # 'step-C': (country_finder, 'load-text', 'get-report'),
             'output': (workflow_condense, 'step-A')  # , 'step-B', 'step-C')
-        }
+        })
         return workflow
 
 
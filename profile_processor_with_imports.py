@@ -18,6 +18,7 @@ from ltldoorstep.document_utils import load_text, split_into_paragraphs
 
 from datetime import datetime, timedelta
 
+import build_hansard_corpus
 import speaker_to_profile
 import profile_analysis
 import new_hansard_prepper
@@ -32,6 +33,9 @@ OUTPUT_ANALYTICS = {"word_count": "proportional", "interruptions_count": "propor
 
 
 class ProfileAnalyzer:
+    date_format = "%Y-%m-%d"
+    # Keep each day's partial aggregates between runs, so only days not seen before are fetched and scored.
+    use_partial_store = True
 
     def __init__(self):
         self.identifiers = None
@@ -41,6 +45,9 @@ class ProfileAnalyzer:
         self.end_date = None
 
         self.hansard_member = None
+        self.partial_store = None
+        # Days with a request that failed, whose partials may be missing data and so aren't stored.
+        self.incomplete_days = set()
 
     def get_identifiers(self, *args: str):
         self.identifiers = [i for i in args if i in IDENTIFIERS]
@@ -88,13 +95,13 @@ class ProfileAnalyzer:
         # Create a dictionary of component id: namedtuple to connect up the spoken data with the mla speaking.
         combined_dict = self.hansard_member.full_hansard_member()
 
-        # Use this dictionary to run analytics on the spoken text and add these datapoints to a new namedtuple.
+        # Use this dictionary to run analytics on the spoken text, adding each datapoint as a new column.
         analytics_creator = profile_analysis.AnalyticsCreator(combined_dict)
-        combined_analytics_dict = analytics_creator.add_to_tuple()
-        return combined_analytics_dict
+        combined_analytics_table = analytics_creator.add_analytics()
+        return combined_analytics_table
 
     def run_profile_analysis(self):
-        combined_analytics_dict = self.get_data_with_analytics()
+        combined_analytics_table = self.get_data_with_analytics()
         mla_profile_dict = self.get_mla_profile_dict()
 
         # Go back to the mla dictionary to get base proportions of different identifiers.
@@ -103,13 +110,132 @@ class ProfileAnalyzer:
         identifier_counts_dict = prop_calc.get_all_proportions()
 
         # Now we can run the analysis to compare how these proportions differ for identifier groupings.
-        disc_analytics = profile_analysis.DiscreteAnalyticsCreator(combined_analytics_dict, identifier_counts_dict)
+        disc_analytics = profile_analysis.DiscreteAnalyticsCreator(combined_analytics_table, identifier_counts_dict)
         disc_analytics.desired_identifiers = self.identifiers
         disc_analytics.desired_metrics = self.output_analytics
 
         # The output format is split by identifer which gives an analysis for each grouping for that identifier.
         output_dict = disc_analytics.get_all_desired_metrics_for_all_desired_identifiers()
-        return combined_analytics_dict, output_dict
+        return combined_analytics_table, output_dict
+
+
+    def iter_days(self):
+        """start_date inclusive; end_date exclusive, as for the XMLGenerator."""
+        start_date = datetime.strptime(self.start_date, self.date_format)
+        end_date = datetime.strptime(self.end_date, self.date_format)
+        for n in range((end_date - start_date).days):
+            yield (start_date + timedelta(days=n)).strftime(self.date_format)
+
+    def get_next_day(self, day):
+        return (datetime.strptime(day, self.date_format) + timedelta(days=1)).strftime(self.date_format)
+
+    def get_partial_store(self):
+        if self.partial_store is None and self.use_partial_store:
+            self.partial_store = profile_analysis.PartialAggregateStore(sorted(IDENTIFIERS),
+                                                                        sorted(OUTPUT_ANALYTICS))
+        return self.partial_store
+
+    # A day is worked out in stages (fetch members and Hansard, parse, match, score), so that get_workflow can hand
+    # each stage of each day to Dask as a task of its own. Members are the exception: they're fetched once for all the
+    # days being worked out, and each day takes its own members from that.
+
+    def fetch_members(self, days):
+        """Fetches the members from the first to the last of days in one go: the membership timeline only needs a few
+        requests for the whole range, and contact details are fetched once. If any request failed, any of the days
+        may have the wrong members, so none of them are stored."""
+        hansard_member = speaker_to_profile.HansardToMemberConnector(days[0], self.get_next_day(days[-1]))
+        hansard_member.get_mla_data()
+        if hansard_member.profile_parameter_creator.has_failed_requests():
+            self.incomplete_days.update(days)
+        return hansard_member
+
+    def get_day_members(self, range_member, day):
+        """A connector for the day alone, holding the profiles of those who were members on the day."""
+        member_ids = range_member.profile_parameter_creator.get_member_ids_on(day)
+        hansard_member = speaker_to_profile.HansardToMemberConnector(day, self.get_next_day(day))
+        hansard_member.mla_profile_dicts = {person_id: params for person_id, params in
+                                            range_member.mla_profile_dicts.items() if person_id in member_ids}
+        return hansard_member
+
+    def fetch_day_hansard(self, day):
+        xml_generator = build_hansard_corpus.XMLGenerator(day, self.get_next_day(day))
+        day_components = list(xml_generator.iter_valid_xml())
+        if xml_generator.has_failed_requests():
+            self.incomplete_days.add(day)
+        return day_components
+
+    @staticmethod
+    def parse_day(day_components):
+        # There's no next day's first speaker to finish the day's last speech, so it's let through as it is.
+        return build_hansard_corpus.CorpusBuilder(day_components, yield_last_speech=True).create_speaker_text_dict()
+
+    @staticmethod
+    def match_day(hansard_member, all_speech):
+        hansard_member.all_speech = all_speech
+        return hansard_member.full_hansard_member()
+
+    def score_day(self, day, hansard_member, combined_dict):
+        """Scores the day's matched speeches and sums them up as a PartialAggregate, stored for later runs (unless one
+        of the day's requests failed). Every identifier and analytic is totalled, whatever this run asked for, so the
+        partial can answer any later run."""
+        if combined_dict:
+            combined_analytics_table = profile_analysis.AnalyticsCreator(combined_dict).add_analytics()
+        else:
+            combined_analytics_table = profile_analysis.AnalyticsTable.from_named_tuples(combined_dict)
+        partial_aggregate = profile_analysis.PartialAggregate.from_table(
+            combined_analytics_table, hansard_member.mla_profile_dicts, sorted(IDENTIFIERS), sorted(OUTPUT_ANALYTICS))
+
+        partial_store = self.get_partial_store()
+        if day in self.incomplete_days:
+            print(f"Not storing {day}'s partial aggregate, as some of its requests failed")
+        elif partial_store:
+            partial_store.put_many({day: partial_aggregate})
+        return partial_aggregate
+
+    def get_day_partial(self, day, range_member):
+        hansard_member = self.get_day_members(range_member, day)
+        all_speech = self.parse_day(self.fetch_day_hansard(day))
+        return self.score_day(day, hansard_member, self.match_day(hansard_member, all_speech))
+
+    def get_stored_partials(self, days):
+        partial_store = self.get_partial_store()
+        partials_by_day = partial_store.get_many(days) if partial_store else {}
+        print(f"Reusing {len(partials_by_day)} of {len(days)} days' partial aggregates")
+        return partials_by_day
+
+    def get_day_partials(self):
+        """A PartialAggregate for every day in the date range, in order. Stored days are read back from the
+        PartialAggregateStore; only the rest are worked out."""
+        days = list(self.iter_days())
+        partials_by_day = self.get_stored_partials(days)
+        unseen_days = [day for day in days if day not in partials_by_day]
+        if unseen_days:
+            range_member = self.fetch_members(unseen_days)
+            partials_by_day.update({day: self.get_day_partial(day, range_member) for day in unseen_days})
+        return [partials_by_day[day] for day in days]
+
+    @staticmethod
+    def merge_partials(*day_partials):
+        """Day partials must be given in date order."""
+        if day_partials:
+            return profile_analysis.PartialAggregate.merge(*day_partials)
+        return profile_analysis.PartialAggregate(sorted(IDENTIFIERS), sorted(OUTPUT_ANALYTICS))
+
+    def analyze_partial_aggregate(self, partial_aggregate):
+        prop_calc = profile_analysis.ProportionCalculator(partial_aggregate.get_member_params(), self.identifiers)
+        identifier_counts_dict = prop_calc.get_all_proportions()
+
+        disc_analytics = profile_analysis.DiscreteAnalyticsCreator(None, identifier_counts_dict,
+                                                                   partial_aggregate=partial_aggregate)
+        disc_analytics.desired_identifiers = self.identifiers
+        disc_analytics.desired_metrics = self.output_analytics
+        return disc_analytics.get_all_desired_metrics_for_all_desired_identifiers()
+
+    def run_incremental_analysis(self):
+        """Gives the same statistics as run_profile_analysis (without the speeches themselves), by merging the date
+        range's per-day partial aggregates."""
+        self.set_default()
+        return self.analyze_partial_aggregate(self.merge_partials(*self.get_day_partials()))
 
 
 class LintolPrepper:
@@ -117,31 +243,31 @@ class LintolPrepper:
     highlighting useful phrases based on a member profile."""
 
     # TODO: Integrate text finding into processor.
-    def __init__(self, analytics_output_dict, data_dict):
+    def __init__(self, analytics_output_dict, data_table):
         self.analytics_output_dict = analytics_output_dict
-        self.data_dict = data_dict
+        self.data_table = data_table
 
     def clean_hansard_text(self):
-        text_formatter = new_hansard_prepper.HansardTextFormatter()
-        for k, v in self.data_dict.items():
-            txt = v.hansard_text
-            clean_txt = text_formatter.run_formatter(txt)
-            new_v = v._replace(hansard_text=clean_txt)
-            self.data_dict[k] = new_v
+        anonymization_service = new_hansard_prepper.AnonymizationService()
+        clean_texts = anonymization_service.format_texts(self.data_table.column("hansard_text"))
+        self.data_table.add_column("hansard_text", clean_texts)
 
 
-def run_default_analysis(rprt):
+def run_default_analysis(rprt, start_date=None, end_date=None):
     """
     Add report items to indicate where cities appear, and how often in total
     """
 
-    # No need to add any arguments as we're running default.
+    # No need to add any arguments as we're running default (the past week, unless given a date range).
     profile_analyzer = ProfileAnalyzer()
+    profile_analyzer.get_date_range(start_date, end_date)
 
-    # Run methods to get our two desired output dictionaries: adata dictionary that contains the text, and an analytics
-    # dictionary that contains the stats.
-    data_dictionary, stats_dictionary = profile_analyzer.run_profile_analysis()
+    # Only the stats are reported, so they're built up from per-day partial aggregates, which later runs can reuse.
+    stats_dictionary = profile_analyzer.run_incremental_analysis()
+    return add_stats_to_report(rprt, stats_dictionary)
 
+
+def add_stats_to_report(rprt, stats_dictionary):
     # Iterate through identifier keys in our stats_dictionary to format output for lintol doorstep.
     for identifier, analytic_dict in stats_dictionary.items():
         for analytic, datapoints in analytic_dict.items():
@@ -160,6 +286,32 @@ def run_default_analysis(rprt):
     return rprt
 
 
+def report_partial_aggregate(rprt, profile_analyzer, partial_aggregate):
+    return add_stats_to_report(rprt, profile_analyzer.analyze_partial_aggregate(partial_aggregate))
+
+
+def add_tree_reduce(workflow, keys, reduce_func, prefix):
+    """Adds tasks to workflow that combine keys pairwise with reduce_func, then the results pairwise, and so on, keeping
+    them in order. Returns the key of the final result."""
+    level = 0
+    while len(keys) > 1:
+        next_keys = []
+        for i in range(0, len(keys), 2):
+            pair = keys[i:i + 2]
+            if len(pair) == 1:
+                next_keys.append(pair[0])
+                continue
+            key = f'{prefix}-{level}-{i // 2}'
+            workflow[key] = (reduce_func, *pair)
+            next_keys.append(key)
+        keys = next_keys
+        level += 1
+    if keys:
+        return keys[0]
+    workflow[prefix] = (reduce_func,)
+    return prefix
+
+
 class CityFinderProcessor(DoorstepProcessor):
     """
     This class wraps some of the Lintol magic under the hood, that lets us plug
@@ -182,15 +334,44 @@ class CityFinderProcessor(DoorstepProcessor):
     # However, for the coding challenge, you probably only want one or more steps.
     # To add two more, create functions like city_finder called town_finder and country_finder,
     # then uncomment the code in this function (and remove the extra parenthesis in the 'output' line)
+    #
+    # Each day is fetched, parsed, matched and scored as tasks of its own, so Dask can overlap one day's API requests
+    # with another day's parsing and NLP. The days' partial aggregates are then merged pairwise into the one that step-A
+    # reports on. Days already in the PartialAggregateStore go straight into the merge. Members are fetched by one task
+    # for all the other days, which each day's members are then taken from.
     def get_workflow(self, filename, metadata={}):
+        profile_analyzer = ProfileAnalyzer()
+        profile_analyzer.set_default()
+        days = list(profile_analyzer.iter_days())
+        stored_partials = profile_analyzer.get_stored_partials(days)
+        unseen_days = [day for day in days if day not in stored_partials]
+
         workflow = {
             # 'load-text': (load_text, filename),
             'get-report': (self.make_report,),
-            'step-A': (run_default_analysis, 'get-report'),
+        }
+        if unseen_days:
+            workflow['members'] = (profile_analyzer.fetch_members, unseen_days)
+        for day in days:
+            if day in stored_partials:
+                workflow[f'partial-{day}'] = stored_partials[day]
+                continue
+            workflow.update({
+                f'members-{day}': (profile_analyzer.get_day_members, 'members', day),
+                f'hansard-{day}': (profile_analyzer.fetch_day_hansard, day),
+                f'parse-{day}': (profile_analyzer.parse_day, f'hansard-{day}'),
+                f'match-{day}': (profile_analyzer.match_day, f'members-{day}', f'parse-{day}'),
+                f'partial-{day}': (profile_analyzer.score_day, day, f'members-{day}', f'match-{day}'),
+            })
+        merged_partial = add_tree_reduce(workflow, [f'partial-{day}' for day in days], profile_analyzer.merge_partials,
+                                         'merge-partials')
+
+        workflow.update({
+            'step-A': (report_partial_aggregate, 'get-report', profile_analyzer, merged_partial),
             # 'step-B': (town_finder, 'load-text', 'get-report'),
             # 'step-C': (country_finder, 'load-text', 'get-report'),
             'output': (workflow_condense, 'step-A')  # , 'step-B', 'step-C')
-        }
+        })
         return workflow
 
 
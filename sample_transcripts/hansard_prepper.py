@@ -1,17 +1,15 @@
+import os
+import re
 import sys
 import xml.etree.ElementTree as ET
-
-import spacy
-
-from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.predefined_recognizers import SpacyRecognizer
-from presidio_analyzer.nlp_engine import SpacyNlpEngine
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.anonymizers import Replace
-from presidio_anonymizer.entities import AnonymizerRequest
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.sax.saxutils import escape, quoteattr
 
 
 def run_anonymizer(engine, text, analyzer_results, transformations=None):
+    from presidio_anonymizer import AnonymizerEngine
+    from presidio_anonymizer.entities import AnonymizerRequest
+
     req = AnonymizerRequest({
         'analyzer_results': [res.to_dict() for res in analyzer_results],
         'text': text,
@@ -24,6 +22,14 @@ def run_anonymizer(engine, text, analyzer_results, transformations=None):
 
 class HansardCleaner:
     def initialize(self):
+        # spaCy and Presidio are only imported once a cleaner is set up to use them.
+        import spacy
+        from presidio_analyzer import AnalyzerEngine
+        from presidio_analyzer.predefined_recognizers import SpacyRecognizer
+        from presidio_analyzer.nlp_engine import SpacyNlpEngine
+        from presidio_anonymizer import AnonymizerEngine
+        from presidio_anonymizer.anonymizers import Replace
+
         SpacyRecognizer.ENTITIES = ["PERSON"]
         Replace.NEW_VALUE = 'replace_text'
         nlp_engine = SpacyNlpEngine()
@@ -32,58 +38,178 @@ class HansardCleaner:
         self.analyzer_engine = AnalyzerEngine(nlp_engine=nlp_engine)
         self.anonymizer_engine = AnonymizerEngine()
 
-    def run(self, xml_filename):
-        etree = ET.parse(xml_filename)
-
-        for elem in etree.iter():
-            text = elem.text.strip()
-            if text:
-                results = self.analyzer_engine.analyze(correlation_id=0,
-                                                       text=text,
-                                                       entities=[],
-                                                       language='en',
-                                                       score_threshold=0.5)
-                if results:
-                    elem.text = run_anonymizer(self.anonymizer_engine, text, results)
-
-        new_filename = f'out-{xml_filename}'
-        etree.write(new_filename)
+    # Only the speech itself is analysed, not the ids, types and other structural elements around it.
+    text_tags = {'ComponentText'}
+
+    def clean_text(self, text):
+        """Returns the stripped text with any names replaced, or the text exactly as it was if there weren't any (or
+        there's no text)."""
+        if not text or not text.strip():
+            return text
+        stripped_text = text.strip()
+        results = self.analyzer_engine.analyze(correlation_id=0,
+                                               text=stripped_text,
+                                               entities=[],
+                                               language='en',
+                                               score_threshold=0.5)
+        if results:
+            return run_anonymizer(self.anonymizer_engine, stripped_text, results)
+        return text
+
+    @staticmethod
+    def get_local_name(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    @staticmethod
+    def get_root_tags(root, namespaces):
+        """The root's start and end tags. ElementTree writes them itself, so namespaced names come out with prefixes
+        rather than as {uri}name; every namespace the file declared on the root is declared again, used or not."""
+        marker = '\ue000'
+        shell = ET.Element(root.tag, root.attrib)
+        shell.text = marker
+        start_tag, end_tag = ET.tostring(shell, encoding='unicode',
+                                         default_namespace=namespaces.get('')).split(marker)
+        declarations = ''.join(f' xmlns:{prefix}={quoteattr(uri)}' for prefix, uri in namespaces.items()
+                               if prefix and f' xmlns:{prefix}=' not in start_tag)
+        return f'{start_tag[:-1]}{declarations}>', end_tag
+
+    @staticmethod
+    def read_root(context):
+        """Reads up to the root element, returning it with the namespaces declared on it ({prefix: uri}). Their
+        prefixes are registered, so the components are written out with the same ones."""
+        namespaces = {}
+        for event, item in context:
+            if event == 'start':
+                return item, namespaces
+            prefix, uri = item
+            namespaces[prefix] = uri
+            if prefix and not re.match(r'ns\d+$', prefix):
+                ET.register_namespace(prefix, uri)
+
+    def run(self, xml_filename, new_filename=None):
+        """Streams the file through iterparse: each top-level component has its text cleaned and is written out as soon
+        as it has been read, then dropped, so only one component is held in memory at a time."""
+        if new_filename is None:
+            directory, base_filename = os.path.split(xml_filename)
+            new_filename = os.path.join(directory, f'out-{base_filename}')
+
+        context = ET.iterparse(xml_filename, events=('start-ns', 'start', 'end'))
+        root, namespaces = self.read_root(context)
+        start_tag, end_tag = self.get_root_tags(root, namespaces)
+        depth = 1
+        with open(new_filename, 'w', encoding='utf-8') as new_file:
+            new_file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+            new_file.write(start_tag)
+            new_file.write(escape(root.text or ''))
+            for event, elem in context:
+                if event == 'start-ns':
+                    continue
+                if event == 'start':
+                    depth += 1
+                    continue
+                depth -= 1
+                if self.get_local_name(elem.tag) in self.text_tags:
+                    elem.text = self.clean_text(elem.text)
+                if depth == 1:
+                    new_file.write(ET.tostring(elem, encoding='unicode', default_namespace=namespaces.get('')))
+                    root.clear()
+            new_file.write(f'{end_tag}\n')
         return new_filename
 
 
+# Each worker process keeps one cleaner, so the spaCy model is loaded once per worker rather than once per file.
+worker_cleaner = None
+
+
+def initialize_worker():
+    global worker_cleaner
+    worker_cleaner = HansardCleaner()
+    worker_cleaner.initialize()
+
+
+def clean_file_in_worker(xml_filename, new_filename):
+    return worker_cleaner.run(xml_filename, new_filename)
+
+
+def clean_directory(input_dir, output_dir=None, max_workers=None):
+    """Cleans every plenary XML file in input_dir over a pool of max_workers processes (one per core by default),
+    writing each to output_dir (input_dir by default) as out-<name>. Yields the new filenames as they are finished."""
+    output_dir = output_dir or input_dir
+    os.makedirs(output_dir, exist_ok=True)
+    xml_filenames = sorted(f for f in os.listdir(input_dir) if f.endswith('.xml') and not f.startswith('out-'))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initialize_worker) as executor:
+        futures = [executor.submit(clean_file_in_worker, os.path.join(input_dir, xml_filename),
+                                   os.path.join(output_dir, f'out-{xml_filename}'))
+                   for xml_filename in xml_filenames]
+        for future in as_completed(futures):
+            yield future.result()
+
+
 class HansardTextExtractor:
-    def run(self, xml_filename):
-        etree = ET.parse(xml_filename)
-
-        proceedings_plaintext = ''
-
-        for component in etree.getroot():
-            if component.tag == 'HansardComponent':
-                component_type_node = component.find('ComponentType')
-                component_text_node = component.find('ComponentText')
-                if component_text_node.text and component_type_node.text:
-                    if component_type_node.text.strip() == 'Spoken Text':
-                        text = component_text_node.text.replace('\n', '')
-                        text = text.replace('<BR />', '\n')
-                        proceedings_plaintext += f'{text}\n\n----\n\n'
-                    elif component_type_node.text.strip() == 'Header':
-                        proceedings_plaintext += f'[{component_text_node.text.upper()}]\n\n'
-
-        text_filename = xml_filename.replace('.xml', '.txt')
+    """Writes the spoken text and headers of a sitting out as the .txt format processor.py reads. Components are
+    streamed from iterparse straight to the file, so time is linear and memory flat in the length of the sitting."""
+
+    @staticmethod
+    def find_child(component, local_name):
+        """Like component.find(local_name), whatever namespace the file (and so the cleaner's output) puts it in."""
+        return next((child for child in component if HansardCleaner.get_local_name(child.tag) == local_name), None)
+
+    @classmethod
+    def format_component(cls, component):
+        component_type_node = cls.find_child(component, 'ComponentType')
+        component_text_node = cls.find_child(component, 'ComponentText')
+        if component_type_node is None or component_text_node is None:
+            return None
+        if component_text_node.text and component_type_node.text:
+            if component_type_node.text.strip() == 'Spoken Text':
+                text = component_text_node.text.replace('\n', '')
+                text = text.replace('<BR />', '\n')
+                return f'{text}\n\n----\n\n'
+            elif component_type_node.text.strip() == 'Header':
+                return f'[{component_text_node.text.upper()}]\n\n'
+
+    def write_components(self, xml_filename, text_file):
+        context = ET.iterparse(xml_filename, events=('start', 'end'))
+        _, root = next(context)
+        for event, component in context:
+            if event == 'end' and HansardCleaner.get_local_name(component.tag) == 'HansardComponent':
+                formatted_component = self.format_component(component)
+                if formatted_component:
+                    text_file.write(formatted_component)
+                root.clear()
+
+    def run(self, xml_filename, text_filename=None):
+        text_filename = text_filename or xml_filename.replace('.xml', '.txt')
+        with open(text_filename, 'w') as text_file:
+            self.write_components(xml_filename, text_file)
+        return text_filename
+
+    def run_all(self, xml_filenames, text_filename=None):
+        """Converts many files in one go (xml_filenames can be any iterable, e.g. clean_directory as it goes): each to
+        its own .txt, or, given text_filename, all into that one file in the order given. Returns the files written."""
+        if text_filename is None:
+            return [self.run(xml_filename) for xml_filename in xml_filenames]
         with open(text_filename, 'w') as text_file:
-            text_file.write(proceedings_plaintext)
+            for xml_filename in xml_filenames:
+                self.write_components(xml_filename, text_file)
+        return [text_filename]
 
 
 if __name__ == "__main__":
     try:
         filename = sys.argv[1]
-    except KeyError as e:
-        print("Hansard Cleaner takes one argument, the XML file to be cleaned.")
+    except IndexError as e:
+        print("Hansard Cleaner takes the XML file to be cleaned, or a directory of them (optionally followed by an "
+              "output directory).")
         raise e
 
-    cleaner = HansardCleaner()
-    cleaner.initialize()
-    cleaner.run(filename)
-    filename = cleaner.run(filename)
     extractor = HansardTextExtractor()
-    extractor.run(filename)
+    if os.path.isdir(filename):
+        output_dir = sys.argv[2] if len(sys.argv) > 2 else None
+        text_filenames = extractor.run_all(clean_directory(filename, output_dir))
+        print(f"Cleaned and extracted {len(text_filenames)} files")
+    else:
+        cleaner = HansardCleaner()
+        cleaner.initialize()
+        filename = cleaner.run(filename)
+        extractor.run(filename)
@@ -9,6 +9,9 @@ misleading matches which we'd want to avoid.
 
 The matching process is not comprehensive - what if two MLAs of the same gender have the same surname AND initial? This 
 is yet to be accounted for.
+
+Each matching pass (title + surname, title + initial + surname, title + double-barrelled surname) is held as a
+name: PersonId index, so each distinct Hansard speaker string is resolved with a few dictionary lookups, once.
 """
 
 
@@ -31,15 +34,22 @@ class HansardToMemberConnector:
         self.unmatched_components_dict = {}
         self.current_unmatched_speech = {}
 
-    def get_speech_data(self):
+        self.speaker_indexes = []
+        self.resolved_speakers = {}
+
+        self.profile_parameter_creator = None
+
+    def get_speech_data(self, yield_last_speech=None):
         valid_xmls = build_hansard_corpus.XMLGenerator(self.start_date, self.end_date)
-        valid_xmls.run_for_all_dates()
-        corp = build_hansard_corpus.CorpusBuilder(valid_xmls.valid_xml_list)
+        # Days are parsed as they arrive rather than all being held in valid_xml_list first.
+        corp = build_hansard_corpus.CorpusBuilder(valid_xmls.iter_valid_xml(), yield_last_speech=yield_last_speech)
         self.all_speech = corp.create_speaker_text_dict()
         return self.all_speech
 
     def get_mla_data(self):
         ppc = mla_profiling.ProfileParameterCreator(self.start_date, self.end_date)
+        # Kept, so its request log can be checked afterwards.
+        self.profile_parameter_creator = ppc
         self.mla_profile_dicts = ppc.create_parameters_from_mla_data()
         return self.mla_profile_dicts
 
@@ -56,22 +66,36 @@ class HansardToMemberConnector:
         self.dupe_speakers = {k: v for k, v in speaker_name_dict.items() if k in duplicate_keys}
 
     def update_unmatched_components(self):
-        self.current_unmatched_speech = {k: v for k, v in self.current_unmatched_speech.items() if
+        self.current_unmatched_speech = {k: v for k, v in self.all_speech.items() if
                                          k not in self.matched_components_dict.keys()}
-        for d in self.current_unmatched_speech.items():
-            print(d)
 
-    def match_hansard_to_speaker(self, hansard_dict_item, speaker_dict):
-        component_id, speech_tup = hansard_dict_item
-        for speaker_id, speaker in speaker_dict.items():
-            if speech_tup.speaker == speaker:
-                self.matched_components_dict[component_id] = speaker_id
-                break
+    @staticmethod
+    def normalise_name(name):
+        return " ".join(name.split())
 
-    def title_surname_match(self):
-        for hansard_dict_item in self.all_speech.items():
-            self.match_hansard_to_speaker(hansard_dict_item, self.deduped_speakers)
-        self.update_unmatched_components()
+    def index_speaker_dict(self, speaker_dict):
+        """Inverts a PersonId: name dict. Where two members share a name the first one wins, as it always has."""
+        speaker_index = {}
+        for speaker_id, speaker in speaker_dict.items():
+            speaker_index.setdefault(self.normalise_name(speaker), speaker_id)
+        return speaker_index
+
+    def build_speaker_indexes(self):
+        # In the order the passes are tried.
+        self.speaker_indexes = [
+            self.index_speaker_dict(self.deduped_speakers),
+            self.index_speaker_dict(self.get_speakers_dict_as_title_initial_surname()),
+            self.index_speaker_dict(self.get_speakers_dict_as_dual_surname()),
+        ]
+
+    def resolve_speaker(self, speaker):
+        """Returns (pass number, PersonId) for the first pass that matches speaker, or None."""
+        if speaker not in self.resolved_speakers:
+            normalised_speaker = self.normalise_name(speaker)
+            self.resolved_speakers[speaker] = next(
+                ((n, speaker_index[normalised_speaker]) for n, speaker_index in enumerate(self.speaker_indexes)
+                 if normalised_speaker in speaker_index), None)
+        return self.resolved_speakers[speaker]
 
     def get_speakers_dict_as_title_initial_surname(self):
         initial_added_dict = {}
@@ -80,12 +104,6 @@ class HansardToMemberConnector:
             initial_added_dict[k] = new_v
         return initial_added_dict
 
-    def title_initial_surname_match(self):
-        initial_added_dict = self.get_speakers_dict_as_title_initial_surname()
-        for hansard_dict_item in self.current_unmatched_speech.items():
-            self.match_hansard_to_speaker(hansard_dict_item, initial_added_dict)
-        self.update_unmatched_components()
-
     def get_speakers_dict_as_dual_surname(self):
         dual_surname_dict = {}
         for k, v in self.split_names_dict.items():
@@ -94,18 +112,19 @@ class HansardToMemberConnector:
                 dual_surname_dict[k] = new_v
         return dual_surname_dict
 
-    def dual_surname_match(self):
-        dual_surname_dict = self.get_speakers_dict_as_dual_surname()
-        for hansard_dict_item in self.current_unmatched_speech.items():
-            self.match_hansard_to_speaker(hansard_dict_item, dual_surname_dict)
-        self.update_unmatched_components()
-
     def run_all_matching(self):
         self.split_duplicate_names_to_separate_dict()
-        self.current_unmatched_speech = self.all_speech
-        self.title_surname_match()
-        self.title_initial_surname_match()
-        self.dual_surname_match()
+        self.build_speaker_indexes()
+        matches_by_pass = [[] for _ in self.speaker_indexes]
+        for component_id, speech_tup in self.all_speech.items():
+            resolved = self.resolve_speaker(speech_tup.speaker)
+            if resolved:
+                match_pass, speaker_id = resolved
+                matches_by_pass[match_pass].append((component_id, speaker_id))
+        # Matches are stored pass by pass, which keeps the order the passes used to produce.
+        for matches in matches_by_pass:
+            self.matched_components_dict.update(matches)
+        self.update_unmatched_components()
 
     def unify_data(self):
         combined_data_dict = {}
@@ -0,0 +1,74 @@
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+import benchmark
+import profile_analysis
+import speaker_to_profile
+from conftest import FakeNLP
+
+
+def testing_importing_processor_loads_no_heavy_modules():
+    results = benchmark.run_startup_benchmark(repeat=1)
+
+    assert results["import"]["heavy_modules_loaded"] == []
+    assert results["import"]["import_seconds"]["min"] > 0
+    assert results["first_analysis"] is None
+
+
+def testing_each_first_analysis_starts_from_an_empty_cache(tmp_path):
+    cache_dirs = []
+
+    def fake_run(script, env=None):
+        if env is None:
+            return {"import_seconds": 0.1, "heavy_modules_loaded": [], "wall_seconds": 0.5}
+        assert "run_default_analysis" in script and "2021-02-01" in script
+        assert os.listdir(env["NIA_CACHE_DIR"]) == []
+        cache_dirs.append(env["NIA_CACHE_DIR"])
+        return {"import_seconds": 0.1, "analysis_seconds": 1.0, "wall_seconds": 1.5}
+
+    with mock.patch.object(benchmark, "run_in_fresh_interpreter", fake_run):
+        results = benchmark.run_startup_benchmark(repeat=3, fixtures_dir=str(tmp_path), start_date="2021-02-01",
+                                                  end_date="2021-02-08")
+
+    assert results["first_analysis"]["analysis_seconds"]["median"] == 1.0
+    assert len(set(cache_dirs)) == 3
+    assert not any(os.path.exists(cache_dir) for cache_dir in cache_dirs)
+
+
+def testing_synthetic_corpus_is_repeatable():
+    corpus = benchmark.SyntheticCorpus(days=2, speeches_per_day=30, members=40, seed=4)
+
+    assert corpus.get_hansard_xml(1) == benchmark.SyntheticCorpus(days=2, speeches_per_day=30, members=40,
+                                                                  seed=4).get_hansard_xml(1)
+    assert corpus.get_hansard_xml(0) != corpus.get_hansard_xml(1)
+    assert corpus.get_dates() == ["2021-02-01", "2021-02-02"] and corpus.get_end_date() == "2021-02-03"
+
+
+def testing_every_synthetic_speaker_is_matched_to_their_own_member():
+    for seed in (0, 1):
+        corpus = benchmark.SyntheticCorpus(seed=seed)
+        connector = speaker_to_profile.HansardToMemberConnector(corpus.start_date, corpus.get_end_date())
+        connector.mla_profile_dicts = {member.person_id: SimpleNamespace(name=member.display_name)
+                                       for member in corpus.members}
+        connector.all_speech = {member.person_id: SimpleNamespace(speaker=member.hansard_name)
+                                for member in corpus.members}
+        connector.run_all_matching()
+
+        assert len({member.hansard_name for member in corpus.members}) == 90
+        assert connector.matched_components_dict == {member.person_id: member.person_id for member in corpus.members}
+
+
+def testing_every_pipeline_stage_is_timed_and_traced(tmp_path):
+    corpus = benchmark.SyntheticCorpus(days=3, speeches_per_day=20, members=12)
+    with mock.patch.object(profile_analysis.AnalyticsCreator, "shared_nlp", FakeNLP()):
+        results = benchmark.run_pipeline_benchmark(corpus, repeat=1, fixtures_dir=str(tmp_path))
+
+    # Every synthetic speech is by a member, so all of them are matched.
+    assert results["counts"] == {"days": 3, "members": 12, "speeches": 60, "matched_speeches": 60}
+    assert list(results["stages"]) == benchmark.PipelineBenchmark.stages
+    for stage in results["stages"].values():
+        assert stage["seconds"]["min"] >= 0
+        assert stage["peak_bytes"] >= stage["retained_bytes"] >= 0
+    assert results["stages"]["fetch-hansard"]["peak_bytes"] > 0
+    assert results["corpus"]["xml_bytes"] > 0
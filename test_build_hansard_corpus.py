@@ -0,0 +1,169 @@
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+import build_hansard_corpus
+from conftest import FakeResponse
+
+
+def fake_hansard_get(session, url, **kwargs):
+    date_ = url.split("=")[-1]
+    time.sleep(random.random() / 50)
+    return FakeResponse(f"<ArrayOfHansardComponent><HansardComponent><ComponentId>{date_}</ComponentId>"
+                        f"<ComponentType>Spoken Text</ComponentType><ComponentText>Text</ComponentText>"
+                        f"</HansardComponent></ArrayOfHansardComponent>")
+
+
+SITTING_XML = """<ArrayOfHansardComponent>
+<HansardComponent><ComponentId>1</ComponentId><ComponentType>Speaker (MlaName)</ComponentType>
+<ComponentText>Mr Allister:</ComponentText></HansardComponent>
+<HansardComponent><ComponentId>2</ComponentId><ComponentType>Spoken Text</ComponentType>
+<ComponentText>I beg to move the amendment.</ComponentText></HansardComponent>
+<HansardComponent><ComponentId>3</ComponentId><ComponentType>Procedure Line</ComponentType>
+<ComponentText>[Interruption.]</ComponentText></HansardComponent>
+<HansardComponent><ComponentId>4</ComponentId><ComponentType>Speaker (MlaName)</ComponentType>
+<ComponentText>Ms Bradshaw (The Minister):</ComponentText></HansardComponent>
+<HansardComponent><ComponentId>5</ComponentId><ComponentType>Spoken Text</ComponentType>
+<ComponentText>I thank the Member.</ComponentText></HansardComponent>
+<HansardComponent><ComponentId>6</ComponentId><ComponentType>Speaker (MlaName)</ComponentType>
+<ComponentText>Mr Speaker:</ComponentText></HansardComponent>
+</ArrayOfHansardComponent>"""
+
+
+@pytest.fixture(autouse=True)
+def response_cache_dir(tmp_path):
+    with mock.patch.object(build_hansard_corpus.ResponseCache, "cache_dir", str(tmp_path)):
+        yield tmp_path
+
+
+def testing_concurrent_puts_of_each_dated_url_are_kept(tmp_path):
+    response_cache = build_hansard_corpus.ResponseCache(str(tmp_path / "cache"))
+    contact_url = "http://api/members.asmx/GetAllMemberContactDetails?"
+    assert response_cache.split_url(contact_url + "2021-02-01") == ("members.asmx/GetAllMemberContactDetails",
+                                                                     "2021-02-01")
+
+    urls = [contact_url + f"2021-02-{day:02}" for day in range(1, 5)] * 50
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda url: response_cache.put(url, url.encode()), urls))
+
+    assert [response_cache.get(url) for url in urls[:4]] == [url.encode() for url in urls[:4]]
+    assert not [f for f in os.listdir(os.path.dirname(response_cache.get_path(urls[0]))) if f.endswith(".tmp")]
+
+
+def testing_concurrent_fetch_keeps_date_order():
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", fake_hansard_get), mock.patch("builtins.print"):
+        xml_generator = build_hansard_corpus.XMLGenerator("2021-01-01", "2021-01-21", max_workers=8)
+        xml_generator.run_for_all_dates()
+
+    component_ids = [components[0].component_id for components in xml_generator.valid_xml_list]
+    assert component_ids == xml_generator.get_plenary_dates()
+
+
+def testing_validators_share_one_session():
+    validators = [build_hansard_corpus.HansardXMLValidator(), build_hansard_corpus.HansardXMLValidator(),
+                  build_hansard_corpus.XMLGenerator("2021-01-01", "2021-01-08")]
+    bigger_pool = build_hansard_corpus.XMLGenerator("2021-01-01", "2021-01-08", max_workers=32)
+
+    assert len({id(validator.session) for validator in validators}) == 1
+    assert bigger_pool.session is not validators[0].session
+    assert bigger_pool.session.get_adapter("http://").poolmanager.connection_pool_kw["maxsize"] == 32
+
+
+def testing_warm_rerun_is_served_from_cache():
+    fake_get = mock.Mock(side_effect=lambda url, **kwargs: fake_hansard_get(None, url))
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", fake_get), mock.patch("builtins.print"):
+        build_hansard_corpus.XMLGenerator("2021-01-01", "2021-01-08").run_for_all_dates()
+        assert fake_get.call_count == 5
+
+        xml_generator = build_hansard_corpus.XMLGenerator("2021-01-04", "2021-01-11")
+        xml_generator.run_for_all_dates()
+    # Only the weekday that wasn't in the first window goes to the API.
+    assert fake_get.call_count == 6
+    assert len(xml_generator.valid_xml_list) == 5
+
+
+def testing_transient_server_errors_are_retried():
+    responses = [FakeResponse("", status_code=503), FakeResponse("", status_code=502),
+                 fake_hansard_get(None, "plenaryDate=2021-01-01")]
+    fake_get = mock.Mock(side_effect=lambda url, **kwargs: responses.pop(0))
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", fake_get), mock.patch("builtins.print"), \
+            mock.patch.object(build_hansard_corpus.time, "sleep") as fake_sleep:
+        xml_generator = build_hansard_corpus.XMLGenerator("2021-01-01", "2021-01-02")
+        xml_generator.run_for_all_dates()
+
+    assert len(xml_generator.valid_xml_list) == 1
+    assert [call.args[0] for call in fake_sleep.call_args_list] == [0.5, 1.0]
+    assert xml_generator.get_request_summary()["retries"] == 2
+
+
+def testing_streamed_and_parsed_components_build_the_same_corpus():
+    fake_get = mock.Mock(side_effect=lambda url, **kwargs: FakeResponse(SITTING_XML))
+    speech_dicts = []
+    for streaming in (True, False):
+        with mock.patch.object(build_hansard_corpus.requests.Session, "get", fake_get), \
+                mock.patch.object(build_hansard_corpus.XMLGenerator, "streaming", streaming), \
+                mock.patch.object(build_hansard_corpus.XMLGenerator, "cache_responses", False), \
+                mock.patch("builtins.print"):
+            xml_generator = build_hansard_corpus.XMLGenerator("2021-02-01", "2021-02-02")
+            corpus_builder = build_hansard_corpus.CorpusBuilder(xml_generator.iter_valid_xml())
+            speech_dicts.append(corpus_builder.create_speaker_text_dict())
+
+    assert speech_dicts[0] == speech_dicts[1]
+    assert speech_dicts[0]["4"] == ("Mr Allister", "I beg to move the amendment.", "[Interruption.]")
+
+
+def testing_sitting_calendar_skips_days_without_a_sitting():
+    def fake_get_mondays_only(url, **kwargs):
+        if build_hansard_corpus.datetime.strptime(url.split("=")[-1], "%Y-%m-%d").weekday() == 0:
+            return FakeResponse(SITTING_XML)
+        return FakeResponse("<ArrayOfHansardComponent />")
+
+    fake_get = mock.Mock(side_effect=fake_get_mondays_only)
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", fake_get), \
+            mock.patch.object(build_hansard_corpus.XMLGenerator, "cache_responses", False), \
+            mock.patch("builtins.print"):
+        build_hansard_corpus.XMLGenerator("2021-03-01", "2021-03-15").run_for_all_dates()
+        assert fake_get.call_count == 10
+
+        xml_generator = build_hansard_corpus.XMLGenerator("2021-03-01", "2021-03-15")
+        xml_generator.run_for_all_dates()
+    assert fake_get.call_count == 12
+    assert len(xml_generator.valid_xml_list) == 2
+
+
+def testing_per_day_calendars_saved_at_once_keep_every_day(response_cache_dir):
+    calendar_path = response_cache_dir / "sitting_calendar.json"
+    calendar_path.write_text('{"2021-03-0')
+
+    def fetch_day(day):
+        day_generator = build_hansard_corpus.XMLGenerator(f"2021-03-{day:02}", f"2021-03-{day + 1:02}")
+        return list(day_generator.iter_valid_xml())
+
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", fake_hansard_get), \
+            mock.patch.object(build_hansard_corpus.XMLGenerator, "cache_responses", False), \
+            mock.patch("builtins.print"):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(fetch_day, [day for day in range(1, 27) if day % 7 not in (6, 0)] * 3))
+
+    # The unreadable calendar was started again, and no day's sitting was lost to another's save.
+    sittings = build_hansard_corpus.SittingCalendar(str(calendar_path)).sittings
+    assert sorted(sittings) == [f"2021-03-{day:02}" for day in range(1, 27) if day % 7 not in (6, 0)]
+    assert not [f for f in os.listdir(response_cache_dir) if f.endswith(".tmp")]
+
+
+def testing_last_speech_is_only_yielded_when_asked_for():
+    Fields = build_hansard_corpus.XMLGenerator.HansardComponentFields
+    day = [Fields("1", "Speaker (MlaName)", "Mr Allister:"), Fields("2", "Spoken Text", "I beg to move."),
+           Fields("3", "Speaker (MlaName)", "Ms Bradshaw:"), Fields("4", "Spoken Text", "I thank the Member.")]
+
+    assert build_hansard_corpus.CorpusBuilder([day]).create_speaker_text_dict() == {
+        "3": ("Mr Allister", "I beg to move.", None)}
+    assert build_hansard_corpus.CorpusBuilder([day], yield_last_speech=True).create_speaker_text_dict() == {
+        "3": ("Mr Allister", "I beg to move.", None), "4": ("Ms Bradshaw", "I thank the Member.", None)}
+    # A speaker with nothing said after them isn't a speech.
+    assert build_hansard_corpus.CorpusBuilder([day[:3]], yield_last_speech=True).create_speaker_text_dict() == {
+        "3": ("Mr Allister", "I beg to move.", None)}
@@ -0,0 +1,173 @@
+import os
+import xml.etree.ElementTree as ET
+from unittest import mock
+
+from sample_transcripts import hansard_prepper
+
+PLENARY_XML = """<?xml version="1.0" encoding="utf-8"?>
+<ArrayOfHansardComponent>
+  <HansardComponent><ComponentId>1</ComponentId><ComponentType>Speaker (MlaName)</ComponentType>
+    <ComponentText>Mr Allister:</ComponentText></HansardComponent>
+  <HansardComponent><ComponentId>2</ComponentId><ComponentType>Spoken Text</ComponentType>
+    <ComponentText>Mr Allister &amp; I beg to move.&lt;BR /&gt;Thank you.</ComponentText></HansardComponent>
+  <HansardComponent><ComponentId>3</ComponentId><ComponentType>Header</ComponentType>
+    <ComponentText /></HansardComponent>
+</ArrayOfHansardComponent>
+"""
+
+NAMESPACED_XML = """<?xml version="1.0" encoding="utf-8"?>
+<ArrayOfHansardComponent xmlns="http://data.niassembly.gov.uk/"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">a &amp; b
+  <HansardComponent><ComponentId>1</ComponentId><ComponentType xsi:nil="true" />
+    <ComponentText>Mr Allister spoke.</ComponentText></HansardComponent>
+</ArrayOfHansardComponent>
+"""
+
+
+def fake_clean_text(self, text):
+    return text.replace("Allister", "[GDPRREDACT]") if text else text
+
+
+def get_component_texts(root):
+    return [element.text for element in root.iter() if hansard_prepper.HansardCleaner.get_local_name(element.tag) ==
+            "ComponentText"]
+
+
+def testing_cleaned_file_is_the_same_xml_with_names_replaced(tmp_path):
+    xml_path = tmp_path / "plenary.xml"
+    xml_path.write_text(PLENARY_XML, encoding="utf-8")
+    with mock.patch.object(hansard_prepper.HansardCleaner, "clean_text", fake_clean_text):
+        cleaned_path = hansard_prepper.HansardCleaner().run(str(xml_path))
+
+    assert cleaned_path == str(tmp_path / "out-plenary.xml")
+    original, cleaned = ET.parse(xml_path).getroot(), ET.parse(cleaned_path).getroot()
+    assert [element.tag for element in cleaned.iter()] == [element.tag for element in original.iter()]
+    assert get_component_texts(cleaned) == ["Mr [GDPRREDACT]:", "Mr [GDPRREDACT] & I beg to move.<BR />Thank you.",
+                                            None]
+
+
+def testing_namespaces_are_kept_when_cleaning(tmp_path):
+    xml_path = tmp_path / "plenary.xml"
+    xml_path.write_text(NAMESPACED_XML, encoding="utf-8")
+    with mock.patch.object(hansard_prepper.HansardCleaner, "clean_text", fake_clean_text):
+        cleaned_path = hansard_prepper.HansardCleaner().run(str(xml_path), str(tmp_path / "cleaned.xml"))
+
+    cleaned = ET.parse(cleaned_path).getroot()
+    assert cleaned.tag == "{http://data.niassembly.gov.uk/}ArrayOfHansardComponent"
+    assert cleaned.text.startswith("a & b")
+    assert get_component_texts(cleaned) == ["Mr [GDPRREDACT] spoke."]
+    component_type = cleaned.find("{http://data.niassembly.gov.uk/}HansardComponent/"
+                                  "{http://data.niassembly.gov.uk/}ComponentType")
+    assert component_type.get("{http://www.w3.org/2001/XMLSchema-instance}nil") == "true"
+    with open(cleaned_path, encoding="utf-8") as cleaned_file:
+        assert 'xmlns:xsd="http://www.w3.org/2001/XMLSchema"' in cleaned_file.read()
+
+
+def testing_only_texts_with_names_in_are_rewritten():
+    cleaner = hansard_prepper.HansardCleaner()
+    cleaner.analyzer_engine = mock.Mock()
+    cleaner.analyzer_engine.analyze.side_effect = lambda text, **kwargs: ["PERSON"] if "Allister" in text else []
+    cleaner.anonymizer_engine = mock.Mock()
+    with mock.patch.object(hansard_prepper, "run_anonymizer",
+                           side_effect=lambda engine, text, results: text.replace("Allister", "[GDPRREDACT]")):
+        assert cleaner.clean_text("\n    I beg to move.  ") == "\n    I beg to move.  "
+        assert cleaner.clean_text("\n    Mr Allister spoke.  ") == "Mr [GDPRREDACT] spoke."
+        assert cleaner.clean_text("  ") == "  " and cleaner.clean_text(None) is None
+    assert [call.kwargs["text"] for call in cleaner.analyzer_engine.analyze.call_args_list] == \
+        ["I beg to move.", "Mr Allister spoke."]
+
+
+def testing_directory_is_cleaned_over_a_process_pool(tmp_path):
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    input_dir.mkdir()
+    for n in range(3):
+        (input_dir / f"plenary-{n}.xml").write_text(PLENARY_XML, encoding="utf-8")
+    (input_dir / "notes.txt").write_text("not a sitting")
+
+    # Worker processes are forked, so they get the stubbed cleaner too.
+    with mock.patch.object(hansard_prepper.HansardCleaner, "initialize"), \
+            mock.patch.object(hansard_prepper.HansardCleaner, "clean_text", fake_clean_text):
+        cleaned_paths = list(hansard_prepper.clean_directory(str(input_dir), str(output_dir), max_workers=2))
+
+    assert sorted(os.path.basename(path) for path in cleaned_paths) == [f"out-plenary-{n}.xml" for n in range(3)]
+    for path in cleaned_paths:
+        assert get_component_texts(ET.parse(path).getroot())[0] == "Mr [GDPRREDACT]:"
+
+
+def extract_text_in_one_go(xml_filename):
+    """How HansardTextExtractor built the whole text before it streamed, to check the output hasn't changed."""
+    proceedings_plaintext = ''
+    for component in ET.parse(xml_filename).getroot():
+        if component.tag == 'HansardComponent':
+            component_type_node = component.find('ComponentType')
+            component_text_node = component.find('ComponentText')
+            if component_text_node.text and component_type_node.text:
+                if component_type_node.text.strip() == 'Spoken Text':
+                    text = component_text_node.text.replace('\n', '')
+                    text = text.replace('<BR />', '\n')
+                    proceedings_plaintext += f'{text}\n\n----\n\n'
+                elif component_type_node.text.strip() == 'Header':
+                    proceedings_plaintext += f'[{component_text_node.text.upper()}]\n\n'
+    return proceedings_plaintext
+
+
+EXTRACTOR_XML = """<?xml version="1.0" encoding="utf-8"?>
+<ArrayOfHansardComponent>
+  <HansardComponent><ComponentType>Header</ComponentType><ComponentText>Assembly Business</ComponentText>
+  </HansardComponent>
+  <HansardComponent><ComponentType>Speaker (MlaName)</ComponentType><ComponentText>Mr Speaker:</ComponentText>
+  </HansardComponent>
+  <HansardComponent><ComponentType> Spoken Text </ComponentType><ComponentText>Order.
+Members, please.&lt;BR /&gt;Thank you.</ComponentText></HansardComponent>
+  <HansardComponent><ComponentType /><ComponentText>No type.</ComponentText></HansardComponent>
+  <HansardComponent><ComponentType>Spoken Text</ComponentType><ComponentText /></HansardComponent>
+  <HansardComponent><ComponentType>Header</ComponentType><ComponentText>Oral Answers</ComponentText>
+  </HansardComponent>
+</ArrayOfHansardComponent>
+"""
+
+
+def testing_streamed_text_matches_the_text_built_in_one_go(tmp_path):
+    xml_path = tmp_path / "out-plenary.xml"
+    xml_path.write_text(EXTRACTOR_XML, encoding="utf-8")
+
+    text_path = hansard_prepper.HansardTextExtractor().run(str(xml_path))
+
+    assert text_path == str(tmp_path / "out-plenary.txt")
+    with open(text_path) as text_file:
+        streamed_text = text_file.read()
+    assert streamed_text == extract_text_in_one_go(str(xml_path))
+    assert streamed_text == ("[ASSEMBLY BUSINESS]\n\nOrder.Members, please.\nThank you.\n\n----\n\n"
+                             "[ORAL ANSWERS]\n\n")
+
+
+def testing_namespaced_files_are_extracted_once_cleaned(tmp_path):
+    xml_path = tmp_path / "plenary.xml"
+    xml_path.write_text(EXTRACTOR_XML.replace("<ArrayOfHansardComponent>", '<ArrayOfHansardComponent '
+                                              'xmlns="http://data.niassembly.gov.uk/" '
+                                              'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'),
+                        encoding="utf-8")
+    plain_xml_path = tmp_path / "plain.xml"
+    plain_xml_path.write_text(EXTRACTOR_XML, encoding="utf-8")
+    with mock.patch.object(hansard_prepper.HansardCleaner, "clean_text", fake_clean_text):
+        cleaned_path = hansard_prepper.HansardCleaner().run(str(xml_path))
+
+    text_path = hansard_prepper.HansardTextExtractor().run(cleaned_path)
+
+    with open(text_path) as text_file:
+        assert text_file.read() == extract_text_in_one_go(str(plain_xml_path)) != ""
+
+
+def testing_many_files_can_be_extracted_into_one(tmp_path):
+    xml_paths = [tmp_path / f"out-plenary-{n}.xml" for n in range(3)]
+    for n, xml_path in enumerate(xml_paths):
+        xml_path.write_text(EXTRACTOR_XML.replace("Assembly Business", f"Sitting {n}"), encoding="utf-8")
+
+    text_paths = hansard_prepper.HansardTextExtractor().run_all(map(str, xml_paths), str(tmp_path / "all.txt"))
+
+    assert text_paths == [str(tmp_path / "all.txt")]
+    with open(text_paths[0]) as text_file:
+        assert text_file.read() == "".join(extract_text_in_one_go(str(xml_path)) for xml_path in xml_paths)
+    assert not list(tmp_path.glob("out-plenary-*.txt"))
+    assert hansard_prepper.HansardTextExtractor().run_all(map(str, xml_paths)) == \
+        [str(xml_path).replace(".xml", ".txt") for xml_path in xml_paths]
@@ -0,0 +1,111 @@
+from unittest import mock
+
+import pytest
+
+import build_hansard_corpus
+import mla_profiling
+from conftest import FakeResponse
+
+# person_id: (first day as a member, first day no longer a member)
+MEMBERSHIP = {"1": ("2000-01-01", "2030-01-01"), "2": ("2000-01-01", "2014-05-12"),
+              "3": ("2014-05-12", "2030-01-01"), "4": ("2017-03-02", "2019-06-04")}
+
+
+def fake_members_get(url, **kwargs):
+    date_ = url.split("=")[-1]
+    members = "".join(f"<Member><PersonId>{person_id}</PersonId><MemberFullDisplayName>Mr A Member{person_id}"
+                      f"</MemberFullDisplayName><PartyName>Party</PartyName><ConstituencyName>Foyle"
+                      f"</ConstituencyName></Member>" for person_id, (start, end) in MEMBERSHIP.items()
+                      if start <= date_ < end)
+    return FakeResponse(f"<AllMembersList>{members}</AllMembersList>")
+
+
+@pytest.fixture
+def fake_members_api():
+    fake_get = mock.Mock(side_effect=fake_members_get)
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", fake_get), \
+            mock.patch.object(build_hansard_corpus.XMLGenerator, "cache_responses", False), \
+            mock.patch("builtins.print"):
+        yield fake_get
+
+
+def testing_membership_timeline_bisects_to_each_change(fake_members_api):
+    profiler = mla_profiling.MLAProfiler("2011-01-01", "2021-01-01")
+    profiler.get_all_profiles_for_date_range()
+
+    assert profiler.membership_intervals == {
+        "1": [("2011-01-01", "2021-01-01")],
+        "2": [("2011-01-01", "2014-05-12")],
+        "3": [("2014-05-12", "2021-01-01")],
+        "4": [("2017-03-02", "2019-06-04")],
+    }
+    assert fake_members_api.call_count < 100
+    assert list(profiler.current_member_ids.keys()) == ["1", "2", "3", "4"]
+
+
+def testing_failed_member_lists_are_not_taken_as_nobody_being_a_member(fake_members_api):
+    def fake_members_get_failing(url, **kwargs):
+        # A sample date, and any date bisection might land on around member 4 joining
+        if url.endswith("2011-03-02") or "2017-02" in url or "2017-03-0" in url:
+            raise build_hansard_corpus.requests.ConnectionError("no route to host")
+        return fake_members_get(url, **kwargs)
+
+    fake_members_api.side_effect = fake_members_get_failing
+    with mock.patch.object(build_hansard_corpus.time, "sleep"):
+        profiler = mla_profiling.MLAProfiler("2011-01-01", "2021-01-01")
+        profiler.get_all_profiles_for_date_range()
+
+    # Member 4's start can't be pinned to the day, but nobody gets a false gap in their membership.
+    [(start, end)] = profiler.membership_intervals["4"]
+    assert "2017-03-02" < start < "2017-04-30" and end == "2019-06-04"
+    assert {person_id: intervals for person_id, intervals in profiler.membership_intervals.items()
+            if person_id != "4"} == {"1": [("2011-01-01", "2021-01-01")], "2": [("2011-01-01", "2014-05-12")],
+                                     "3": [("2014-05-12", "2021-01-01")]}
+
+
+def testing_membership_timeline_matches_daily_fetching(fake_members_api):
+    profiles = []
+    for use_membership_timeline in (True, False):
+        with mock.patch.object(mla_profiling.MLAProfiler, "use_membership_timeline", use_membership_timeline):
+            profiler = mla_profiling.MLAProfiler("2014-01-01", "2014-12-01")
+            profiler.create_named_tuples()
+            profiles.append(profiler.all_mla_profile_tuples)
+
+    assert profiles[0] == profiles[1]
+
+
+def testing_constituency_distances_are_looked_up_by_person_id():
+    contact_xml = """<AllMembersContactDetails>
+    <Member><PersonId>1</PersonId><AddressType>NIA Constituency Address</AddressType>
+    <Latitude>55.07</Latitude><Longitude>-6.51</Longitude></Member>
+    <Member><PersonId>1</PersonId><AddressType>NIA Constituency Address</AddressType>
+    <Latitude>54.35</Latitude><Longitude>-6.65</Longitude></Member>
+    <Member><PersonId>2</PersonId><AddressType>NIA Constituency Address</AddressType></Member>
+    <Member><PersonId>3</PersonId><AddressType>Assembly Address</AddressType>
+    <Latitude>54.99</Latitude><Longitude>-7.32</Longitude></Member>
+    </AllMembersContactDetails>"""
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", return_value=FakeResponse(contact_xml)), \
+            mock.patch.object(build_hansard_corpus.XMLGenerator, "cache_responses", False):
+        profile_creator = mla_profiling.ProfileParameterCreator("2021-01-01", "2021-01-02")
+        profile_creator.current_date = "2021-01-01"
+        profile_creator.find_constituency_locations()
+
+    distances = profile_creator.get_constituency_distances_from_stormont(["1", "2", "3", "4"])
+    # Haversine on a sphere is within half a percent of the geodesic distance (42.60 miles).
+    assert distances["1"] == pytest.approx(42.60, rel=0.005)
+    assert distances["2"] is distances["3"] is distances["4"] is None
+
+
+def testing_gender_detector_is_loaded_once():
+    profile_creator = mla_profiling.ProfileParameterCreator("2021-01-01", "2021-01-02")
+    with mock.patch.object(mla_profiling.ProfileParameterCreator, "gender_detector", None), \
+            mock.patch.object(mla_profiling.ProfileParameterCreator, "first_name_gender_cache", {}), \
+            mock.patch.object(mla_profiling.gender_detector, "Detector",
+                              wraps=mla_profiling.gender_detector.Detector) as detector:
+        genders = profile_creator.assign_genders(["Dr Caoimhe Archibald", "Mr Jim Allister", "Dr Steve Aiken",
+                                                  "Dr Steve Aiken", "Ms Clare Bailey", "Dr Kim Smith"])
+
+    # "Kim" is only mostly female, which doesn't count.
+    assert genders == {"Dr Caoimhe Archibald": "female", "Mr Jim Allister": "male", "Dr Steve Aiken": "male",
+                       "Ms Clare Bailey": "female", "Dr Kim Smith": None}
+    assert detector.call_count == 1
@@ -0,0 +1,44 @@
+from unittest import mock
+
+import new_hansard_prepper
+
+
+class FakeAnalyzerEngine:
+    def analyze(self, text, **kwargs):
+        return ["PERSON"] if "Mervyn" in text else []
+
+
+class FakeAnonymizerEngine:
+    def anonymize(self, text, results, config):
+        return text.replace("Mervyn", "[GDPRREDACT]")
+
+
+def create_formatter():
+    text_formatter = object.__new__(new_hansard_prepper.HansardTextFormatter)
+    text_formatter.analyzer_engine = FakeAnalyzerEngine()
+    text_formatter.anonymizer_engine = FakeAnonymizerEngine()
+    text_formatter.anonymizer_config = {}
+    return text_formatter
+
+
+def testing_speeches_without_names_come_back_unchanged():
+    text_formatter = create_formatter()
+
+    assert text_formatter.run_formatter("I thank the Member.<BR />Order.") == "I thank the Member.\nOrder."
+    assert text_formatter.run_formatter("I look at Mervyn.") == "I look at [GDPRREDACT]."
+    assert text_formatter.run_formatter(None) == ""
+
+
+def testing_each_distinct_speech_is_only_formatted_once(tmp_path):
+    text_formatter = create_formatter()
+    formatted_cache = new_hansard_prepper.profile_analysis.NLPResultCache("formatter==1", cache_dir=str(tmp_path))
+    texts = ["Mervyn spoke.", "Order.", "Mervyn spoke.", None]
+
+    with mock.patch.object(new_hansard_prepper.HansardTextFormatter, "shared_formatter", text_formatter), \
+            mock.patch.object(text_formatter, "run_formatter", wraps=text_formatter.run_formatter) as run_formatter:
+        service = new_hansard_prepper.AnonymizationService(formatted_cache=formatted_cache)
+        assert service.format_texts(texts) == ["[GDPRREDACT] spoke.", "Order.", "[GDPRREDACT] spoke.", ""]
+        assert run_formatter.call_count == 3
+
+        assert service.format_texts(texts[:2]) == ["[GDPRREDACT] spoke.", "Order."]
+        assert run_formatter.call_count == 3
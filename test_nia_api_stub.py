@@ -0,0 +1,68 @@
+from unittest import mock
+
+import pytest
+
+import build_hansard_corpus
+import nia_api_stub
+from conftest import FakeResponse
+
+SITTING_XML = """<ArrayOfHansardComponent>
+<HansardComponent><ComponentId>1</ComponentId><ComponentType>Speaker (MlaName)</ComponentType>
+<ComponentText>Mr Allister:</ComponentText></HansardComponent>
+<HansardComponent><ComponentId>2</ComponentId><ComponentType>Spoken Text</ComponentType>
+<ComponentText>I beg to move the amendment.</ComponentText></HansardComponent>
+</ArrayOfHansardComponent>"""
+
+MEMBERS_XML = """<AllMembersList><Member><PersonId>1</PersonId><MemberFullDisplayName>Mr Jim Allister</MemberFullDisplayName>
+<PartyName>Traditional Unionist Voice</PartyName><ConstituencyName>North Antrim</ConstituencyName></Member>
+</AllMembersList>"""
+
+CONTACT_XML = """<AllMembersContactDetails><Member><PersonId>1</PersonId>
+<AddressType>NIA Constituency Address</AddressType><Latitude>55.07</Latitude><Longitude>-6.51</Longitude></Member>
+</AllMembersContactDetails>"""
+
+
+def fake_live_api_get(url, **kwargs):
+    if "hansard.asmx" in url:
+        if url.endswith("2021-03-01"):
+            return FakeResponse(SITTING_XML)
+        return FakeResponse("<ArrayOfHansardComponent />")
+    if "GetAllMemberContactDetails" in url:
+        return FakeResponse(CONTACT_XML)
+    return FakeResponse(MEMBERS_XML)
+
+
+@pytest.fixture
+def fixtures_dir(tmp_path):
+    with mock.patch.object(build_hansard_corpus.requests.Session, "get", side_effect=fake_live_api_get), \
+            mock.patch.object(build_hansard_corpus.XMLGenerator, "cache_responses", False), \
+            mock.patch("builtins.print"):
+        nia_api_stub.record("2021-03-01", "2021-03-08", str(tmp_path))
+    return str(tmp_path)
+
+
+def run_against_stub(stub_server):
+    with mock.patch.object(build_hansard_corpus.XMLGenerator, "cache_responses", False), \
+            mock.patch.object(build_hansard_corpus.XMLGenerator, "use_sitting_calendar", False), \
+            mock.patch.object(build_hansard_corpus.time, "sleep"), mock.patch("builtins.print"):
+        xml_generator = build_hansard_corpus.XMLGenerator("2021-03-01", "2021-03-08", api_root=stub_server.api_root)
+        xml_generator.run_for_all_dates()
+    return xml_generator
+
+
+def testing_stub_replays_recorded_responses(fixtures_dir):
+    with nia_api_stub.StubServer(fixtures_dir) as stub_server:
+        xml_generator = run_against_stub(stub_server)
+        # Not recorded, but membership falls back to the closest earlier recording.
+        later_members = stub_server.lookup("/members.asmx/GetAllMembersByGivenDate?specificDate=2021-06-01")
+
+    assert [[c.component_id for c in day] for day in xml_generator.valid_xml_list] == [["1", "2"]]
+    assert b"Mr Jim Allister" in later_members
+
+
+def testing_stub_injected_errors_are_retried(fixtures_dir):
+    with nia_api_stub.StubServer(fixtures_dir, error_rate=0.3, seed=1) as stub_server:
+        xml_generator = run_against_stub(stub_server)
+
+    assert len(xml_generator.valid_xml_list) == 1
+    assert xml_generator.get_request_summary()["retries"] > 0
@@ -1,7 +1,8 @@
 import os
+import re
 import json
 from dask.threaded import get
-from processor import processor
+from processor import processor, city_finder, PlaceMatcher, CITIES
 import pytest
 from ltldoorstep.encoders import json_dumps
 
@@ -20,3 +21,63 @@ def testing_city_finder():
     # get the JSON output (python3 processor.py out...txt) and save it to tests/test_report.json
     # Then uncomment the line below - this will alert you if your processor output ever changes!
     # assert expected_report == compiled_report
+
+
+def find_occurrences_one_city_at_a_time(places, text):
+    return {place: [match.span() for match in re.finditer(re.escape(place), text)]
+            for place in places if text.count(place)}
+
+
+def testing_place_matcher_finds_overlapping_places_in_one_pass():
+    matcher = PlaceMatcher(CITIES)
+    assert matcher.find_occurrences('londonderry is not london or derry') == {
+        'derry': [(6, 11), (29, 34)], 'london': [(0, 6), (19, 25)]}
+
+    # Like str.count, one name's occurrences never overlap, but different names' can
+    places = ['anna', 'nan', 'a', 'bel', 'belfast', 'fast']
+    text = 'annanna went to belfastbelfast, bel, fast - banana!'
+    occurrences = PlaceMatcher(places).find_occurrences(text)
+    assert occurrences == find_occurrences_one_city_at_a_time(places, text)
+    assert list(occurrences) == [place for place in places if place in occurrences]
+
+
+def testing_gazetteer_places_are_found_as_whole_words(tmp_path):
+    gazetteer_path = tmp_path / 'places.csv'
+    gazetteer_path.write_text("name,kind\nLondonderry,city\nLough Neagh,region\nGiant's Causeway,region\n"
+                              "Newry,city\nNewtownabbey,town\nBelfast East,constituency\nAntrim,town\n"
+                              "County Antrim,county\nNewry and Armagh,constituency\n")
+    text = ("Belfast and Londonderry, not Newryville.\n\n"
+            "Lough\nNeagh and the Giant's Causeway, then back to Belfast.\n\n"
+            "Belfast East, Newry and Armagh, and County Antrim.")
+    report = city_finder(text, processor().make_report(), gazetteer_path=str(gazetteer_path)).compile()
+    issues = [issue for level in ('warnings', 'informations') for issue in report['tables'][0][level]]
+    messages = {issue['code']: [] for issue in issues}
+    for issue in issues:
+        messages[issue['code']].append(issue['message'])
+
+    # The CITIES totals are always there, other places only when found - and "derry" in
+    # "Londonderry" or "newry" in "Newryville" don't count
+    assert messages['city-totals'] == [f'Found {total} occurrences of {city.title()}' for city, total in
+                                       zip(CITIES, [0, 2, 0, 0, 0, 0, 0, 0])] + ['Found 1 occurrences of Londonderry']
+    assert messages['region-totals'] == ['Found 1 occurrences of Lough Neagh',
+                                         "Found 1 occurrences of Giant's Causeway"]
+    assert messages['region-cropped-up'] == ['Found lough neagh', 'Found giants causeway']
+    # Names inside a longer name (Belfast in Belfast East) only count as the longer one
+    assert messages['constituency-totals'] == ['Found 1 occurrences of Belfast East',
+                                               'Found 1 occurrences of Newry and Armagh']
+    assert messages['county-totals'] == ['Found 1 occurrences of County Antrim']
+    assert 'town-totals' not in messages
+    # Belfast still gets its warning
+    assert [issue['message'] for issue in report['tables'][0]['warnings']] == ['Found belfast'] * 2
+
+
+def testing_people_and_the_assembly_are_not_taken_for_places():
+    text = ("Mr Whitehead and Ms Moira Malone at Stormont, down by the waterside.\n\n"
+            "Then up the Malone Road and out to the Stormont Estate.")
+    report = city_finder(text, processor().make_report()).compile()
+    issues = [issue for level in ('warnings', 'informations') for issue in report['tables'][0][level]]
+
+    # Only the two qualified names are places; no town or other area is found
+    assert [(issue['code'], issue['message']) for issue in issues if issue['code'] != 'city-totals'] == [
+        ('area-cropped-up', 'Found malone road'), ('area-cropped-up', 'Found stormont estate'),
+        ('area-totals', 'Found 1 occurrences of Malone Road'), ('area-totals', 'Found 1 occurrences of Stormont Estate')]
@@ -0,0 +1,150 @@
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+import profile_analysis
+from conftest import FakeNLP
+
+SpeechRecord = namedtuple("SpeechRecord", ["hansard_text", "interjection"])
+
+
+def create_analytics_creator(texts, nlp_cache):
+    speeches = {str(i): SpeechRecord(text, None) for i, text in enumerate(texts)}
+    analytics_creator = profile_analysis.AnalyticsCreator(speeches, nlp_cache=nlp_cache)
+    analytics_creator.nlp = FakeNLP()
+    return analytics_creator
+
+
+def testing_analytics_are_added_as_columns():
+    table = profile_analysis.AnalyticsTable.from_named_tuples({"1": SpeechRecord("a b c", "[Interruption.]"),
+                                                               "2": SpeechRecord("", None)})
+    table.add_column("word_count", [3, 0])
+
+    assert table.fields == ("hansard_text", "interjection", "word_count")
+    assert table.as_named_tuples()["1"].word_count == 3
+    with pytest.raises(ValueError):
+        table.add_column("polarity", [0.1])
+
+
+def testing_only_unscored_speeches_go_to_nlp(tmp_path):
+    nlp_cache = profile_analysis.NLPResultCache("model==1", cache_dir=str(tmp_path))
+    first_run = create_analytics_creator(["Order.", "Thank you.", "Order."], nlp_cache)
+    assert first_run.get_sentiment_polarity() == [0.06, 0.1, 0.06]
+    assert first_run.nlp.texts_seen == ["Order.", "Thank you."]
+
+    second_run = create_analytics_creator(["Thank you.", "Question 2."], nlp_cache)
+    assert second_run.get_sentiment_subjectivity() == [1.0, 1.1]
+    assert second_run.nlp.texts_seen == ["Question 2."]
+
+    other_model = profile_analysis.NLPResultCache("model==2", cache_dir=str(tmp_path))
+    assert other_model.get_many([profile_analysis.NLPResultCache.hash_text("Order.")]) == {}
+
+
+def totalize_row_by_row(table, identifier, metric):
+    totals = {}
+    for group, value in zip(table.column(identifier), table.column(metric)):
+        totals[group] = totals.get(group, 0) + value
+    return totals
+
+
+def testing_grouped_totals_match_row_by_row_totals():
+    rng = random.Random(3)
+    row_count = 500
+    table = profile_analysis.AnalyticsTable([str(i) for i in range(row_count)], {
+        "gender": [rng.choice(["male", "female", None]) for _ in range(row_count)],
+        "party": [rng.choice(["DUP", "Sinn Féin", "SDLP", "Alliance", "UUP"]) for _ in range(row_count)],
+        "word_count": [rng.randint(0, 2000) for _ in range(row_count)],
+        "interruptions_count": [rng.randint(0, 1) for _ in range(row_count)],
+        "polarity": [rng.uniform(-1, 1) for _ in range(row_count)],
+    })
+    identifiers = ["gender", "party"]
+    metrics = ["word_count", "interruptions_count", "polarity"]
+
+    aggregator = profile_analysis.GroupedAggregator(table, identifiers, metrics)
+    sums = aggregator.aggregate()
+    for identifier in identifiers:
+        for metric in metrics:
+            expected = totalize_row_by_row(table, identifier, metric)
+            assert sums[identifier][metric] == expected
+            assert list(sums[identifier][metric]) == list(expected)
+    assert sum(aggregator.counts["party"].values()) == row_count
+
+    proportions = {identifier: {group: 1 / len(groups) for group in groups}
+                   for identifier, groups in aggregator.counts.items()}
+    disc_analytics = profile_analysis.DiscreteAnalyticsCreator(table, proportions)
+    disc_analytics.desired_identifiers = identifiers
+    disc_analytics.desired_metrics = metrics
+    output = disc_analytics.get_all_desired_metrics_for_all_desired_identifiers()
+
+    party_words = totalize_row_by_row(table, "party", "word_count")
+    total_words = sum(party_words.values())
+    assert output["party"]["word_count"] == {party: round((words / total_words - 0.2) * 100, 1)
+                                             for party, words in party_words.items()}
+    assert output["gender"]["polarity"] == {gender: polarity / row_count for gender, polarity in
+                                            totalize_row_by_row(table, "gender", "polarity").items()}
+
+
+def create_day_table(rng, row_count):
+    return profile_analysis.AnalyticsTable([str(i) for i in range(row_count)], {
+        "party": [rng.choice(["DUP", "Sinn Féin", "SDLP"]) for _ in range(row_count)],
+        "word_count": [rng.randint(0, 2000) for _ in range(row_count)],
+        "polarity": [rng.uniform(-1, 1) for _ in range(row_count)],
+    })
+
+
+def testing_merged_day_partials_match_the_whole_range(tmp_path):
+    rng = random.Random(5)
+    day_tables = [create_day_table(rng, row_count) for row_count in (40, 0, 25, 60)]
+    MemberParams = namedtuple("MemberParams", ["party", "name"])
+    day_members = [{"1": MemberParams("DUP", "A"), "2": MemberParams("SDLP", "B")},
+                   {"2": MemberParams("SDLP", "B")}, {}, {"3": MemberParams("Sinn Féin", "C")}]
+    day_partials = [profile_analysis.PartialAggregate.from_table(table, members, ["party"], ["polarity", "word_count"])
+                    for table, members in zip(day_tables, day_members)]
+
+    today = datetime.now().strftime("%Y-%m-%d")
+    store = profile_analysis.PartialAggregateStore(["party"], ["polarity", "word_count"], cache_dir=str(tmp_path))
+    store.put_many({"2021-02-01": day_partials[0], "2021-02-02": day_partials[1], today: day_partials[2]})
+    stored = store.get_many(["2021-02-01", "2021-02-02", today])
+    assert list(stored) == ["2021-02-01", "2021-02-02", today]
+    # Recent days might still be revised, so they're only reused for the ttl.
+    expired = profile_analysis.PartialAggregateStore(["party"], ["polarity", "word_count"], cache_dir=str(tmp_path),
+                                                     ttl=timedelta(0))
+    assert list(expired.get_many(["2021-02-01", "2021-02-02", today])) == ["2021-02-01", "2021-02-02"]
+    merged = profile_analysis.PartialAggregate.merge(stored["2021-02-01"], stored["2021-02-02"], *day_partials[2:])
+
+    whole_range = profile_analysis.AnalyticsTable(range(125), {
+        field: [value for table in day_tables for value in table.column(field)] for field in day_tables[0].fields})
+    aggregator = profile_analysis.GroupedAggregator(whole_range, ["party"], ["polarity", "word_count"])
+    aggregator.aggregate()
+
+    assert merged.speech_count == len(whole_range)
+    assert merged.counts == aggregator.counts
+    assert merged.sums["party"]["word_count"] == aggregator.sums["party"]["word_count"]
+    assert merged.sums["party"]["polarity"] == pytest.approx(aggregator.sums["party"]["polarity"])
+    assert list(merged.get_member_params()) == ["1", "2", "3"]
+
+    proportions = profile_analysis.ProportionCalculator(merged.get_member_params(), ["party"]).get_all_proportions()
+    from_partial = profile_analysis.DiscreteAnalyticsCreator(None, proportions, partial_aggregate=merged)
+    from_table = profile_analysis.DiscreteAnalyticsCreator(whole_range, proportions)
+    for disc_analytics in (from_partial, from_table):
+        disc_analytics.desired_identifiers = ["party"]
+        disc_analytics.desired_metrics = ["word_count", "polarity"]
+    partial_output = from_partial.get_all_desired_metrics_for_all_desired_identifiers()["party"]
+    table_output = from_table.get_all_desired_metrics_for_all_desired_identifiers()["party"]
+    assert partial_output["word_count"] == table_output["word_count"]
+    assert partial_output["polarity"] == pytest.approx(table_output["polarity"])
+
+
+def testing_tokenizer_counts_words_sentences_and_characters():
+    analytics_creator = profile_analysis.AnalyticsCreator({
+        "1": SpeechRecord("I beg to move.  The Minister's cross-border plan!<BR />Is it ready? Yes", None),
+        "2": SpeechRecord("Thank you, Mr Speaker.\nIt costs 2.5 million", None),
+        "3": SpeechRecord(None, "[Interruption.]"),
+    })
+    analytics_creator.add_word_count()
+
+    assert analytics_creator.table.column("word_count") == [12, 8, 0]
+    assert analytics_creator.get_sentence_count() == [4, 2, 0]
+    assert analytics_creator.get_character_count() == [65, 43, 0]
@@ -0,0 +1,88 @@
+from unittest import mock
+
+from dask.threaded import get
+
+import profile_processor
+from conftest import FakeResponse
+
+
+def testing_tree_reduce_keeps_order():
+    workflow = {f"part-{i}": str(i) for i in range(7)}
+    final_key = profile_processor.add_tree_reduce(workflow, [f"part-{i}" for i in range(7)],
+                                                  lambda *parts: "".join(parts), "joined")
+
+    assert get(workflow, final_key) == "0123456"
+    assert profile_processor.add_tree_reduce({}, ["only"], max, "joined") == "only"
+
+
+def testing_workflow_has_tasks_for_each_day_not_stored():
+    stored_day = profile_processor.PartialAggregate(["party"], ["word_count"])
+    with mock.patch.object(profile_processor.ProfileAnalyzer, "get_stored_partials",
+                           return_value={"2021-02-02": stored_day}), \
+            mock.patch.object(profile_processor.ProfileAnalyzer, "set_default", autospec=True,
+                              side_effect=lambda analyzer: analyzer.get_date_range("2021-02-01", "2021-02-04")):
+        workflow = profile_processor.CityFinderProcessor().get_workflow("transcript.txt")
+
+    assert {"members-2021-02-01", "hansard-2021-02-03", "partial-2021-02-03"} <= set(workflow)
+    assert workflow["members"][1:] == (["2021-02-01", "2021-02-03"],)
+    assert workflow["members-2021-02-01"][1:] == ("members", "2021-02-01")
+    assert "members-2021-02-02" not in workflow
+    assert workflow["partial-2021-02-02"] is stored_day
+    assert workflow["step-A"][-1] == "merge-partials-1-0"
+
+
+def fake_get(url, failing_url=""):
+    """Jim Allister is always a member; Steve Aiken joins on 2021-03-15. Any URL ending in failing_url fails."""
+    if failing_url and url.endswith(failing_url):
+        raise profile_processor.requests.ConnectionError("no route to host")
+    if "hansard.asmx" in url:
+        return FakeResponse("<ArrayOfHansardComponent />")
+    if "GetAllMemberContactDetails" in url:
+        return FakeResponse("<AllMembersContactDetails />")
+    members = "<Member><PersonId>1</PersonId><MemberFullDisplayName>Mr Jim Allister</MemberFullDisplayName></Member>"
+    if url.split("=")[-1] >= "2021-03-15":
+        members += "<Member><PersonId>2</PersonId><MemberFullDisplayName>Dr Steve Aiken</MemberFullDisplayName></Member>"
+    return FakeResponse(f"<AllMembersList>{members}</AllMembersList>")
+
+
+def run_incremental_analysis(tmp_path, start_date, end_date, failing_url=""):
+    profile_analyzer = profile_processor.ProfileAnalyzer()
+    profile_analyzer.get_date_range(start_date, end_date)
+    profile_analyzer.partial_store = profile_processor.PartialAggregateStore(
+        sorted(profile_processor.IDENTIFIERS), sorted(profile_processor.OUTPUT_ANALYTICS), cache_dir=str(tmp_path))
+    fake_session_get = mock.Mock(side_effect=lambda url, **kwargs: fake_get(url, failing_url))
+    with mock.patch.object(profile_processor.requests.Session, "get", fake_session_get), \
+            mock.patch.object(profile_processor.ResponseCache, "cache_dir", str(tmp_path)), \
+            mock.patch.object(profile_processor.time, "sleep"), mock.patch("builtins.print"):
+        day_partials = profile_analyzer.get_day_partials()
+    urls = [call.args[0] for call in fake_session_get.call_args_list]
+    return profile_analyzer, day_partials, urls
+
+
+def testing_members_are_fetched_once_for_every_day_not_stored(tmp_path):
+    profile_analyzer, day_partials, urls = run_incremental_analysis(tmp_path, "2021-02-01", "2021-06-01")
+
+    assert len(day_partials) == 120
+    # A handful of member lists pin down the one change in membership, and contact details are fetched once.
+    assert len([url for url in urls if "GetAllMembersByGivenDate" in url]) < 15
+    assert len([url for url in urls if "GetAllMemberContactDetails" in url]) == 1
+    # Each day only has those who were members on the day.
+    assert [sorted(day_partial.members) for day_partial in day_partials[41:44]] == [["1"], ["1", "2"], ["1", "2"]]
+
+
+def testing_days_with_failed_requests_are_not_stored(tmp_path):
+    # The first day's Hansard can't be fetched, so only it is left out of the store.
+    profile_analyzer, day_partials, _ = run_incremental_analysis(tmp_path, "2021-02-01", "2021-02-03",
+                                                                 failing_url="plenaryDate=2021-02-01")
+
+    assert [day_partial.speech_count for day_partial in day_partials] == [0, 0]
+    assert profile_analyzer.incomplete_days == {"2021-02-01"}
+    assert list(profile_analyzer.partial_store.get_many(["2021-02-01", "2021-02-02"])) == ["2021-02-02"]
+
+
+def testing_no_day_is_stored_if_the_members_could_not_be_fetched(tmp_path):
+    profile_analyzer, _, _ = run_incremental_analysis(tmp_path, "2021-02-01", "2021-02-04",
+                                                      failing_url="GetAllMemberContactDetails?2021-02-03")
+
+    assert profile_analyzer.incomplete_days == {"2021-02-01", "2021-02-02", "2021-02-03"}
+    assert profile_analyzer.partial_store.get_many(["2021-02-01", "2021-02-02", "2021-02-03"]) == {}
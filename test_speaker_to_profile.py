@@ -0,0 +1,24 @@
+from collections import namedtuple
+
+import speaker_to_profile
+
+SpeakerComponent = namedtuple("SpeakerComponent", ["speaker", "text", "interjection"])
+MLAParams = namedtuple("MLAParams", ["gender", "distance", "party", "constituency", "name"])
+
+
+def testing_speakers_are_matched_by_each_pass():
+    connector = speaker_to_profile.HansardToMemberConnector("2021-01-01", "2021-01-08")
+    connector.mla_profile_dicts = {
+        person_id: MLAParams(None, None, "Party", "Foyle", name) for person_id, name in
+        {"1": "Mr Jim Allister", "2": "Mr Gerry Kelly", "3": "Mr John Kelly", "4": "Ms Emma Sheerin Little"}.items()
+    }
+    connector.all_speech = {
+        component_id: SpeakerComponent(speaker, "Text", None) for component_id, speaker in
+        {"10": "Mr J Kelly", "11": "Mr Allister", "12": "Mr Kelly", "13": "Ms Sheerin Little",
+         "14": "Mr Nobody", "15": "Mr  Allister"}.items()
+    }
+    connector.run_all_matching()
+
+    assert connector.matched_components_dict == {"11": "1", "15": "1", "10": "3", "13": "4"}
+    assert list(connector.matched_components_dict.keys()) == ["11", "15", "10", "13"]
+    assert set(connector.current_unmatched_speech.keys()) == {"12", "14"}